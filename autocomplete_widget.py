@@ -1,14 +1,27 @@
 import tkinter as tk
 import typing
 
+from symbol_index import SymbolIndex
+
 # Want to display a list when the user starts typing in the entry widget
 
 # Inherits from entry widget
 class Autocomplete(tk.Entry):
-    def __init__(self, symbols: typing.List[str], *args, **kwargs):
+    def __init__(self, symbol_index: SymbolIndex, exchange: str, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        self._symbols = symbols
+        # Index shared with the other widgets, only the symbols of the exchange are proposed
+        self._symbol_index = symbol_index
+        self._exchange = exchange
+
+        # Maximum number of symbols inserted in the Listbox
+        self._max_matches = 100
+
+        # Previous query and the position of its prefix matches in the index, narrowed when the user keeps typing
+        self._last_query = ""
+        self._last_range = (0, 0)
+        self._last_version = -1
+        self._displayed: typing.List[str] = []
 
         self._lb: tk.Listbox
         self._lb_open = False
@@ -25,7 +38,10 @@ class Autocomplete(tk.Entry):
     # Open a Listbox when content in tk.Entry changes and obtain a list of symbols matching this content
     def _changed(self, var_name: str, index: str, mode:str):
 
-        self._var.set(self._var.get().upper())
+        # Setting the upper case text triggers this callback again, only do it when the text actually changes
+        if self._var.get() != self._var.get().upper():
+            self._var.set(self._var.get().upper())
+            return
 
         # When the user deletes everything from the widget, destroy the listbox and set boolean false
         if self._var.get() == "":
@@ -38,25 +54,50 @@ class Autocomplete(tk.Entry):
                 self._lb.place(x=self.winfo_x() + self.winfo_width(), y=self.winfo_y() + self.winfo_height() + 10)
 
                 self._lb_open = True
+                self._displayed = []
 
-            symbols_matched = [symbol for symbol in self._symbols if symbol.startswith(self._var.get())]
+            symbols_matched = self._match(self._var.get())
 
             # If there are matches found insert into the listbox
             if len(symbols_matched) > 0:
 
-                try:
-                    self._lb.delete(0, tk.END)
-                except tk.TclError:
-                    pass
+                # Only rebuild the listbox when its content changes
+                if symbols_matched != self._displayed:
+                    try:
+                        self._lb.delete(0, tk.END)
+                    except tk.TclError:
+                        pass
 
-                for symbol in symbols_matched:
-                    self._lb.insert(tk.END, symbol)
+                    self._lb.insert(tk.END, *symbols_matched)
+                    self._displayed = symbols_matched
 
             else:
                 if self._lb_open:
                     self._lb.destroy()
                     self._lb_open = False
 
+    # Symbols matching the query: prefix matches found with binary searches (restricted to the range of the previous
+    # query when the user is adding characters), completed by substring and fuzzy matches
+    def _match(self, query: str) -> typing.List[str]:
+        if self._last_version == self._symbol_index.version and query.startswith(self._last_query) \
+                and self._last_query != "":
+            lo, hi = self._last_range
+        else:
+            lo, hi = 0, None
+
+        self._last_range = self._symbol_index.prefix_range(query, lo, hi)
+        self._last_query = query
+        self._last_version = self._symbol_index.version
+
+        matches = self._symbol_index.prefix(query, self._exchange, self._max_matches,
+                                            self._last_range[0], self._last_range[1])
+
+        # Only the substring and fuzzy matches are searched for the remaining rows
+        if len(matches) < self._max_matches:
+            matches = self._symbol_index.search(query, self._exchange, self._max_matches, prefix_matches=matches)
+
+        return matches
+
 
     # Callee with Right arrow key is pressed to change the Listbox to the value in the drop down menu
     def _select(self, event: tk.Event):
@@ -12,16 +12,40 @@ import websocket
 import json
 
 import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from models import *
+import contract_cache
+from clock_sync import ClockSync
+from order_book import OrderBook
 
-from strategies import TechnicalStrategy, BreakoutStrategy
+from market_data import MarketDataHub
+from tick_recorder import TickRecorder
+from price_cache import PriceCache
+from strategy_registry import StrategyRegistry
 
 logger = logging.getLogger()
 
+# Websocket heartbeat: a ping is sent every WS_PING_INTERVAL seconds and the connection is closed if the pong does not
+# come back within WS_PING_TIMEOUT seconds, or if no message was received for WS_STALE_TIMEOUT seconds
+WS_PING_INTERVAL = 10
+WS_PING_TIMEOUT = 5
+WS_STALE_TIMEOUT = 15
+
+# Maximum delay (in seconds) between two reconnection attempts, the delay doubles after each failed attempt
+WS_MAX_RECONNECT_DELAY = 60
+
+# Seconds the requests that can wait are paused after the request rate limit is exceeded (HTTP 429, or 418 once the IP
+# is banned), when the answer has no Retry-After header
+RATE_LIMIT_BACKOFF = 60
+
 
 class BinanceFuturesClient:
-    def __init__(self, public_key: str, secret_key: str, testnet: bool):
+    # feed: client whose market data connection is shared. Each account (e.g. a sub-account) is a client with its own
+    # keys, balances, orders and strategies, and only the first one (the feed) opens the market data websocket: the
+    # prices, order books, candle series and clock of the feed are used by every account
+    def __init__(self, public_key: str, secret_key: str, testnet: bool,
+                 feed: typing.Optional["BinanceFuturesClient"] = None):
         if testnet:
             self._base_url = "https://testnet.binancefuture.com"
             self._wss_url = "wss://stream.binancefuture.com/ws"
@@ -34,26 +58,121 @@ class BinanceFuturesClient:
 
         self._headers = {'X-MBX-APIKEY': self._public_key}
 
-        # Instance variable containing dictionary of contracts and balances
-        self.contracts = self.get_contracts()
-        self.balances = self.get_balances()
+        self._feed = feed if feed is not None else self
+
+        self._init_start = time.perf_counter()
+
+        # Milliseconds spent on each startup step, reported by the root component once the client is ready
+        self.startup_timings = dict()
+
+        # Instance variable containing dictionary of contracts and balances. Contracts saved in the contracts cache are
+        # used until the exchange answers, balances are fetched in the background
+        self.contracts = contract_cache.load_contracts("binance") if feed is None else feed.contracts
+        self.balances = dict()
+
+        # Increased every time self.contracts is replaced, so that the UI knows when to refresh its lists
+        self.contracts_version = 0
+        self.ready = False
+
+        # Time (time.time()) until which the requests that can wait (e.g. the scanner history) are paused, set when the
+        # exchange answers that the request rate limit is exceeded
+        self.rate_limited_until = 0.0
+
+        # Exchange clock estimate, used for the timestamps of the signed requests and the candles boundaries
+        self.clock = ClockSync("Binance", self._server_time) if feed is None else feed.clock
+
+        self.startup_timings['cache'] = (time.perf_counter() - self._init_start) * 1000
 
-        self.prices = dict()
+        # Best bid/ask of the symbols, written by the websocket thread of the feed only
+        self.prices = PriceCache() if feed is None else feed.prices
+
+        # Local L2 order books of the symbols traded by the strategies
+        self.order_books: typing.Dict[str, OrderBook] = dict() if feed is None else feed.order_books
 
         # After the strategy object is created and historical candles have been fetched, store strategies in each connector
-        self.strategies: typing.Dict[int, typing.Union[TechnicalStrategy, BreakoutStrategy]] = dict()
+        self.strategies = StrategyRegistry()
+
+        # Intervals accepted by get_historical_candles()
+        self.history_timeframes = ["1m", "5m", "15m", "30m", "1h", "4h"]
+
+        # Intervals of the <symbol>@kline_<interval> streams used by the strategies in "klines" mode
+        self.kline_timeframes = ["1m", "5m", "15m", "30m", "1h", "4h"]
+
+        # Intervals whose kline stream is subscribed for every contract (scanner), kept when a strategy stops
+        self._all_klines: typing.Set[str] = set()
+
+        # Candle series shared by the strategies (of every account of the feed), updated once per trade
+        self.market_data = MarketDataHub(self, "Binance") if feed is None else feed.market_data
+
+        # Optional archive of the trades and bid/ask updates received (tick_recorder.py), on the feed client
+        self.tick_recorder: typing.Optional[TickRecorder] = None
 
         self.logs = []
 
         self._ws_id = 1
-        self.ws: websocket.WebSocketApp
+        self.ws: typing.Optional[websocket.WebSocketApp] = None
         self.reconnect = True
 
-        t = threading.Thread(target=self._start_ws)
+        # Channels subscribed (channel -> symbols), subscribed again when the connection is reopened
+        self._subscriptions: typing.Dict[str, typing.Set[str]] = dict()
+
+        self._ws_connected = False
+        self._last_message = 0.0
+        self._reconnect_delay = 1
+        # Exchange time when the connection dropped, the candles missed since then are downloaded after reconnecting
+        self._disconnected_at: typing.Optional[int] = None
+
+        # Order updates of the account (user data stream), used for the exchange-side take profit and stop loss
+        self._user_ws: typing.Optional[websocket.WebSocketApp] = None
+        self._listen_key: typing.Optional[str] = None
+        self._user_reconnect_delay = 1
+        self._order_callbacks: typing.Dict[int, typing.Callable[[OrderStatus], None]] = dict()
+
+        # REST calls and websocket connection happen in the background so that the UI is not blocked
+        t = threading.Thread(target=self._initialize)
         t.start()
 
+    # Fetch the contracts and balances, then start the websocket connection (run in a Thread)
+    def _initialize(self):
+        if self._feed is self:
+            self.clock.sample()
+            self.clock.start()
+            logger.info("Binance clock offset: %s ms", self.clock.offset)
+
+            cache_meta = contract_cache.load_meta("binance")
+
+            # The exchangeInfo payload is only downloaded when the cache is older than its TTL
+            if not cache_meta.is_fresh() or len(self.contracts) == 0:
+                contracts = self.get_contracts()
+
+                if len(contracts) > 0 and contract_cache.load_meta("binance").version != cache_meta.version:
+                    self.contracts = contracts
+                    self.contracts_version += 1
+        else:
+            # The contracts and the clock of the feed are used once it is initialized
+            while not self._feed.ready:
+                time.sleep(0.1)
+
+            if self.contracts is not self._feed.contracts:
+                self.contracts = self._feed.contracts
+                self.contracts_version += 1
+
+        self.startup_timings['contracts'] = (time.perf_counter() - self._init_start) * 1000
+
+        self.balances = self.get_balances()
+        self.startup_timings['balances'] = (time.perf_counter() - self._init_start) * 1000
+
+        self.ready = True
+
         logger.info("Binance Futures Client successfully initialized")
 
+        if self.reconnect:
+            t = threading.Thread(target=self._start_user_ws, daemon=True)
+            t.start()
+
+            if self._feed is self:
+                self._start_ws()
+
     # Add a log to the list in order for it to be picked by the update_ui() method of the root component
     def _add_log(self, msg: str):
         logger.info("%s", msg)
@@ -79,6 +198,13 @@ class BinanceFuturesClient:
                 logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
                 return None
 
+        elif method == "PUT":
+            try:
+                response = requests.put(self._base_url + endpoint, params=data, headers=self._headers)
+            except Exception as e:
+                logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
+                return None
+
         elif method == "DELETE":
             try:
                 response = requests.delete(self._base_url + endpoint, params=data, headers=self._headers)
@@ -88,6 +214,9 @@ class BinanceFuturesClient:
         else:
             raise ValueError()
 
+        if response.status_code in [418, 429]:
+            self.rate_limited_until = time.time() + float(response.headers.get("Retry-After", RATE_LIMIT_BACKOFF))
+
         if response.status_code == 200:
             return response.json()
         else:
@@ -95,27 +224,81 @@ class BinanceFuturesClient:
                          method, endpoint, response.json(), response.status_code)
             return None
 
+    # Milliseconds to add to the local time to get the exchange time
+    @property
+    def clock_offset(self) -> int:
+        return self.clock.offset
+
+    # True while the market data websocket (of the feed) is open
+    @property
+    def connected(self) -> bool:
+        return self._feed._ws_connected
+
+    # Current exchange time in milliseconds
+    def now_ms(self) -> int:
+        return self.clock.now_ms()
+
+    # Exchange time in milliseconds, sampled by the clock sync thread
+    def _server_time(self) -> typing.Optional[float]:
+        server_time = self._make_request("GET", "/fapi/v1/time", dict())
+
+        if server_time is not None:
+            return server_time['serverTime']
+
     #  Get list of symbols (contracts) on the exchange in order to display it on the OptionMenus in the UI
+    # The contracts cache is only rewritten when the exchange payload changed (ETag or payload hash), otherwise the
+    # contracts are loaded from the cache without parsing the payload
     def get_contracts(self) -> typing.Dict[str, Contract]:
-        exchange_info = self._make_request("GET", "/fapi/v1/exchangeInfo", dict())
+        cache_meta = contract_cache.load_meta("binance")
+
+        headers = dict(self._headers)
+        if cache_meta.etag is not None:
+            headers['If-None-Match'] = cache_meta.etag
+
+        try:
+            response = requests.get(self._base_url + "/fapi/v1/exchangeInfo", headers=headers)
+        except Exception as e:
+            logger.error("Connection error while making GET request to /fapi/v1/exchangeInfo: %s", e)
+            return dict()
+
+        if response.status_code == 304:
+            contract_cache.touch("binance")
+            return contract_cache.load_contracts("binance")
+
+        if response.status_code != 200:
+            logger.error("Error while making GET request to /fapi/v1/exchangeInfo: %s (error code %s)",
+                         response.text, response.status_code)
+            return dict()
+
+        payload_hash = contract_cache.content_hash(response.content)
+
+        if payload_hash == cache_meta.content_hash:
+            contract_cache.touch("binance")
+            return contract_cache.load_contracts("binance")
 
         contracts = dict()
 
-        if exchange_info is not None:
-            for contract_data in exchange_info['symbols']:
-                if contract_data['marginAsset'] != "BUSD":
-                    contracts[contract_data['symbol']] = Contract(contract_data, "binance")
+        for contract_data in response.json()['symbols']:
+            if contract_data['marginAsset'] != "BUSD":
+                contracts[contract_data['symbol']] = Contract(contract_data, "binance")
+
+        contract_cache.save_contracts("binance", contracts, response.headers.get('ETag'), payload_hash)
 
         return contracts
 
-    # Get list of the most recent candlesticks for any given symbol (contract) and interval
-    def get_historical_candles(self, contract: Contract, interval: str) -> typing.List[Candle]:
+    # Get list of the most recent candlesticks for any given symbol (contract) and interval, or the candlesticks from
+    # start_time (in milliseconds) when it is set
+    def get_historical_candles(self, contract: Contract, interval: str,
+                               start_time: typing.Optional[int] = None) -> typing.List[Candle]:
         data = {
         'symbol': contract.symbol,
         'interval': interval,
         'limit': 1000
         }
 
+        if start_time is not None:
+            data['startTime'] = start_time
+
         raw_candles = self._make_request("GET", "/fapi/v1/klines", data)
 
         candles = []
@@ -126,27 +309,58 @@ class BinanceFuturesClient:
 
         return candles
 
-    # Get current bid and ask price for any symbol/contract, to display in the Watchlist.
-    def get_bid_ask(self, contract: Contract) -> typing.Dict[str, float]:
+    # Get current bid and ask price for any symbol/contract, to display in the Watchlist until the bookTicker stream
+    # sends it. Not stored in the price cache, only the websocket thread writes to it
+    def get_bid_ask(self, contract: Contract) -> typing.Optional[typing.Dict[str, float]]:
         data = {
         'symbol': contract.symbol
         }
         ob_data = self._make_request("GET", "/fapi/v1/ticker/bookTicker", data)
 
         if ob_data is not None:
-            if contract.symbol not in self.prices:
-                self.prices[contract.symbol] = {'bid': float(ob_data['bidPrice']), 'ask': float(ob_data['askPrice'])}
-            else:
-                self.prices[contract.symbol]['bid'] = float(ob_data['bidPrice'])
-                self.prices[contract.symbol]['ask'] = float(ob_data['askPrice'])
+            return {'bid': float(ob_data['bidPrice']), 'ask': float(ob_data['askPrice'])}
+
+    # Keep a local order book of the contract: depth diffs (buffered until the snapshot is received) and REST snapshot
+    def subscribe_order_book(self, contract: Contract):
+        if contract.symbol in self.order_books:
+            return
 
-            return self.prices[contract.symbol]
+        self.order_books[contract.symbol] = OrderBook("Binance", contract.symbol)
+        self.subscribe_channel([contract], "depth@100ms")
+
+        t = threading.Thread(target=self._sync_order_book, args=(contract.symbol,), daemon=True)
+        t.start()
+
+    def unsubscribe_order_book(self, contract: Contract):
+        if self.order_books.pop(contract.symbol, None) is not None:
+            self.unsubscribe_channel([contract], "depth@100ms")
+
+    # Download the snapshot of the order book, again if the diffs buffered meanwhile do not follow it
+    def _sync_order_book(self, symbol: str):
+        for attempt in range(5):
+            # Let the websocket buffer the first diffs, the snapshot must not be older than them
+            time.sleep(1)
+
+            snapshot = self._make_request("GET", "/fapi/v1/depth", {'symbol': symbol, 'limit': 1000})
+
+            book = self.order_books.get(symbol)
+
+            # The order book was unsubscribed meanwhile
+            if book is None:
+                return
+
+            if snapshot is not None and book.apply_snapshot(snapshot['lastUpdateId'], snapshot['bids'], snapshot['asks']):
+                logger.info("Binance %s order book synchronized", symbol)
+                return
+
+        logger.error("Binance %s order book could not be synchronized", symbol)
 
     # Get current balance of account
     def get_balances(self) -> typing.Dict[str, Balance]:
         data = {
-        'timestamp': int(time.time() * 1000)
+        'timestamp': self.now_ms()
         }
+        data['recvWindow'] = self.clock.recv_window()
         data['signature'] = self._generate_signature(data)
 
         balances = dict()
@@ -160,21 +374,32 @@ class BinanceFuturesClient:
         return balances
 
     #  Place an order - depending on the order_type, price and tif arguments are not necessary
-    def place_order(self, contract: Contract, order_type: str, quantity: float, side: str, price=None, tif=None) -> OrderStatus:
+    # stop_price is the trigger price of the STOP_MARKET/TAKE_PROFIT_MARKET orders, close_position makes the order close
+    # the whole position when triggered (the quantity is then ignored)
+    def place_order(self, contract: Contract, order_type: str, quantity: float, side: str, price=None, tif=None,
+                    stop_price=None, close_position=False) -> OrderStatus:
         data = {
         'symbol': contract.symbol,
         'side': side.upper(),
-        'quantity': round(round(quantity / contract.lot_size) * contract.lot_size, 8),
         'type': order_type
         }
 
+        if close_position:
+            data['closePosition'] = "true"
+        else:
+            data['quantity'] = round(round(quantity / contract.lot_size) * contract.lot_size, 8)
+
         if price is not None:
             data['price'] = round(round(price / contract.tick_size) * contract.tick_size, 8)
 
+        if stop_price is not None:
+            data['stopPrice'] = round(round(stop_price / contract.tick_size) * contract.tick_size, 8)
+
         if tif is not None:
             data['timeInForce'] = tif
 
-        data['timestamp'] = int(time.time() * 1000)
+        data['timestamp'] = self.now_ms()
+        data['recvWindow'] = self.clock.recv_window()
         data['signature'] = self._generate_signature(data)
 
         order_status = self._make_request("POST", "/fapi/v1/order", data)
@@ -184,14 +409,107 @@ class BinanceFuturesClient:
 
         return order_status
 
+    # Place several orders with /fapi/v1/batchOrders (5 orders per request, the requests are sent concurrently)
+    # Each order is a dictionary with the place_order() arguments: contract, order_type, quantity, side and optionally
+    # price, tif and reduce_only. Returns the order status of each order, None for the rejected ones
+    def place_batch_orders(self, orders: typing.List[typing.Dict]) -> typing.List[typing.Optional[OrderStatus]]:
+        batches = [orders[i:i + 5] for i in range(0, len(orders), 5)]
+
+        if len(batches) == 0:
+            return []
+
+        with ThreadPoolExecutor(max_workers=len(batches)) as executor:
+            results = list(executor.map(self._place_batch, batches))
+
+        return [order_status for batch in results for order_status in batch]
+
+    def _place_batch(self, orders: typing.List[typing.Dict]) -> typing.List[typing.Optional[OrderStatus]]:
+        batch = []
+
+        # The values of the orders are sent as strings, formatted with the precision of the contract
+        for order in orders:
+            contract = order['contract']
+
+            params = {
+            'symbol': contract.symbol,
+            'side': order['side'].upper(),
+            'type': order['order_type'],
+            'quantity': "{0:.{prec}f}".format(round(order['quantity'] / contract.lot_size) * contract.lot_size,
+                                              prec=contract.quantity_decimals)
+            }
+
+            if order.get('price') is not None:
+                params['price'] = "{0:.{prec}f}".format(round(order['price'] / contract.tick_size) * contract.tick_size,
+                                                        prec=contract.price_decimals)
+
+            if order.get('tif') is not None:
+                params['timeInForce'] = order['tif']
+
+            if order.get('reduce_only'):
+                params['reduceOnly'] = "true"
+
+            batch.append(params)
+
+        data = {
+        'batchOrders': json.dumps(batch),
+        'timestamp': self.now_ms()
+        }
+        data['recvWindow'] = self.clock.recv_window()
+        data['signature'] = self._generate_signature(data)
+
+        response = self._make_request("POST", "/fapi/v1/batchOrders", data)
+
+        if response is None:
+            return [None] * len(orders)
+
+        statuses = []
+
+        # Rejected orders are returned as errors in the list, in the same position as the order
+        for order_status in response:
+            if 'orderId' in order_status:
+                statuses.append(OrderStatus(order_status, "binance"))
+            else:
+                logger.error("Binance batch order rejected: %s", order_status)
+                statuses.append(None)
+
+        return statuses
+
+    # Cancel all the open orders of a contract with a single request
+    def cancel_all_orders(self, contract: Contract) -> bool:
+        data = {
+        'symbol': contract.symbol,
+        'timestamp': self.now_ms()
+        }
+        data['recvWindow'] = self.clock.recv_window()
+        data['signature'] = self._generate_signature(data)
+
+        return self._make_request("DELETE", "/fapi/v1/allOpenOrders", data) is not None
+
+    # Exit orders kept by the exchange once the entry is filled, so that the take profit and stop loss do not depend on
+    # the trades received by the bot. Both orders close the position, the other one is canceled by the strategy when one
+    # of them is filled (order updates of the user data stream)
+    def place_exit_orders(self, contract: Contract, side: str, quantity: float, take_profit_price: typing.Optional[float],
+                          stop_loss_price: typing.Optional[float]) -> typing.Dict[str, typing.Optional[OrderStatus]]:
+        orders = dict()
+
+        if take_profit_price is not None:
+            orders['take_profit'] = self.place_order(contract, "TAKE_PROFIT_MARKET", quantity, side,
+                                                     stop_price=take_profit_price, close_position=True)
+        if stop_loss_price is not None:
+            orders['stop_loss'] = self.place_order(contract, "STOP_MARKET", quantity, side,
+                                                   stop_price=stop_loss_price, close_position=True)
+
+        return orders
+
     # Cancel order
     def cancel_order(self, contract: Contract, order_id: int) -> OrderStatus:
 
         data = {
         'orderId': order_id,
         'symbol': contract.symbol,
-        'timestamp': int(time.time() * 1000)
+        'timestamp': self.now_ms()
         }
+        data['recvWindow'] = self.clock.recv_window()
         data['signature'] = self._generate_signature(data)
 
         order_status = self._make_request("DELETE", "/fapi/v1/order", data)
@@ -206,10 +524,11 @@ class BinanceFuturesClient:
     def get_order_status(self, contract: Contract, order_id: int) -> OrderStatus:
 
         data = {
-        'timestamp': int(time.time() * 1000),
+        'timestamp': self.now_ms(),
         'symbol': contract.symbol,
         'orderId': order_id
         }
+        data['recvWindow'] = self.clock.recv_window()
         data['signature'] = self._generate_signature(data)
 
 
@@ -227,32 +546,176 @@ class BinanceFuturesClient:
         self.ws = websocket.WebSocketApp(self._wss_url, on_open=self._on_open, on_close=self._on_close,
                                          on_error=self._on_error, on_message=self._on_message)
 
+        t = threading.Thread(target=self._watch_connection, daemon=True)
+        t.start()
+
         while True:
             # Reconnect websocket connection if disconnected
             try:
                 if self.reconnect:
-                    self.ws.run_forever()
+                    self.ws.run_forever(ping_interval=WS_PING_INTERVAL, ping_timeout=WS_PING_TIMEOUT)
                 else:
                     break
             except Exception as e:
                 logger.error("Binance error in run_forever() method: %s", e)
-            time.sleep(2)
+
+            # Exponential backoff, reset when the connection opens
+            logger.info("Binance reconnecting in %s seconds", self._reconnect_delay)
+            time.sleep(self._reconnect_delay)
+            self._reconnect_delay = min(self._reconnect_delay * 2, WS_MAX_RECONNECT_DELAY)
+
+    # Close the connection when no message was received for a while (dead socket not noticed by the TCP stack), so that
+    # run_forever() returns and the connection is reopened
+    def _watch_connection(self):
+        while self.reconnect:
+            time.sleep(1)
+
+            if self._ws_connected and time.time() - self._last_message > WS_STALE_TIMEOUT:
+                logger.warning("Binance no message received for %s seconds, closing the connection", WS_STALE_TIMEOUT)
+                self._ws_connected = False
+                self.ws.close()
+
+    # Call callback(order_status) every time the user data stream sends an update of the order
+    def watch_order(self, order_id: int, callback: typing.Callable[[OrderStatus], None]):
+        self._order_callbacks[order_id] = callback
+
+    def unwatch_order(self, order_id: int):
+        self._order_callbacks.pop(order_id, None)
+
+    # Infinite loop (run in a Thread) for the user data stream, on its own connection because its URL contains the
+    # listen key. A new listen key is created every time the connection is reopened, with an exponential backoff. The
+    # stream is given up if the API keys are missing or rejected (the exit orders placed on the exchange are then not
+    # followed)
+    def _start_user_ws(self):
+        if not self._public_key or not self._secret_key:
+            logger.warning("Binance user data stream not started: no API keys")
+            return
+
+        while self.reconnect:
+            listen_key, rejected = self._create_listen_key()
+
+            if rejected:
+                logger.error("Binance user data stream stopped: the API keys were rejected")
+                return
+
+            if listen_key is not None:
+                self._listen_key = listen_key
+
+                self._user_ws = websocket.WebSocketApp(self._wss_url + "/" + self._listen_key,
+                                                       on_open=self._on_user_open, on_close=self._on_user_close,
+                                                       on_error=self._on_user_error, on_message=self._on_user_message)
+
+                try:
+                    self._user_ws.run_forever()
+                except Exception as e:
+                    logger.error("Binance error in the user data stream run_forever() method: %s", e)
+
+            # Reset when the connection opens
+            logger.info("Binance user data stream reconnecting in %s seconds", self._user_reconnect_delay)
+            time.sleep(self._user_reconnect_delay)
+            self._user_reconnect_delay = min(self._user_reconnect_delay * 2, WS_MAX_RECONNECT_DELAY)
+
+    # Returns the new listen key (None if the request failed) and whether the API keys were rejected (HTTP 401, e.g.
+    # error -2015: invalid API key, IP or permissions, or a testnet account without futures)
+    def _create_listen_key(self) -> typing.Tuple[typing.Optional[str], bool]:
+        try:
+            response = requests.post(self._base_url + "/fapi/v1/listenKey", headers=self._headers)
+        except Exception as e:
+            logger.error("Connection error while making POST request to /fapi/v1/listenKey: %s", e)
+            return None, False
+
+        if response.status_code == 200:
+            return response.json()['listenKey'], False
+
+        logger.error("Error while making POST request to /fapi/v1/listenKey: %s (error code %s)", response.text,
+                     response.status_code)
+
+        try:
+            code = response.json().get('code')
+        except ValueError:
+            code = None
+
+        return None, response.status_code == 401 or code in [-2014, -2015]
+
+    # The listen key expires 60 minutes after its creation unless it is extended
+    def _keep_alive_listen_key(self, listen_key: str):
+        if listen_key != self._listen_key or not self.reconnect:
+            return
+
+        self._make_request("PUT", "/fapi/v1/listenKey", dict())
+
+        t = threading.Timer(30 * 60, lambda: self._keep_alive_listen_key(listen_key))
+        t.daemon = True
+        t.start()
+
+    def _on_user_open(self, ws):
+        logger.info("Binance user data stream opened")
+
+        self._user_reconnect_delay = 1
+
+        t = threading.Timer(30 * 60, lambda key=self._listen_key: self._keep_alive_listen_key(key))
+        t.daemon = True
+        t.start()
+
+    def _on_user_close(self, ws, *args):
+        logger.warning("Binance user data stream closed")
+
+    def _on_user_error(self, ws, msg: str):
+        logger.error("Binance user data stream error: %s", msg)
+
+    def _on_user_message(self, ws, msg: str):
+        data = json.loads(msg)
+
+        if "e" in data:
+            if data['e'] == "ORDER_TRADE_UPDATE":
+                order_status = OrderStatus(data['o'], "binance_stream")
+
+                callback = self._order_callbacks.get(order_status.order_id)
+
+                if callback is not None:
+                    callback(order_status)
+
+            # The connection is closed and reopened with a new listen key
+            elif data['e'] == "listenKeyExpired":
+                logger.warning("Binance listen key expired")
+                ws.close()
 
     def _on_open(self, ws):
         logger.info("Binance connection opened")
 
+        self._ws_connected = True
+        self._last_message = time.time()
+        self._reconnect_delay = 1
+
         self.subscribe_channel(list(self.contracts.values()), "bookTicker")
 
+        # Channels subscribed after the connection opened (trades of the strategies), or before it reopened
+        for channel, symbols in list(self._subscriptions.items()):
+            if channel != "bookTicker":
+                self.subscribe_channel([self.contracts[s] for s in symbols if s in self.contracts], channel)
+
+        # The candles of the trades missed while disconnected are downloaded and replace the flat candles
+        if self._disconnected_at is not None:
+            t = threading.Thread(target=self.market_data.resync, args=(self._disconnected_at,), daemon=True)
+            t.start()
+            self._disconnected_at = None
+
     # Called when the connection drops
-    def _on_close(self, ws):
+    def _on_close(self, ws, *args):
         logger.warning("Binance Websocket connection closed")
 
+        self._ws_connected = False
+
+        if self._disconnected_at is None:
+            self._disconnected_at = self.now_ms()
+
     # Called in case of an error
     def _on_error(self, ws, msg: str):
         logger.error("Binance connection error: %s", msg)
 
     # The websocket updates of the channels subscribed go through this callback method
     def _on_message(self, ws, msg: str):
+        self._last_message = time.time()
 
         data = json.loads(msg)
 
@@ -261,39 +724,50 @@ class BinanceFuturesClient:
 
                 symbol = data['s']
 
-                if symbol not in self.prices:
-                    self.prices[symbol] = {'bid': float(data['b']), 'ask': float(data['a'])}
-                else:
-                    self.prices[symbol]['bid'] = float(data['b'])
-                    self.prices[symbol]['ask'] = float(data['a'])
+                self.clock.record_latency("bookTicker", data['E'])
 
-                # PNL Calculation
-                try:
-                    for b_index, strat in self.strategies.items():
-                        if strat.contract.symbol == symbol:
-                            for trade in strat.trades:
-                                if trade.status == "open" and trade.entry_price is not None:
-                                    if trade.side == "long":
-                                        trade.pnl = (self.prices[symbol]['bid'] - trade.entry_price) * trade.quantity
-                                    elif trade.side == "short":
-                                        trade.pnl = (trade.entry_price - self.prices[symbol]['ask']) * trade.quantity
-                except RuntimeError as e:
-                    logger.error("Error while looping through the Binance strategies: %s", e)
+                bid, ask = float(data['b']), float(data['a'])
 
+                self.prices.update(symbol, bid, ask, data['E'])
 
+                if self.tick_recorder is not None:
+                    self.tick_recorder.record_book(symbol, bid, ask, data['E'])
+
+                # PNL, take profit and stop loss of the strategies of the symbol
+                self.market_data.on_price(symbol, bid, ask)
+
+            if data['e'] == "kline":
+                kline = data['k']
+                candle = Candle([kline['t'], kline['o'], kline['h'], kline['l'], kline['c'], kline['v']], kline['i'],
+                                "binance")
+                self.market_data.on_kline(data['s'], kline['i'], candle, kline['x'])
+
+            if data['e'] == "depthUpdate":
+                book = self.order_books.get(data['s'])
+
+                # A diff was missed (e.g. the connection was reopened), a new snapshot is needed
+                if book is not None and not book.apply_diff(data):
+                    t = threading.Thread(target=self._sync_order_book, args=(data['s'],), daemon=True)
+                    t.start()
 
             if data['e'] == "aggTrade":
-                symbol = data['s']
+                self.clock.record_latency("aggTrade", data['E'])
+
+                price, size = float(data['p']), float(data['q'])
 
-                # Loop through strategies
-                for key, strat in self.strategies.items():
-                    if strat.contract.symbol == symbol:
-                        res = strat.parse_trades(float(data['p']), float(data['q']), data['T'])
-                        strat.check_trade(res)
+                if self.tick_recorder is not None:
+                    self.tick_recorder.record_trade(data['s'], price, size, data['T'])
+
+                # The candle series of the symbol are updated once and notify their strategies
+                self.market_data.on_trade(data['s'], price, size, data['T'])
 
     # Class method to subscribe to a channel to receive market data
     # If the list is bigger than 300 symbols the subscription will most likely fail
     def subscribe_channel(self, contracts: typing.List[Contract], channel: str):
+        if self._feed is not self:
+            self._feed.subscribe_channel(contracts, channel)
+            return
+
         data = {
         'method': "SUBSCRIBE",
         'params': []
@@ -303,6 +777,12 @@ class BinanceFuturesClient:
             data['params'].append(contract.symbol.lower() + "@" + channel)
         data['id'] = self._ws_id
 
+        self._subscriptions.setdefault(channel, set()).update(contract.symbol for contract in contracts)
+
+        # The channels subscribed before the connection is open are sent by _on_open()
+        if not self._ws_connected or len(contracts) == 0:
+            return
+
         try:
             self.ws.send(json.dumps(data))
         except Exception as e:
@@ -310,8 +790,63 @@ class BinanceFuturesClient:
 
         self._ws_id += 1
 
+    def unsubscribe_channel(self, contracts: typing.List[Contract], channel: str):
+        if self._feed is not self:
+            self._feed.unsubscribe_channel(contracts, channel)
+            return
+
+        data = {
+        'method': "UNSUBSCRIBE",
+        'params': [contract.symbol.lower() + "@" + channel for contract in contracts],
+        'id': self._ws_id
+        }
+
+        self._subscriptions.get(channel, set()).difference_update(contract.symbol for contract in contracts)
+
+        if not self._ws_connected or len(contracts) == 0:
+            return
+
+        try:
+            self.ws.send(json.dumps(data))
+        except Exception as e:
+            logger.error("Websocket error while unsubscribing from %s %s updates: %s", len(contracts), channel, e)
+
+        self._ws_id += 1
+
+    # Called by the market data hub when a strategy starts on a symbol that has no candle series yet
+    def subscribe_trades(self, contract: Contract):
+        self.subscribe_channel([contract], "aggTrade")
+
+    # Called by the market data hub when the last strategy of the symbol stops
+    def unsubscribe_trades(self, contract: Contract):
+        self.unsubscribe_channel([contract], "aggTrade")
+
+    # Candles streamed by the exchange, for the strategies in "klines" mode
+    def subscribe_klines(self, contract: Contract, timeframe: str):
+        self.subscribe_channel([contract], "kline_" + timeframe)
+
+    def unsubscribe_klines(self, contract: Contract, timeframe: str):
+        if timeframe in self._feed._all_klines:
+            return
+
+        self.unsubscribe_channel([contract], "kline_" + timeframe)
+
+    # Candles of every contract on one subscription, for the scanner
+    def subscribe_all_klines(self, timeframe: str):
+        self._feed._all_klines.add(timeframe)
+        self.subscribe_channel(list(self.contracts.values()), "kline_" + timeframe)
+
+    # The bookTicker channel is subscribed for every contract when the connection opens
+    def subscribe_prices(self, symbol: str):
+        pass
+
+    def unsubscribe_prices(self, symbol: str):
+        pass
+
     # Calculate the trade size based on the percentage of the balance to use (defined in the strategy component)
-    def get_trade_size(self, contract: Contract, price: float, balance_pct: float):
+    # When the side of the order is given and the order book of the contract is synchronized, the trade size is capped
+    # to the quantity the book can fill within MAX_SLIPPAGE of the best price
+    def get_trade_size(self, contract: Contract, price: float, balance_pct: float, side: typing.Optional[str] = None):
 
         balance = self.get_balances()
         if balance is not None:
@@ -329,5 +864,15 @@ class BinanceFuturesClient:
 
         logger.info("Binance Futures current USDT balance = %s, trade size = %s", balance, trade_size)
 
+        book = self.order_books.get(contract.symbol)
+
+        if side is not None and book is not None and book.synced:
+            max_size = book.max_quantity(side)
+
+            if 0 < max_size < trade_size:
+                trade_size = round(int(max_size / contract.lot_size) * contract.lot_size, 8)
+                logger.info("Binance Futures trade size capped to %s by the %s order book depth", trade_size,
+                            contract.symbol)
+
         return trade_size
 
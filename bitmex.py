@@ -12,18 +12,35 @@ import hashlib
 import websocket
 import json
 
+import datetime
 import dateutil.parser
 
 import threading
-from strategies import TechnicalStrategy, BreakoutStrategy
+from market_data import MarketDataHub
+from tick_recorder import TickRecorder
+from price_cache import PriceCache
+from strategy_registry import StrategyRegistry
 
 from models import *
+import contract_cache
+from clock_sync import ClockSync
+from order_book import OrderBook
 
 logger = logging.getLogger()
 
+# Heartbeat and reconnection settings, see binance_futures.py
+WS_PING_INTERVAL = 10
+WS_PING_TIMEOUT = 5
+WS_STALE_TIMEOUT = 15
+WS_MAX_RECONNECT_DELAY = 60
+
+# Pause of the requests that can wait after the request rate limit is exceeded, see binance_futures.py
+RATE_LIMIT_BACKOFF = 60
+
 
 class BitmexClient:
-    def __init__(self, public_key: str, secret_key: str, testnet: bool):
+    # feed: client whose market data connection is shared (see BinanceFuturesClient)
+    def __init__(self, public_key: str, secret_key: str, testnet: bool, feed: typing.Optional["BitmexClient"] = None):
 
         if testnet:
             self._base_url = "https://testnet.bitmex.com"
@@ -35,24 +52,105 @@ class BitmexClient:
         self._public_key = public_key
         self._secret_key = secret_key
 
-        self.ws: websocket.WebSocketApp
+        self._feed = feed if feed is not None else self
+
+        self.ws: typing.Optional[websocket.WebSocketApp] = None
         self.reconnect = True
 
-        self.contracts = self.get_contracts()
-        self.balances = self.get_balances()
+        # Number of users (watchlist rows, candle series, order books) of each per-symbol topic ("trade:XBTUSD",
+        # "instrument:XBTUSD"...). A topic is subscribed for its first user and unsubscribed after its last one, and
+        # every topic is subscribed again when the connection is reopened
+        self._subscriptions: typing.Dict[str, int] = dict()
+        self._subscriptions_lock = threading.Lock()
+
+        self._ws_connected = False
+        self._last_message = 0.0
+        self._reconnect_delay = 1
+        self._disconnected_at: typing.Optional[int] = None
+
+        # Authenticated connection receiving the order updates of the account
+        self._user_ws: typing.Optional[websocket.WebSocketApp] = None
+        self._order_callbacks: typing.Dict[str, typing.Callable[[OrderStatus], None]] = dict()
+
+        self._init_start = time.perf_counter()
+        self.startup_timings = dict()
+
+        self.contracts = contract_cache.load_contracts("bitmex") if feed is None else feed.contracts
+        self.balances = dict()
+
+        self.contracts_version = 0
+        self.ready = False
 
-        self.prices = dict()
+        # Time (time.time()) until which the requests that can wait (e.g. the scanner history) are paused, set when the
+        # exchange answers that the request rate limit is exceeded
+        self.rate_limited_until = 0.0
+
+        self.clock = ClockSync("Bitmex", self._server_time) if feed is None else feed.clock
+
+        self.startup_timings['cache'] = (time.perf_counter() - self._init_start) * 1000
+
+        # Best bid/ask of the symbols, written by the websocket thread of the feed only
+        self.prices = PriceCache() if feed is None else feed.prices
+
+        self.order_books: typing.Dict[str, OrderBook] = dict() if feed is None else feed.order_books
 
         # After the strategy object is created and historical candles have been fetched, store strategies in each connector
-        self.strategies: typing.Dict[int, typing.Union[TechnicalStrategy, BreakoutStrategy]] = dict()
+        self.strategies = StrategyRegistry()
+
+        # Bin sizes accepted by /api/v1/trade/bucketed, the other timeframes are resampled by the market data hub
+        self.history_timeframes = ["1m", "5m", "1h", "1d"]
+
+        # Timeframes of the tradeBin topics (closed candles) that are also strategy timeframes
+        self.kline_timeframes = ["1m", "5m", "1h"]
+
+        self.market_data = MarketDataHub(self, "Bitmex") if feed is None else feed.market_data
+
+        # Optional archive of the trades and bid/ask updates received (tick_recorder.py), on the feed client
+        self.tick_recorder: typing.Optional[TickRecorder] = None
 
         self.logs = []
 
-        t = threading.Thread(target=self._start_ws)
+        t = threading.Thread(target=self._initialize)
         t.start()
 
+    def _initialize(self):
+        if self._feed is self:
+            self.clock.sample()
+            self.clock.start()
+            logger.info("Bitmex clock offset: %s ms", self.clock.offset)
+
+            cache_meta = contract_cache.load_meta("bitmex")
+
+            if not cache_meta.is_fresh() or len(self.contracts) == 0:
+                contracts = self.get_contracts()
+
+                if len(contracts) > 0 and contract_cache.load_meta("bitmex").version != cache_meta.version:
+                    self.contracts = contracts
+                    self.contracts_version += 1
+        else:
+            while not self._feed.ready:
+                time.sleep(0.1)
+
+            if self.contracts is not self._feed.contracts:
+                self.contracts = self._feed.contracts
+                self.contracts_version += 1
+
+        self.startup_timings['contracts'] = (time.perf_counter() - self._init_start) * 1000
+
+        self.balances = self.get_balances()
+        self.startup_timings['balances'] = (time.perf_counter() - self._init_start) * 1000
+
+        self.ready = True
+
         logger.info("Bitmex Client successfully initialized")
 
+        if self.reconnect:
+            t = threading.Thread(target=self._start_user_ws, daemon=True)
+            t.start()
+
+            if self._feed is self:
+                self._start_ws()
+
     # Most of the functions in bitmex.py are also in binance_futures.py, which is documented for each function
     def _add_log(self, msg: str):
         logger.info("%s", msg)
@@ -64,7 +162,8 @@ class BitmexClient:
         return hmac.new(self._secret_key.encode(), message.encode(), hashlib.sha256).hexdigest()
 
     def _make_request(self, method: str, endpoint: str, data: typing.Dict):
-        expires = str(int(time.time()) + 5)
+        # The validity of the request is longer when the network is slow (recv_window() is at least 5 seconds)
+        expires = str(int((self.now_ms() + self.clock.recv_window()) / 1000))
         headers = {
         'api-expires': expires,
         'api-key': self._public_key,
@@ -95,6 +194,9 @@ class BitmexClient:
         else:
             raise ValueError ()
 
+        if response.status_code in [429]:
+            self.rate_limited_until = time.time() + float(response.headers.get("Retry-After", RATE_LIMIT_BACKOFF))
+
         if response.status_code == 200:
             return response.json()
         else:
@@ -102,17 +204,75 @@ class BitmexClient:
                          method, endpoint, response.json(), response.status_code)
             return None
 
+    @property
+    def clock_offset(self) -> int:
+        return self.clock.offset
+
+    @property
+    def connected(self) -> bool:
+        return self._feed._ws_connected
+
+    def now_ms(self) -> int:
+        return self.clock.now_ms()
+
+    # The API root endpoint returns the exchange time (with milliseconds, unlike the Date header of the responses)
+    def _server_time(self) -> typing.Optional[float]:
+        api_info = self._make_request("GET", "/api/v1", dict())
+
+        if api_info is not None:
+            return dateutil.parser.isoparse(api_info['timestamp']).timestamp() * 1000
+
+    # The instrument payload is only parsed (tick_to_decimals for every instrument) when it changed since it was cached
     def get_contracts(self) -> typing.Dict[str, Contract]:
+        cache_meta = contract_cache.load_meta("bitmex")
+
+        headers = dict()
+        if cache_meta.etag is not None:
+            headers['If-None-Match'] = cache_meta.etag
+
+        try:
+            response = requests.get(self._base_url + "/api/v1/instrument/active", headers=headers)
+        except Exception as e:
+            logger.error("Connection error while making GET request to /api/v1/instrument/active: %s", e)
+            return dict()
 
-        instruments = self._make_request("GET", "/api/v1/instrument/active", dict())
+        if response.status_code == 304:
+            contract_cache.touch("bitmex")
+            return contract_cache.load_contracts("bitmex")
+
+        if response.status_code != 200:
+            logger.error("Error while making GET request to /api/v1/instrument/active: %s (error code %s)",
+                         response.text, response.status_code)
+            return dict()
+
+        payload_hash = contract_cache.content_hash(response.content)
+
+        if payload_hash == cache_meta.content_hash:
+            contract_cache.touch("bitmex")
+            return contract_cache.load_contracts("bitmex")
 
         contracts = dict()
 
-        if instruments is not None:
-            for s in instruments:
-                contracts[s['symbol']] = Contract(s, "bitmex")
+        for s in response.json():
+            contracts[s['symbol']] = Contract(s, "bitmex")
+
+        contracts = collections.OrderedDict(sorted(contracts.items()))
 
-        return collections.OrderedDict(sorted(contracts.items()))
+        contract_cache.save_contracts("bitmex", contracts, response.headers.get('ETag'), payload_hash)
+
+        return contracts
+
+    # The orderBookL2_25 topic sends the 25 best levels of each side (partial), then their updates
+    def subscribe_order_book(self, contract: Contract):
+        if contract.symbol in self.order_books:
+            return
+
+        self.order_books[contract.symbol] = OrderBook("Bitmex", contract.symbol)
+        self.subscribe_channel("orderBookL2_25:" + contract.symbol)
+
+    def unsubscribe_order_book(self, contract: Contract):
+        if self.order_books.pop(contract.symbol, None) is not None:
+            self.unsubscribe_channel("orderBookL2_25:" + contract.symbol)
 
     def get_balances(self) -> typing.Dict[str, Balance]:
         data = {
@@ -129,7 +289,8 @@ class BitmexClient:
 
         return balances
 
-    def get_historical_candles(self, contract: Contract, timeframe: str) -> typing.List[Candle]:
+    def get_historical_candles(self, contract: Contract, timeframe: str,
+                               start_time: typing.Optional[int] = None) -> typing.List[Candle]:
         data = {
         'symbol': contract.symbol,
         'partial': True,
@@ -138,29 +299,45 @@ class BitmexClient:
         'reverse': True
         }
 
+        # The timestamps of the Bitmex candles are their close time
+        if start_time is not None:
+            start = datetime.datetime.fromtimestamp(start_time / 1000 + BITMEX_TF_MINUTES[timeframe] * 60,
+                                                    tz=datetime.timezone.utc)
+            data['startTime'] = start.isoformat()
+            data['reverse'] = False
+
         raw_candles = self._make_request("GET", "/api/v1/trade/bucketed", data)
 
         candles = []
 
         if raw_candles is not None:
-            for c in reversed(raw_candles):
+            for c in (reversed(raw_candles) if data['reverse'] else raw_candles):
                 if c['open'] is None or c['close'] is None:
                     continue
                 candles.append(Candle(c, timeframe, "bitmex"))
 
         return candles
 
-    def place_order(self, contract: Contract, order_type: str, quantity: int, side: str, price=None, tif=None) -> OrderStatus:
+    # order_type is "MARKET", "LIMIT", "STOP" or "MARKET_IF_TOUCHED", stop_price is the trigger price of the last two.
+    # exec_inst is the execution instructions, e.g. "Close" so that the order can only reduce the position
+    def place_order(self, contract: Contract, order_type: str, quantity: int, side: str, price=None, tif=None,
+                    stop_price=None, exec_inst=None) -> OrderStatus:
         data = {
             'symbol': contract.symbol,
             'side': side.capitalize(),
             'orderQty': round(quantity / contract.lot_size) * contract.lot_size,
-            'ordType': order_type.capitalize()
+            'ordType': BITMEX_ORDER_TYPES.get(order_type.upper(), order_type.capitalize())
         }
 
         if price is not None:
             data['price'] = round(round(price / contract.tick_size) * contract.tick_size, 8)
 
+        if stop_price is not None:
+            data['stopPx'] = round(round(stop_price / contract.tick_size) * contract.tick_size, 8)
+
+        if exec_inst is not None:
+            data['execInst'] = exec_inst
+
         if tif is not None:
             data['timeInForce'] = tif
 
@@ -171,7 +348,68 @@ class BitmexClient:
 
         return order_status
 
-    def cancel_order(self, order_id: str) -> OrderStatus:
+    # Place several orders with a single /api/v1/order/bulk request, see BinanceFuturesClient.place_batch_orders()
+    def place_batch_orders(self, orders: typing.List[typing.Dict]) -> typing.List[typing.Optional[OrderStatus]]:
+        if len(orders) == 0:
+            return []
+
+        bulk = []
+
+        for order in orders:
+            contract = order['contract']
+
+            params = {
+                'symbol': contract.symbol,
+                'side': order['side'].capitalize(),
+                'orderQty': round(order['quantity'] / contract.lot_size) * contract.lot_size,
+                'ordType': BITMEX_ORDER_TYPES.get(order['order_type'].upper(), order['order_type'].capitalize())
+            }
+
+            if order.get('price') is not None:
+                params['price'] = round(round(order['price'] / contract.tick_size) * contract.tick_size, 8)
+
+            if order.get('tif') is not None:
+                params['timeInForce'] = order['tif']
+
+            if order.get('reduce_only'):
+                params['execInst'] = "ReduceOnly"
+
+            bulk.append(params)
+
+        response = self._make_request("POST", "/api/v1/order/bulk", {'orders': json.dumps(bulk)})
+
+        if response is None:
+            return [None] * len(orders)
+
+        return [OrderStatus(order_status, "bitmex") for order_status in response]
+
+    # Cancel all the open orders of a contract (of every contract if it is None) with a single request
+    def cancel_all_orders(self, contract: typing.Optional[Contract] = None) -> bool:
+        data = dict()
+
+        if contract is not None:
+            data['symbol'] = contract.symbol
+
+        return self._make_request("DELETE", "/api/v1/order/all", data) is not None
+
+    # Bitmex contingent orders (OCO) are not available anymore: both exit orders are placed separately and the strategy
+    # cancels the other one when one of them is filled. Triggered on the last price, like the take profit and stop loss
+    # checked by the strategies
+    def place_exit_orders(self, contract: Contract, side: str, quantity: int, take_profit_price: typing.Optional[float],
+                          stop_loss_price: typing.Optional[float]) -> typing.Dict[str, typing.Optional[OrderStatus]]:
+        orders = dict()
+
+        if take_profit_price is not None:
+            orders['take_profit'] = self.place_order(contract, "MARKET_IF_TOUCHED", quantity, side,
+                                                     stop_price=take_profit_price, exec_inst="Close,LastPrice")
+        if stop_loss_price is not None:
+            orders['stop_loss'] = self.place_order(contract, "STOP", quantity, side,
+                                                   stop_price=stop_loss_price, exec_inst="Close,LastPrice")
+
+        return orders
+
+    # The contract is not needed by Bitmex, the argument keeps the same signature as the Binance client
+    def cancel_order(self, contract: Contract, order_id: str) -> OrderStatus:
         data = {
         'orderID': order_id
         }
@@ -204,32 +442,132 @@ class BitmexClient:
         self.ws = websocket.WebSocketApp(self._wss_url, on_open=self._on_open, on_close=self._on_close,
                                          on_error=self._on_error, on_message=self._on_message)
 
+        t = threading.Thread(target=self._watch_connection, daemon=True)
+        t.start()
+
 # Reconnect websocket connection if disconnected
         while True:
             try:
                 if self.reconnect:
-                    self.ws.run_forever()
+                    self.ws.run_forever(ping_interval=WS_PING_INTERVAL, ping_timeout=WS_PING_TIMEOUT)
                 else:
                     break
             except Exception as e:
                 logger.error("Bitmex error in run_forever() method: %s", e)
+
+            logger.info("Bitmex reconnecting in %s seconds", self._reconnect_delay)
+            time.sleep(self._reconnect_delay)
+            self._reconnect_delay = min(self._reconnect_delay * 2, WS_MAX_RECONNECT_DELAY)
+
+    def _watch_connection(self):
+        while self.reconnect:
+            time.sleep(1)
+
+            if not self._ws_connected:
+                continue
+
+            silence = time.time() - self._last_message
+
+            if silence > WS_STALE_TIMEOUT:
+                logger.warning("Bitmex no message received for %s seconds, closing the connection", WS_STALE_TIMEOUT)
+                self._ws_connected = False
+                self.ws.close()
+
+            # Only the symbols used are subscribed, the connection can be quiet: Bitmex answers "pong" to a "ping"
+            elif silence > WS_STALE_TIMEOUT / 2:
+                try:
+                    self.ws.send("ping")
+                except Exception as e:
+                    logger.error("Bitmex error while sending a ping: %s", e)
+
+    def watch_order(self, order_id: str, callback: typing.Callable[[OrderStatus], None]):
+        self._order_callbacks[order_id] = callback
+
+    def unwatch_order(self, order_id: str):
+        self._order_callbacks.pop(order_id, None)
+
+    # The order updates are only sent to an authenticated connection, kept separate from the market data connection
+    def _start_user_ws(self):
+        self._user_ws = websocket.WebSocketApp(self._wss_url, on_open=self._on_user_open, on_close=self._on_user_close,
+                                               on_error=self._on_user_error, on_message=self._on_user_message)
+
+        while self.reconnect:
+            try:
+                self._user_ws.run_forever()
+            except Exception as e:
+                logger.error("Bitmex error in the order stream run_forever() method: %s", e)
             time.sleep(2)
 
+    def _on_user_open(self, ws):
+        logger.info("Bitmex order stream opened")
+
+        expires = int((self.now_ms() + self.clock.recv_window()) / 1000)
+        signature = self._generate_signature("GET", "/realtime", str(expires), dict())
+
+        try:
+            ws.send(json.dumps({'op': "authKeyExpires", 'args': [self._public_key, expires, signature]}))
+            ws.send(json.dumps({'op': "subscribe", 'args': ["order"]}))
+        except Exception as e:
+            logger.error("Websocket error while subscribing to the Bitmex orders: %s", e)
+
+    def _on_user_close(self, ws, *args):
+        logger.warning("Bitmex order stream closed")
+
+    def _on_user_error(self, ws, msg: str):
+        logger.error("Bitmex order stream error: %s", msg)
+
+    def _on_user_message(self, ws, msg: str):
+        data = json.loads(msg)
+
+        if "table" in data and data['table'] == "order":
+            for d in data['data']:
+                # The updates only contain the fields that changed
+                if 'ordStatus' not in d:
+                    continue
+
+                callback = self._order_callbacks.get(d['orderID'])
+
+                if callback is not None:
+                    callback(OrderStatus(d, "bitmex_stream"))
+
+        elif "error" in data:
+            logger.error("Bitmex order stream error: %s", data['error'])
+
     def _on_open(self, ws):
         logger.info("Bitmex connection opened")
 
-        self.subscribe_channel("instrument")
+        self._last_message = time.time()
+        self._reconnect_delay = 1
+
+        # The topics subscribed from now on are sent by subscribe_channel()
+        with self._subscriptions_lock:
+            self._ws_connected = True
+            topics = list(self._subscriptions)
+
+        if len(topics) > 0:
+            self._send_subscription("subscribe", topics)
 
-        # Add trades data to subscriptions
-        self.subscribe_channel("trade")
+        if self._disconnected_at is not None:
+            t = threading.Thread(target=self.market_data.resync, args=(self._disconnected_at,), daemon=True)
+            t.start()
+            self._disconnected_at = None
 
-    def _on_close(self, ws):
+    def _on_close(self, ws, *args):
         logger.warning("Bitmex Websocket connection closed")
 
+        self._ws_connected = False
+
+        if self._disconnected_at is None:
+            self._disconnected_at = self.now_ms()
+
     def _on_error(self, ws, msg: str):
         logger.error("Bitmex connection error: %s", msg)
 
     def _on_message(self, ws, msg: str):
+        self._last_message = time.time()
+
+        if msg == "pong":
+            return
 
         data = json.loads(msg)
 
@@ -240,42 +578,41 @@ class BitmexClient:
 
                     symbol = d['symbol']
 
-                    if symbol not in self.prices:
-                        self.prices[symbol] = {'bid': None, 'ask': None}
-
-                    if 'bidPrice' in d:
-                        self.prices[symbol]['bid'] = d['bidPrice']
-                    if 'askPrice' in d:
-                        self.prices[symbol]['ask'] = d['askPrice']
-
-                    # PNL Calculation
-                    try:
-                        for b_index, strat in self.strategies.items():
-                            if strat.contract.symbol == symbol:
-                                for trade in strat.trades:
-                                    if trade.status == "open" and trade.entry_price is not None:
-
-                                        if trade.side == "long":
-                                            price = self.prices[symbol]['bid']
-                                        else:
-                                            price = self.prices[symbol]['ask']
-                                        multiplier = trade.contract.multiplier
-
-                                        # From documentation
-                                        if trade.contract.inverse:
-                                            if trade.side == "long":
-                                                trade.pnl = (
-                                                                        1 / trade.entry_price - 1 / price) * multiplier * trade.quantity
-                                            elif trade.side == "short":
-                                                trade.pnl = (
-                                                                        1 / price - 1 / trade.entry_price) * multiplier * trade.quantity
-                                        else:
-                                            if trade.side == "long":
-                                                trade.pnl = (price - trade.entry_price) * multiplier * trade.quantity
-                                            elif trade.side == "short":
-                                                trade.pnl = (trade.entry_price - price) * multiplier * trade.quantity
-                    except RuntimeError as e:
-                        logger.error("Error while looping through the Bitmex strategies: %s", e)
+                    # The instrument updates also contain other fields (funding, open interest...), only the
+                    # fields that changed are sent
+                    if 'bidPrice' in d or 'askPrice' in d:
+                        timestamp = self.now_ms()
+
+                        self.prices.update(symbol, d.get('bidPrice'), d.get('askPrice'), timestamp)
+
+                        bid, ask, _ = self.prices.get(symbol)
+
+                        if self.tick_recorder is not None:
+                            self.tick_recorder.record_book(symbol, bid, ask, timestamp)
+                    else:
+                        bid, ask, _ = self.prices.get(symbol)
+
+                    # PNL, take profit and stop loss of the strategies of the symbol
+                    self.market_data.on_price(symbol, bid, ask)
+
+            # Closed candles of the tradeBin1m/5m/1h topics
+            if data['table'] in BITMEX_TRADE_BINS and data['action'] in ["partial", "insert"]:
+                timeframe = BITMEX_TRADE_BINS[data['table']]
+
+                for d in data['data']:
+                    if d['open'] is None or d['close'] is None:
+                        continue
+                    self.market_data.on_kline(d['symbol'], timeframe, Candle(d, timeframe, "bitmex"), True)
+
+            if data['table'] == "orderBookL2_25":
+                levels = dict()
+
+                for d in data['data']:
+                    levels.setdefault(d['symbol'], []).append(d)
+
+                for symbol, symbol_levels in levels.items():
+                    if symbol in self.order_books:
+                        self.order_books[symbol].apply_l2(data['action'], symbol_levels)
 
             if data['table'] == "trade":
 
@@ -286,28 +623,88 @@ class BitmexClient:
                     # Timestamp represents time of the trade in this case
                     ts = int(dateutil.parser.isoparse(d['timestamp']).timestamp() * 1000)
 
-                    # Loop through strategies
-                    for key, strat in self.strategies.items():
-                        if strat.contract.symbol == symbol:
-                            res = strat.parse_trades(float(d['price']), float(d['size']), ts)
-                            strat.check_trade(res)
+                    self.clock.record_latency("trade", ts)
+
+                    price, size = float(d['price']), float(d['size'])
+
+                    if self.tick_recorder is not None:
+                        self.tick_recorder.record_trade(symbol, price, size, ts)
+
+                    self.market_data.on_trade(symbol, price, size, ts)
 
 
     # Class method to subscribe to a channel to recieve market data
     def subscribe_channel(self, topic: str):
+        if self._feed is not self:
+            self._feed.subscribe_channel(topic)
+            return
+
+        with self._subscriptions_lock:
+            self._subscriptions[topic] = self._subscriptions.get(topic, 0) + 1
+
+            # Already subscribed, or subscribed by _on_open()
+            if self._subscriptions[topic] > 1 or not self._ws_connected:
+                return
+
+        self._send_subscription("subscribe", [topic])
+
+    def unsubscribe_channel(self, topic: str):
+        if self._feed is not self:
+            self._feed.unsubscribe_channel(topic)
+            return
 
+        with self._subscriptions_lock:
+            if topic not in self._subscriptions:
+                return
+
+            self._subscriptions[topic] -= 1
+
+            if self._subscriptions[topic] > 0:
+                return
+
+            del self._subscriptions[topic]
+
+            if not self._ws_connected:
+                return
+
+        self._send_subscription("unsubscribe", [topic])
+
+    def _send_subscription(self, operation: str, topics: typing.List[str]):
         data = {
-        'op': "subscribe",
-        'args': []
+        'op': operation,
+        'args': topics
         }
-        data['args'].append(topic)
 
         try:
             self.ws.send(json.dumps(data))
         except Exception as e:
-            logger.error("Websocket error while subscribing to %s: %s", topic, e)
+            logger.error("Websocket error while sending %s for %s: %s", operation, topics, e)
+
+    # Trades of the symbol, used by the market data hub to build its candles
+    def subscribe_trades(self, contract: Contract):
+        self.subscribe_channel("trade:" + contract.symbol)
+
+    def unsubscribe_trades(self, contract: Contract):
+        self.unsubscribe_channel("trade:" + contract.symbol)
 
-    def get_trade_size(self, contract: Contract, price: float, balance_pct: float):
+    def subscribe_klines(self, contract: Contract, timeframe: str):
+        self.subscribe_channel("tradeBin" + timeframe + ":" + contract.symbol)
+
+    def unsubscribe_klines(self, contract: Contract, timeframe: str):
+        self.unsubscribe_channel("tradeBin" + timeframe + ":" + contract.symbol)
+
+    # Candles of every contract (topic without symbol), for the scanner
+    def subscribe_all_klines(self, timeframe: str):
+        self.subscribe_channel("tradeBin" + timeframe)
+
+    # Bid and ask of the symbol (instrument updates), for the watchlist and the PNL of the trades
+    def subscribe_prices(self, symbol: str):
+        self.subscribe_channel("instrument:" + symbol)
+
+    def unsubscribe_prices(self, symbol: str):
+        self.unsubscribe_channel("instrument:" + symbol)
+
+    def get_trade_size(self, contract: Contract, price: float, balance_pct: float, side: typing.Optional[str] = None):
 
         balance = self.get_balances()
         if balance is not None:
@@ -333,6 +730,16 @@ class BitmexClient:
 
         logger.info("Bitmex current XBT balance = %s, contracts number = %s", balance, contracts_number)
 
+        book = self.order_books.get(contract.symbol)
+
+        if side is not None and book is not None and book.synced:
+            max_contracts = book.max_quantity(side)
+
+            if 0 < max_contracts < contracts_number:
+                contracts_number = max_contracts
+                logger.info("Bitmex contracts number capped to %s by the %s order book depth", int(contracts_number),
+                            contract.symbol)
+
         return int(contracts_number)
 
 
@@ -0,0 +1,83 @@
+# Closes the candles on the timeframe boundaries instead of waiting for the first trade of the next candle
+# A single thread runs a timer wheel: every deadline goes into the slot of its tick, and at each tick the callbacks
+# whose deadline passed are called once with all their keys, so hundreds of series are closed in one batch
+
+import logging
+import threading
+import time
+import typing
+
+logger = logging.getLogger()
+
+
+class CandleScheduler:
+    def __init__(self, tick_ms: int = 50, slots: int = 1024):
+        self._tick_ms = tick_ms
+        self._slots: typing.List[typing.List[typing.Tuple[int, typing.Callable, typing.Any]]] = [[] for _ in range(slots)]
+
+        self._lock = threading.Lock()
+
+        self._current_tick = int(time.time() * 1000) // self._tick_ms
+
+        t = threading.Thread(target=self._run, daemon=True)
+        t.start()
+
+    # Call callback([key, ...]) once the local time (in milliseconds) reaches the deadline
+    def schedule(self, deadline: int, callback: typing.Callable[[typing.List], None], key: typing.Any):
+        with self._lock:
+            # A deadline in the past is processed at the next tick
+            tick = max(deadline // self._tick_ms, self._current_tick + 1)
+            self._slots[tick % len(self._slots)].append((deadline, callback, key))
+
+    def _run(self):
+        while True:
+            next_tick_time = (self._current_tick + 1) * self._tick_ms / 1000
+            delay = next_tick_time - time.time()
+
+            if delay > 0:
+                time.sleep(delay)
+
+            now_tick = int(time.time() * 1000) // self._tick_ms
+            now = now_tick * self._tick_ms + self._tick_ms - 1
+
+            due: typing.Dict[typing.Callable, typing.List] = dict()
+
+            with self._lock:
+                # Catch up with every tick elapsed since the last iteration (at most one round of the wheel)
+                first_tick = max(self._current_tick + 1, now_tick - len(self._slots) + 1)
+
+                for tick in range(first_tick, now_tick + 1):
+                    slot = self._slots[tick % len(self._slots)]
+                    remaining = []
+
+                    for deadline, callback, key in slot:
+                        # Deadlines more than one round away stay in the slot
+                        if deadline <= now:
+                            due.setdefault(callback, []).append(key)
+                        else:
+                            remaining.append((deadline, callback, key))
+
+                    self._slots[tick % len(self._slots)] = remaining
+
+                self._current_tick = now_tick
+
+            for callback, keys in due.items():
+                try:
+                    callback(keys)
+                except Exception as e:
+                    logger.error("Error in the candle scheduler callback %s: %s", callback, e)
+
+
+_scheduler: typing.Optional[CandleScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+# The scheduler (and its thread) shared by every client
+def get_scheduler() -> CandleScheduler:
+    global _scheduler
+
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = CandleScheduler()
+
+    return _scheduler
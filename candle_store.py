@@ -0,0 +1,335 @@
+# On-disk columnar store of the candles, for research and backtesting
+# Layout: <root>/<exchange>/<symbol>/<timeframe>/<YYYY-MM>/<column>.bin, one file per column (timestamp int64, open,
+# high, low, close and volume float64) holding the candles of the month (UTC), in time order
+# The files are only appended to, so they are read memory-mapped (np.memmap): nothing is copied when a month is read,
+# only the pages used are loaded, and reading only the close prices doesn't touch the other columns
+# The candles are queued by the market data hub (closed candles of the live series and historical downloads) and
+# written in batches by a writer thread. Candles older than the last one stored for the series are ignored
+
+import datetime
+import logging
+import os
+import queue
+import threading
+import time
+import typing
+
+import numpy as np
+
+from models import *
+
+# pyarrow is optional, only needed to export the series to Parquet (pip install pyarrow)
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger()
+
+STORE_DIR = "candles"
+
+COLUMNS: typing.Dict[str, typing.Type[np.generic]] = {"timestamp": np.int64, "open": np.float64, "high": np.float64,
+                                                     "low": np.float64, "close": np.float64, "volume": np.float64}
+
+# Seconds the writer thread waits for other candles before writing a batch, and maximum age of a batch (the candles of
+# many series stream continuously)
+BATCH_DELAY = 0.5
+BATCH_MAX_AGE = 2.0
+
+
+def _month(timestamp: int) -> str:
+    return datetime.datetime.fromtimestamp(timestamp / 1000, tz=datetime.timezone.utc).strftime("%Y-%m")
+
+
+class CandleStore:
+    def __init__(self, root: str = STORE_DIR):
+        self.root = root
+
+        # Timestamp of the last candle stored for each (exchange, symbol, timeframe), used by the writer thread only
+        self._last_timestamps: typing.Dict[typing.Tuple[str, str, str], int] = dict()
+
+        self._queue = queue.Queue()
+
+        t = threading.Thread(target=self._run, daemon=True)
+        t.start()
+
+    # Queue closed candles of a series (any thread)
+    def append(self, exchange: str, symbol: str, timeframe: str, candles: typing.List[Candle]):
+        if len(candles) == 0:
+            return
+
+        rows = [(c.timestamp, c.open, c.high, c.low, c.close, c.volume) for c in candles]
+        self._queue.put(("append", (exchange, symbol, timeframe), rows))
+
+    # Wait until the candles queued so far are written, returns False on timeout
+    def flush(self, timeout: typing.Optional[float] = None) -> bool:
+        event = threading.Event()
+        self._queue.put(("flush", event))
+        return event.wait(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            batch_start = time.monotonic()
+
+            try:
+                while time.monotonic() - batch_start < BATCH_MAX_AGE:
+                    batch.append(self._queue.get(timeout=BATCH_DELAY))
+            except queue.Empty:
+                pass
+
+            rows_by_series: typing.Dict[typing.Tuple[str, str, str], typing.List[tuple]] = dict()
+            events = []
+
+            for operation in batch:
+                if operation[0] == "append":
+                    rows_by_series.setdefault(operation[1], []).extend(operation[2])
+                else:
+                    events.append(operation[1])
+
+            # Any error (disk or malformed candles) loses the candles of the series, never the writer thread: flush()
+            # would wait for it forever
+            try:
+                for key, rows in rows_by_series.items():
+                    try:
+                        self._write(key, rows)
+                    except Exception as e:
+                        logger.error("Error while storing %s %s %s candles: %s", *key, e)
+                        # The last timestamp is read from the files again
+                        self._last_timestamps.pop(key, None)
+            finally:
+                for event in events:
+                    event.set()
+
+    def _write(self, key: typing.Tuple[str, str, str], rows: typing.List[tuple]):
+        last_timestamp = self._last_timestamp(key)
+
+        data = np.array(rows, dtype=np.float64)
+        data = data[data[:, 0] > last_timestamp]
+
+        if len(data) == 0:
+            return
+
+        # One row per timestamp (the last one queued), in time order
+        data = data[np.argsort(data[:, 0], kind="stable")]
+        data = data[np.append(data[1:, 0] != data[:-1, 0], True)]
+
+        timestamps = data[:, 0].astype(np.int64)
+        columns = [timestamps] + [np.ascontiguousarray(data[:, i]) for i in range(1, len(COLUMNS))]
+
+        # Rows of each month
+        months = timestamps.astype("datetime64[ms]").astype("datetime64[M]")
+        bounds = np.concatenate([[0], np.flatnonzero(months[1:] != months[:-1]) + 1, [len(data)]])
+
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            directory = self._partition_dir(*key, _month(int(timestamps[start])))
+            os.makedirs(directory, exist_ok=True)
+
+            for name, values in zip(COLUMNS, columns):
+                with open(os.path.join(directory, name + ".bin"), "ab") as f:
+                    f.write(values[start:end].tobytes())
+
+        self._last_timestamps[key] = int(timestamps[-1])
+
+    # Read from the last month stored the first time, the columns of the month are cut to the same length before new
+    # candles are appended to them
+    def _last_timestamp(self, key: typing.Tuple[str, str, str]) -> int:
+        if key not in self._last_timestamps:
+            months = self.months(*key)
+            timestamps = []
+
+            if len(months) > 0:
+                directory = self._partition_dir(*key, months[-1])
+                timestamps = self._read_partition(directory, ["timestamp"])["timestamp"]
+
+                for name, dtype in COLUMNS.items():
+                    path = os.path.join(directory, name + ".bin")
+                    if os.path.exists(path) and os.path.getsize(path) > len(timestamps) * np.dtype(dtype).itemsize:
+                        os.truncate(path, len(timestamps) * np.dtype(dtype).itemsize)
+
+            self._last_timestamps[key] = int(timestamps[-1]) if len(timestamps) > 0 else -1
+
+        return self._last_timestamps[key]
+
+    def _partition_dir(self, exchange: str, symbol: str, timeframe: str, month: str) -> str:
+        return os.path.join(self.root, exchange, symbol, timeframe, month)
+
+    # Months stored for the series, oldest first
+    def months(self, exchange: str, symbol: str, timeframe: str) -> typing.List[str]:
+        directory = os.path.join(self.root, exchange, symbol, timeframe)
+
+        if not os.path.isdir(directory):
+            return []
+
+        return sorted(os.listdir(directory))
+
+    # Series stored, as (exchange, symbol, timeframe)
+    def series(self) -> typing.List[typing.Tuple[str, str, str]]:
+        result = []
+
+        if not os.path.isdir(self.root):
+            return result
+
+        for exchange in sorted(os.listdir(self.root)):
+            for symbol in sorted(os.listdir(os.path.join(self.root, exchange))):
+                for timeframe in sorted(os.listdir(os.path.join(self.root, exchange, symbol))):
+                    result.append((exchange, symbol, timeframe))
+
+        return result
+
+    # Memory-mapped columns of a month. The number of candles is the length of the shortest column, in case the
+    # program stopped while a batch was written
+    @staticmethod
+    def _read_partition(directory: str, columns: typing.List[str]) -> typing.Dict[str, np.ndarray]:
+        paths = {name: os.path.join(directory, name + ".bin") for name in COLUMNS}
+
+        length = min(os.path.getsize(path) // np.dtype(COLUMNS[name]).itemsize if os.path.exists(path) else 0
+                     for name, path in paths.items())
+
+        if length == 0:
+            return {name: np.empty(0, dtype=COLUMNS[name]) for name in columns}
+
+        return {name: np.memmap(paths[name], dtype=COLUMNS[name], mode="r", shape=(length,)) for name in columns}
+
+    # Columns of the candles of the series from start to end (timestamps in milliseconds, included), one dict per month
+    # stored, oldest first. The columns are memory-mapped views of the files: nothing is copied or loaded until used
+    def read_parts(self, exchange: str, symbol: str, timeframe: str, start: typing.Optional[int] = None,
+                   end: typing.Optional[int] = None,
+                   columns: typing.Optional[typing.List[str]] = None) -> typing.List[typing.Dict[str, np.ndarray]]:
+        columns = list(COLUMNS) if columns is None else columns
+        needed = columns if "timestamp" in columns else ["timestamp"] + columns
+
+        months = self.months(exchange, symbol, timeframe)
+
+        if start is not None:
+            months = [m for m in months if m >= _month(start)]
+        if end is not None:
+            months = [m for m in months if m <= _month(end)]
+
+        parts = []
+
+        for month in months:
+            part = self._read_partition(self._partition_dir(exchange, symbol, timeframe, month), needed)
+
+            first = 0 if start is None else np.searchsorted(part["timestamp"], start, side="left")
+            last = len(part["timestamp"]) if end is None else np.searchsorted(part["timestamp"], end, side="right")
+
+            if last > first:
+                parts.append({name: part[name][first:last] for name in columns})
+
+        return parts
+
+    # Same as read_parts(), as contiguous columns: a single month is returned as memory-mapped views, several months are
+    # copied into new arrays
+    def read(self, exchange: str, symbol: str, timeframe: str, start: typing.Optional[int] = None,
+             end: typing.Optional[int] = None,
+             columns: typing.Optional[typing.List[str]] = None) -> typing.Dict[str, np.ndarray]:
+        columns = list(COLUMNS) if columns is None else columns
+
+        parts = self.read_parts(exchange, symbol, timeframe, start, end, columns)
+
+        if len(parts) == 0:
+            return {name: np.empty(0, dtype=COLUMNS[name]) for name in columns}
+
+        if len(parts) == 1:
+            return parts[0]
+
+        return {name: np.concatenate([part[name] for part in parts]) for name in columns}
+
+    # Candles objects of the series (e.g. for a backtest using the strategies)
+    def read_candles(self, exchange: str, symbol: str, timeframe: str, start: typing.Optional[int] = None,
+                     end: typing.Optional[int] = None) -> typing.List[Candle]:
+        candles = []
+
+        for data in self.read_parts(exchange, symbol, timeframe, start, end):
+            candles.extend(Candle({'ts': ts, 'open': o, 'high': h, 'low': l, 'close': c, 'volume': v}, timeframe,
+                                  "parse_trade")
+                           for ts, o, h, l, c, v in zip(data["timestamp"].tolist(), data["open"].tolist(),
+                                                        data["high"].tolist(), data["low"].tolist(),
+                                                        data["close"].tolist(), data["volume"].tolist()))
+
+        return candles
+
+    # Parquet file of the series, for the research tools that read Parquet (pandas, Polars, DuckDB...). One row group
+    # per month, the series is never loaded whole
+    def export_parquet(self, exchange: str, symbol: str, timeframe: str, path: str):
+        if pyarrow is None:
+            raise RuntimeError("pyarrow is needed to export Parquet files")
+
+        schema = pyarrow.schema([(name, pyarrow.from_numpy_dtype(dtype)) for name, dtype in COLUMNS.items()])
+
+        with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+            for data in self.read_parts(exchange, symbol, timeframe):
+                writer.write_table(pyarrow.table({name: np.asarray(values) for name, values in data.items()},
+                                                 schema=schema))
+
+
+if __name__ == '__main__':
+    # Ingestion and read benchmark: years of 1m candles of several symbols in a temporary directory
+    import argparse
+    import shutil
+    import tempfile
+    import time
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--symbols", type=int, default=12)
+    parser.add_argument("--years", type=float, default=1)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+
+    try:
+        store = CandleStore(root)
+
+        n = int(args.years * 365 * 1440)
+        start_ts = 1577836800000
+        timestamps = start_ts + np.arange(n, dtype=np.int64) * 60000
+        closes = 100 + np.cumsum(np.random.default_rng(0).normal(0, 0.1, n))
+
+        # The store is written with the numpy columns directly, through the writer thread
+        write_start = time.perf_counter()
+
+        for s in range(args.symbols):
+            key = ("Binance", f"SYM{s}USDT", "1m")
+            store._queue.put(("append", key, list(zip(timestamps.tolist(), closes.tolist(), closes.tolist(),
+                                                      closes.tolist(), closes.tolist(), [1.0] * n))))
+
+        store.flush()
+        write_elapsed = time.perf_counter() - write_start
+
+        print(f"{args.symbols} symbols x {n:,} 1m candles ({args.years} years) written in {write_elapsed:.1f} s "
+              f"({args.symbols * n / write_elapsed:,.0f} candles/s)")
+
+        # Best of 3 runs: contiguous columns (the months are copied), then memory-mapped months (nothing is read from
+        # the files until used)
+        read_elapsed = parts_elapsed = float("inf")
+
+        for _ in range(3):
+            read_start = time.perf_counter()
+            data = [store.read("Binance", f"SYM{s}USDT", "1m", columns=["timestamp", "close"])
+                    for s in range(args.symbols)]
+            read_elapsed = min(read_elapsed, time.perf_counter() - read_start)
+
+            read_start = time.perf_counter()
+            parts = [store.read_parts("Binance", f"SYM{s}USDT", "1m", columns=["timestamp", "close"])
+                     for s in range(args.symbols)]
+            parts_elapsed = min(parts_elapsed, time.perf_counter() - read_start)
+
+        assert all(np.array_equal(d["close"], closes) and np.array_equal(d["timestamp"], timestamps) for d in data)
+        assert all(np.array_equal(np.concatenate([p["close"] for p in symbol_parts]), closes)
+                   for symbol_parts in parts)
+
+        print(f"Close prices of the {args.symbols} symbols: {parts_elapsed * 1000:.1f} ms as memory-mapped months "
+              f"({len(parts[0])} months per symbol), {read_elapsed * 1000:.0f} ms as contiguous arrays")
+
+        month = store.read("Binance", "SYM0USDT", "1m", start_ts + 40 * 86400000, start_ts + 50 * 86400000)
+        print(f"10 days of one symbol: {len(month['close'])} candles, memory-mapped: "
+              f"{isinstance(month['close'].base, np.memmap) or isinstance(month['close'], np.memmap)}")
+
+        # Candles older than the last stored candle are ignored
+        store._queue.put(("append", ("Binance", "SYM0USDT", "1m"), [(start_ts, 1, 1, 1, 1, 1)]))
+        store.flush()
+        assert len(store.read("Binance", "SYM0USDT", "1m")["close"]) == n
+    finally:
+        shutil.rmtree(root)
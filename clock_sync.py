@@ -0,0 +1,118 @@
+# Estimate of the exchange clock, kept up to date in the background
+# The offset between the local clock and the exchange clock and the round trip time of the requests are smoothed
+# (exponentially weighted moving averages), so that a single slow request does not move the offset. The offset is used
+# for the timestamps of the signed requests and for the candles boundaries
+# The one-way latency of each websocket stream (exchange event time to local reception) is measured as well
+
+import logging
+import threading
+import time
+import typing
+
+logger = logging.getLogger()
+
+# Seconds between two clock samples
+SYNC_INTERVAL = 30
+
+# Weight of a new sample in the moving averages
+SMOOTHING = 0.2
+
+# Samples whose round trip is longer than OUTLIER_RTT times the average round trip are ignored (the offset is
+# estimated assuming the request took as long to go as to come back, which is less likely for a slow request)
+OUTLIER_RTT = 3
+
+# Seconds between two metrics logs
+METRICS_INTERVAL = 60
+
+
+class ClockSync:
+    # server_time is a function returning the exchange time in milliseconds (None if the request failed)
+    def __init__(self, exchange: str, server_time: typing.Callable[[], typing.Optional[float]]):
+        self._exchange = exchange
+        self._server_time = server_time
+
+        # Milliseconds to add to the local time to get the exchange time
+        self.offset = 0
+        # Average round trip time of the requests, in milliseconds
+        self.rtt: typing.Optional[float] = None
+
+        # Average one-way latency (in milliseconds) of each websocket stream
+        self.latencies: typing.Dict[str, float] = dict()
+
+        self._running = False
+        self._last_metrics = time.time()
+
+    # Request the exchange time once and update the estimates, returns False if the request failed
+    def sample(self) -> bool:
+        request_time = time.time() * 1000
+        server_time = self._server_time()
+        response_time = time.time() * 1000
+
+        if server_time is None:
+            return False
+
+        rtt = response_time - request_time
+        offset = server_time - (request_time + response_time) / 2
+
+        if self.rtt is None:
+            self.rtt = rtt
+            self.offset = int(offset)
+        elif rtt <= OUTLIER_RTT * self.rtt:
+            self.rtt += SMOOTHING * (rtt - self.rtt)
+            self.offset = int(self.offset + SMOOTHING * (offset - self.offset))
+        else:
+            logger.info("%s clock sample ignored, round trip of %.0f ms", self._exchange, rtt)
+            # The average still moves towards the new round trip time, in case the network got slower
+            self.rtt += SMOOTHING * (rtt - self.rtt)
+
+        return True
+
+    # Sample the exchange time every SYNC_INTERVAL seconds (in a thread)
+    def start(self):
+        if self._running:
+            return
+
+        self._running = True
+
+        t = threading.Thread(target=self._run, daemon=True)
+        t.start()
+
+    def stop(self):
+        self._running = False
+
+    def _run(self):
+        while self._running:
+            time.sleep(SYNC_INTERVAL)
+            self.sample()
+
+            if time.time() - self._last_metrics >= METRICS_INTERVAL:
+                self._last_metrics = time.time()
+                self.log_metrics()
+
+    # Current exchange time in milliseconds
+    def now_ms(self) -> int:
+        return int(time.time() * 1000) + self.offset
+
+    # Validity window of the signed requests: at least 5 s, more when the network is slow
+    def recv_window(self) -> int:
+        if self.rtt is None:
+            return 5000
+        return int(min(max(5000, 4 * self.rtt), 60000))
+
+    # Called by the websocket threads with the exchange time of the event received
+    def record_latency(self, stream: str, event_time: int):
+        latency = time.time() * 1000 + self.offset - event_time
+
+        if stream not in self.latencies:
+            self.latencies[stream] = latency
+        else:
+            self.latencies[stream] += SMOOTHING * (latency - self.latencies[stream])
+
+    def metrics(self) -> typing.Dict[str, typing.Any]:
+        return {"offset": self.offset, "rtt": self.rtt, "latencies": dict(self.latencies)}
+
+    def log_metrics(self):
+        latencies = ", ".join(f"{stream} {latency:.0f} ms" for stream, latency in list(self.latencies.items()))
+
+        logger.info("%s clock offset %s ms, round trip %s ms, feed latency: %s", self._exchange, self.offset,
+                    "-" if self.rtt is None else f"{self.rtt:.0f}", latencies if latencies != "" else "-")
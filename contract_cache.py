@@ -0,0 +1,133 @@
+# Contracts received from the exchanges are saved on disk (SQLite), already parsed, so that the UI can be filled at
+# startup without downloading and parsing the exchangeInfo/instrument payloads, which are the biggest REST responses
+# Use DB Browser for SQLite to visualize the database
+
+import hashlib
+import logging
+import sqlite3
+import time
+import typing
+
+from models import *
+
+logger = logging.getLogger()
+
+CACHE_FILE = "contracts_cache.db"
+
+# Age (in seconds) after which the contracts are requested again from the exchange
+CONTRACTS_TTL = 6 * 3600
+
+_CONTRACT_COLUMNS = ["exchange", "symbol", "base_asset", "quote_asset", "price_decimals", "quantity_decimals",
+                     "tick_size", "lot_size", "quanto", "inverse", "multiplier"]
+
+
+# Information about the contracts saved for an exchange
+class CacheMeta:
+    def __init__(self, row: typing.Optional[sqlite3.Row]):
+        if row is not None:
+            self.fetched_at: float = row['fetched_at']
+            self.etag: typing.Optional[str] = row['etag']
+            self.content_hash: typing.Optional[str] = row['content_hash']
+            self.version: int = row['version']
+        else:
+            self.fetched_at = 0.0
+            self.etag = None
+            self.content_hash = None
+            self.version = 0
+
+    # True when the contracts were fetched less than CONTRACTS_TTL seconds ago
+    def is_fresh(self) -> bool:
+        return time.time() - self.fetched_at < CONTRACTS_TTL
+
+
+# Both clients initialize in their own thread, so every call uses its own connection
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(CACHE_FILE, timeout=10)
+    conn.row_factory = sqlite3.Row
+
+    conn.execute("CREATE TABLE IF NOT EXISTS contracts (exchange TEXT, symbol TEXT, base_asset TEXT, quote_asset TEXT,"
+                 "price_decimals INTEGER, quantity_decimals INTEGER, tick_size NUMERIC, lot_size NUMERIC, quanto INTEGER,"
+                 "inverse INTEGER, multiplier NUMERIC, PRIMARY KEY (exchange, symbol))")
+    conn.execute("CREATE TABLE IF NOT EXISTS contracts_meta (exchange TEXT PRIMARY KEY, fetched_at REAL, etag TEXT,"
+                 "content_hash TEXT, version INTEGER)")
+
+    return conn
+
+
+# Hash of a raw REST payload, used to know if the contracts changed when the exchange doesn't support ETags
+def content_hash(payload: bytes) -> str:
+    return hashlib.sha1(payload).hexdigest()
+
+
+def load_meta(exchange: str) -> CacheMeta:
+    try:
+        conn = _connect()
+        try:
+            row = conn.execute("SELECT * FROM contracts_meta WHERE exchange = ?", (exchange,)).fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.warning("Could not read the contracts cache %s: %s", CACHE_FILE, e)
+        row = None
+
+    return CacheMeta(row)
+
+
+# Contracts saved for the exchange, sorted by symbol, without any parsing of the exchange payload
+def load_contracts(exchange: str) -> typing.Dict[str, Contract]:
+    contracts = dict()
+
+    try:
+        conn = _connect()
+        try:
+            rows = conn.execute("SELECT * FROM contracts WHERE exchange = ? ORDER BY symbol", (exchange,)).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.warning("Could not read the contracts cache %s: %s", CACHE_FILE, e)
+        return contracts
+
+    for row in rows:
+        contracts[row['symbol']] = Contract(row, "cache")
+
+    return contracts
+
+
+# Replace the contracts saved for the exchange, the version is increased
+def save_contracts(exchange: str, contracts: typing.Dict[str, Contract], etag: typing.Optional[str], payload_hash: str):
+    rows = []
+
+    for contract in contracts.values():
+        rows.append((exchange, contract.symbol, contract.base_asset, contract.quote_asset, contract.price_decimals,
+                     contract.quantity_decimals, contract.tick_size, contract.lot_size,
+                     getattr(contract, "quanto", None), getattr(contract, "inverse", None),
+                     getattr(contract, "multiplier", None)))
+
+    try:
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM contracts WHERE exchange = ?", (exchange,))
+                conn.executemany(f"INSERT INTO contracts ({', '.join(_CONTRACT_COLUMNS)}) "
+                                 f"VALUES ({', '.join(['?'] * len(_CONTRACT_COLUMNS))})", rows)
+                conn.execute("INSERT INTO contracts_meta (exchange, fetched_at, etag, content_hash, version) "
+                             "VALUES (?, ?, ?, ?, 1) ON CONFLICT(exchange) DO UPDATE SET fetched_at = excluded.fetched_at,"
+                             "etag = excluded.etag, content_hash = excluded.content_hash, version = version + 1",
+                             (exchange, time.time(), etag, payload_hash))
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.warning("Could not write the contracts cache %s: %s", CACHE_FILE, e)
+
+
+# The exchange confirmed the saved contracts are still valid (same ETag or same payload hash): only the TTL restarts
+def touch(exchange: str):
+    try:
+        conn = _connect()
+        try:
+            with conn:
+                conn.execute("UPDATE contracts_meta SET fetched_at = ? WHERE exchange = ?", (time.time(), exchange))
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.warning("Could not write the contracts cache %s: %s", CACHE_FILE, e)
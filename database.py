@@ -1,59 +1,288 @@
 # Use SQLite to save info in a database and load data when the application is opened, relational database
 # Use DB Browser for SQLite to visualize the database
+# The database is in WAL mode: one writer thread commits the changes in batches while any thread can read
+import logging
+import queue
 import sqlite3
+import threading
+import time
 import typing
 
-class WorkspaceData:
-    def __init__(self):
-        # Connect to the database
-        self.conn = sqlite3.connect("database.db")
-        # When data is received from database, return list of SQLite row objects (accessible like python dictionaries)
-        self.conn.row_factory = sqlite3.Row
+logger = logging.getLogger()
 
-        # Cursor object to make queries to the database
-        self.cursor = self.conn.cursor()
+DATABASE_FILE = "database.db"
 
-        # Table for data to store (one for watchlist and one for strategies)
-        self.cursor.execute("CREATE TABLE IF NOT EXISTS watchlist (symbol TEXT, exchange TEXT)")
-        self.cursor.execute("CREATE TABLE IF NOT EXISTS strategies (strategy_type TEXT, contract TEXT,"
-                            "timeframe TEXT, balance_pct REAL, take_profit REAL, stop_loss REAL, extra_params TEXT)")
+# Time (in seconds) the writer thread waits for more changes before committing a batch
+BATCH_DELAY = 0.2
 
-        # Commit changes or they won't be saved
-        self.conn.commit()
+# A batch is committed once it has this many changes or is this old (seconds), even if changes keep arriving
+BATCH_MAX_SIZE = 1000
+BATCH_MAX_AGE = 1.0
 
+# Schema migrations, applied in order. The number of migrations applied is stored in the user_version pragma
+MIGRATIONS = [
+    # 1. Tables created by the first versions of the program
+    [
+        "CREATE TABLE IF NOT EXISTS watchlist (symbol TEXT, exchange TEXT)",
+        "CREATE TABLE IF NOT EXISTS strategies (strategy_type TEXT, contract TEXT, timeframe TEXT, balance_pct REAL,"
+        "take_profit REAL, stop_loss REAL, extra_params TEXT)",
+    ],
+    # 2. Primary keys, so that the rows can be updated instead of deleting and inserting the whole table
+    [
+        # The position of the watchlist symbols keeps their order (the rowids don't once rows are deleted and inserted)
+        "CREATE TABLE watchlist_new (symbol TEXT, exchange TEXT, position INTEGER, PRIMARY KEY (symbol, exchange))",
+        "INSERT OR IGNORE INTO watchlist_new (symbol, exchange, position) SELECT symbol, exchange, rowid FROM watchlist "
+        "ORDER BY rowid",
+        "DROP TABLE watchlist",
+        "ALTER TABLE watchlist_new RENAME TO watchlist",
+        "CREATE TABLE strategies_new (position INTEGER PRIMARY KEY, strategy_type TEXT, contract TEXT, timeframe TEXT,"
+        "balance_pct REAL, take_profit REAL, stop_loss REAL, extra_params TEXT)",
+        "INSERT INTO strategies_new (position, strategy_type, contract, timeframe, balance_pct, take_profit, stop_loss,"
+        "extra_params) SELECT (SELECT COUNT(*) FROM strategies AS s WHERE s.rowid < strategies.rowid), strategy_type,"
+        "contract, timeframe, balance_pct, take_profit, stop_loss, extra_params FROM strategies",
+        "DROP TABLE strategies",
+        "ALTER TABLE strategies_new RENAME TO strategies",
+    ],
+    # 3. Trades, saved continuously while the strategies run, identified by their entry order (several trades can be
+    # opened in the same millisecond)
+    [
+        "CREATE TABLE trades (time INTEGER, exchange TEXT, symbol TEXT, strategy TEXT, side TEXT, entry_price REAL,"
+        "status TEXT, pnl REAL, quantity REAL, entry_id TEXT, PRIMARY KEY (exchange, entry_id))",
+    ],
+    # 4. Exit mode of the strategies (take profit and stop loss checked locally or placed on the exchange)
+    [
+        "ALTER TABLE strategies ADD COLUMN exit_mode TEXT",
+    ],
+    # 5. Candle source of the strategies (trades or kline streams)
+    [
+        "ALTER TABLE strategies ADD COLUMN candle_source TEXT",
+    ],
+]
 
-    # Delete the previous table content and record new data in it
-    def save(self, table: str, data: typing.List[typing.Tuple]):
-        # Each tuple is a row to insert in the database table
-        # Each element in the tuple is a value for a column in the row
-        # Delete previous content of the table
-        self.cursor.execute(f"DELETE FROM {table}")
+# Columns of the rows passed to WorkspaceData.save() and the columns identifying a row. A key that is not one of the
+# columns ("position") is the index of the row in the data saved. The rows of the "ordered" tables also store that
+# index in a position column, the order in which they are read back
+TABLES = {
+    "watchlist": {"columns": ["symbol", "exchange"], "key": ["symbol", "exchange"], "ordered": True},
+    "strategies": {"columns": ["strategy_type", "contract", "timeframe", "balance_pct", "take_profit", "stop_loss",
+                               "extra_params", "exit_mode", "candle_source"], "key": ["position"]},
+    "trades": {"columns": ["time", "exchange", "symbol", "strategy", "side", "entry_price", "status", "pnl", "quantity",
+                           "entry_id"], "key": ["exchange", "entry_id"]},
+}
 
-        # "INSERT INTO watchlist (symbol, exchange) VALUE(?, ?)"
 
-        # Get list of columns for the table
-        table_data = self.cursor.execute(f"SELECT * FROM {table}")
+# Row of the trades table for a trade of a strategy (models.Trade)
+def trade_row(trade) -> typing.Tuple:
+    return (trade.time, trade.contract.exchange, trade.contract.symbol, trade.strategy, trade.side, trade.entry_price,
+            trade.status, trade.pnl, trade.quantity, str(trade.entry_id))
 
-        # Loop through the description attribute of the cursor that is returned by the above statement
-        # Creates a list of columns because description is a list of tuples and the column name is the first element of
-        # each tuple
-        columns = [description[0] for description in table_data.description]
 
-        # Join method converts list of columns into a string where each element is separated by a comma,
-        sql_statement = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})"
+# Key of a trade in the trades table and in the trades displayed: its exchange and the id of its entry order
+def trade_key(trade) -> typing.Tuple[str, str]:
+    return trade.contract.exchange, str(trade.entry_id)
 
-        # Insert rows
-        self.cursor.executemany(sql_statement, data)
-        self.conn.commit()
 
-    # Get data from table - get all the rows recorded for the table
-    def get(self, table: str) -> typing.List[sqlite3.Row]:
-        # Execute SQL statement to get all the rows of the table
-        self.cursor.execute(f"SELECT * FROM {table}")
-        data = self.cursor.fetchall()
+# Columns of a table in the database: the key, the other columns, then the position for the ordered tables
+def _stored_columns(table: str) -> typing.List[str]:
+    info = TABLES[table]
+    columns = info['key'] + [c for c in info['columns'] if c not in info['key']]
+
+    if info.get('ordered', False):
+        columns.append("position")
+
+    return columns
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+    # When data is received from database, return list of SQLite row objects (accessible like python dictionaries)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+# Each migration is applied in its own explicit transaction: the sqlite3 module doesn't open one before the CREATE,
+# DROP and ALTER statements, so a failed migration would otherwise leave its first tables behind
+def _migrate(conn: sqlite3.Connection):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+    for number in range(version, len(MIGRATIONS)):
+        conn.execute("BEGIN")
+
+        try:
+            for statement in MIGRATIONS[number]:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {number + 1}")
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+        conn.commit()
+
+        logger.info("Database migration %s applied", number + 1)
+
+
+# Single thread writing to the database. Changes are queued by any thread and committed together
+class _Writer:
+    def __init__(self, path: str):
+        self._conn = _connect(path)
+        _migrate(self._conn)
+
+        # SQL statements are built once per table, the sqlite3 module keeps them prepared in its statement cache
+        self._upsert_sql = dict()
+        self._delete_sql = dict()
+
+        for table, info in TABLES.items():
+            columns = _stored_columns(table)
+            updates = [f"{c} = excluded.{c}" for c in columns if c not in info['key']]
+            conflict = f"DO UPDATE SET {', '.join(updates)}" if len(updates) > 0 else "DO NOTHING"
+
+            self._upsert_sql[table] = f"INSERT INTO {table} ({', '.join(columns)}) " \
+                                      f"VALUES ({', '.join(['?'] * len(columns))}) " \
+                                      f"ON CONFLICT ({', '.join(info['key'])}) {conflict}"
+            self._delete_sql[table] = f"DELETE FROM {table} WHERE " + " AND ".join(f"{k} = ?" for k in info['key'])
+
+        # Last rows written for each key, so that only the rows that changed are written
+        self._written: typing.Dict[str, typing.Dict[tuple, tuple]] = dict()
+
+        self._queue = queue.Queue()
+
+        t = threading.Thread(target=self._run, daemon=True)
+        t.start()
+
+    def put(self, operation: typing.Tuple):
+        self._queue.put(operation)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            batch_start = time.monotonic()
+
+            # Wait a little for other changes, to commit them in the same transaction
+            try:
+                while len(batch) < BATCH_MAX_SIZE and time.monotonic() - batch_start < BATCH_MAX_AGE:
+                    batch.append(self._queue.get(timeout=BATCH_DELAY))
+            except queue.Empty:
+                pass
+
+            events = [operation[1] for operation in batch if operation[0] == "flush"]
+
+            # Any error (database or malformed change) loses the batch, never the writer thread: flush() would wait for
+            # it forever
+            try:
+                with self._conn:
+                    for operation in batch:
+                        if operation[0] == "replace":
+                            self._replace(operation[1], operation[2])
+                        elif operation[0] == "upsert":
+                            self._upsert(operation[1], operation[2])
+            except Exception as e:
+                logger.error("Error while writing %s changes to the database: %s", len(batch), e)
+                # Written rows are not known anymore, the next save writes everything again
+                self._written = dict()
+            finally:
+                for event in events:
+                    event.set()
+
+    # Rows keyed by their primary key values (position in the data when the key is not a column)
+    def _keyed_rows(self, table: str, data: typing.List[typing.Tuple]) -> typing.Dict[tuple, tuple]:
+        info = TABLES[table]
+        key_indexes = [info['columns'].index(k) for k in info['key'] if k in info['columns']]
+        other_indexes = [i for i in range(len(info['columns'])) if info['columns'][i] not in info['key']]
 
-        return data
+        rows = dict()
 
+        for position, row in enumerate(data):
+            if len(key_indexes) == len(info['key']):
+                key = tuple(row[i] for i in key_indexes)
+            else:
+                key = (position,)
+            rows[key] = key + tuple(row[i] for i in other_indexes)
 
+            if info.get('ordered', False):
+                rows[key] += (position,)
+
+        return rows
+
+    def _written_rows(self, table: str) -> typing.Dict[tuple, tuple]:
+        if table not in self._written:
+            info = TABLES[table]
+            columns = _stored_columns(table)
+
+            self._written[table] = dict()
+
+            for row in self._conn.execute(f"SELECT {', '.join(columns)} FROM {table}"):
+                self._written[table][tuple(row[k] for k in info['key'])] = tuple(row)
+
+        return self._written[table]
+
+    # The table content becomes the data: rows that changed are upserted, rows not in the data are deleted
+    def _replace(self, table: str, data: typing.List[typing.Tuple]):
+        rows = self._keyed_rows(table, data)
+        written = self._written_rows(table)
+
+        removed = [key for key in written if key not in rows]
+        changed = [row for key, row in rows.items() if written.get(key) != row]
+
+        self._conn.executemany(self._delete_sql[table], removed)
+        self._conn.executemany(self._upsert_sql[table], changed)
+
+        for key in removed:
+            del written[key]
+        for key, row in rows.items():
+            written[key] = row
+
+    def _upsert(self, table: str, data: typing.List[typing.Tuple]):
+        rows = self._keyed_rows(table, data)
+        written = self._written_rows(table)
+
+        changed = [row for key, row in rows.items() if written.get(key) != row]
+
+        self._conn.executemany(self._upsert_sql[table], changed)
+
+        written.update(rows)
+
+
+_writers: typing.Dict[str, _Writer] = dict()
+_writers_lock = threading.Lock()
+
+
+class WorkspaceData:
+    def __init__(self, path: str = DATABASE_FILE):
+        # Every WorkspaceData object of the program shares the same writer thread (which applies the migrations)
+        with _writers_lock:
+            if path not in _writers:
+                _writers[path] = _Writer(path)
+
+        self._writer = _writers[path]
+        self._path = path
+
+        # One connection per thread for the reads, WAL mode lets them read while the writer thread writes
+        self._local = threading.local()
+
+    # Replace the content of the table by the data (only the rows that changed are written, in the background)
+    def save(self, table: str, data: typing.List[typing.Tuple]):
+        # Each tuple is a row to save in the database table
+        # Each element in the tuple is a value for a column in the row, in the order of TABLES[table]['columns']
+        self._writer.put(("replace", table, list(data)))
+
+    # Insert or update rows without deleting the other rows of the table, e.g. the trades
+    def upsert(self, table: str, data: typing.List[typing.Tuple]):
+        self._writer.put(("upsert", table, list(data)))
+
+    # Wait until the changes queued so far are committed, returns False if the timeout expired
+    def flush(self, timeout: typing.Optional[float] = None) -> bool:
+        event = threading.Event()
+        self._writer.put(("flush", event))
+        return event.wait(timeout)
+
+    # Get data from table - get all the rows recorded for the table, in the order of the data saved for the ordered
+    # tables and the strategies (keyed by position), in insertion order for the trades
+    def get(self, table: str) -> typing.List[sqlite3.Row]:
+        if not hasattr(self._local, "conn"):
+            self._local.conn = _connect(self._path)
 
+        order = "position" if TABLES[table].get('ordered', False) else "rowid"
 
+        return self._local.conn.execute(f"SELECT * FROM {table} ORDER BY {order}").fetchall()
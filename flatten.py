@@ -0,0 +1,96 @@
+# Close every position opened by the strategies as fast as possible ("flatten everything"), e.g. when the application
+# is closed. The exchanges are flattened concurrently. On each exchange the open orders (exit orders) of the symbols
+# are canceled concurrently, then the positions are closed with reduce-only market orders sent in batches
+
+import logging
+import time
+import typing
+
+from concurrent.futures import ThreadPoolExecutor
+
+from models import *
+
+if typing.TYPE_CHECKING:
+    from bitmex import BitmexClient
+    from binance_futures import BinanceFuturesClient
+
+logger = logging.getLogger()
+
+
+# Open trades of the strategies of the client, by symbol
+def _open_trades(client: typing.Union["BitmexClient", "BinanceFuturesClient"]) -> typing.Dict[str, typing.List[Trade]]:
+    trades = dict()
+
+    for b_index, strat in client.strategies.items():
+        for trade in strat.trades:
+            if trade.status == "open":
+                trades.setdefault(trade.contract.symbol, []).append(trade)
+
+    return trades
+
+
+# Close the positions of the strategies of one exchange, returns the number of symbols that could not be flattened
+def flatten_exchange(client: typing.Union["BitmexClient", "BinanceFuturesClient"]) -> int:
+    trades = _open_trades(client)
+
+    if len(trades) == 0:
+        return 0
+
+    contracts = {symbol: symbol_trades[0].contract for symbol, symbol_trades in trades.items()}
+
+    # The exit orders are canceled first so that they cannot be triggered while the positions are closed
+    with ThreadPoolExecutor(max_workers=min(len(contracts), 10)) as executor:
+        list(executor.map(client.cancel_all_orders, contracts.values()))
+
+    # One order per symbol, for the net quantity of the trades (long trades are positive)
+    orders = []
+
+    for symbol, symbol_trades in trades.items():
+        net_quantity = sum(t.quantity if t.side == "long" else -t.quantity for t in symbol_trades)
+
+        if net_quantity != 0:
+            orders.append({'contract': contracts[symbol], 'order_type': "MARKET", 'quantity': abs(net_quantity),
+                           'side': "sell" if net_quantity > 0 else "buy", 'reduce_only': True})
+
+    statuses = client.place_batch_orders(orders)
+
+    failed = {order['contract'].symbol for order, order_status in zip(orders, statuses) if order_status is None}
+
+    closed = set()
+
+    for symbol, symbol_trades in trades.items():
+        if symbol in failed:
+            continue
+
+        for trade in symbol_trades:
+            trade.status = "closed"
+            closed.add(id(trade))
+
+            for order_id in trade.exit_orders.values():
+                client.unwatch_order(order_id)
+
+    # The trades closed are collected with the other changes of their strategy (Strategy.changed_trades())
+    for b_index, strat in client.strategies.items():
+        if strat.contract.symbol in trades and strat.contract.symbol not in failed:
+            strat.ongoing_position = False
+
+            for trade in strat.trades:
+                if id(trade) in closed:
+                    strat.trade_changed(trade)
+
+    return len(failed)
+
+
+# Flatten every exchange concurrently, returns the number of symbols that could not be flattened and the time to flat
+# in seconds
+def flatten_all(clients: typing.List[typing.Union["BitmexClient", "BinanceFuturesClient"]]) -> typing.Tuple[int, float]:
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+        failed = sum(executor.map(flatten_exchange, clients))
+
+    elapsed = time.perf_counter() - start
+
+    logger.info("Flatten everything done in %.0f ms (%s symbols failed)", elapsed * 1000, failed)
+
+    return failed, elapsed
@@ -0,0 +1,345 @@
+# Headless mode: the strategies saved in the workspace run without the Tkinter interface (no event loop and no display
+# needed, e.g. on a server)
+# The runner does the bookkeeping of the root component (trades saved to the database, logs collected) in its own loop,
+# and its status is available from a local HTTP endpoint (JSON), also used by the command line:
+#   python main.py --headless --port 8765
+#   python headless.py status --port 8765
+#   python headless.py flatten --port 8765
+# Every request must carry the token written (readable by the user only) to headless_<port>.token when the runner
+# starts, which the command line reads. Requests sent by a web browser (with an Origin header) are rejected: a page
+# open on the same machine could otherwise close the positions with a simple POST to 127.0.0.1
+
+import argparse
+import collections
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+import typing
+import urllib.request
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from database import DATABASE_FILE, WorkspaceData, trade_row
+from flatten import flatten_all
+from strategies import create_strategy
+from utils import CpuMeter
+
+if typing.TYPE_CHECKING:
+    from bitmex import BitmexClient
+    from binance_futures import BinanceFuturesClient
+
+logger = logging.getLogger()
+
+# Seconds between two bookkeeping iterations (the interface updates every 1.5 s)
+UPDATE_INTERVAL = 1.5
+
+# Seconds to wait for the clients to receive their contracts and balances before activating the strategies
+READY_TIMEOUT = 60
+
+# Number of logs kept for the status endpoint
+MAX_LOGS = 200
+
+DEFAULT_PORT = 8765
+
+# Header of the token of the local API
+TOKEN_HEADER = "X-Auth-Token"
+
+
+def token_file(port: int) -> str:
+    return f"headless_{port}.token"
+
+
+# New random token of the local API, the file is only readable and writable by the user
+def _write_token(port: int) -> str:
+    token = secrets.token_hex(32)
+
+    path = token_file(port)
+    if os.path.exists(path):
+        os.remove(path)
+
+    with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), "w") as f:
+        f.write(token)
+
+    return token
+
+
+# Strategies saved in the workspace with the index of their row in the strategy editor
+def workspace_strategies(db: WorkspaceData) -> typing.List[typing.Tuple[int, typing.Dict[str, typing.Any]]]:
+    return [(b_index, dict(row)) for b_index, row in enumerate(db.get("strategies"), start=1)]
+
+
+class HeadlessRunner:
+    # rows: the strategies to run (see workspace_strategies()), every strategy of the workspace by default
+    # database: workspace of the account of the clients
+    def __init__(self, binance: "BinanceFuturesClient", bitmex: "BitmexClient", port: typing.Optional[int] = None,
+                 rows: typing.Optional[typing.List[typing.Tuple[int, typing.Dict[str, typing.Any]]]] = None,
+                 database: str = DATABASE_FILE):
+        self.binance = binance
+        self.bitmex = bitmex
+
+        self._exchanges = {"Binance": binance, "Bitmex": bitmex}
+
+        self._db = WorkspaceData(database)
+        self._rows = rows
+
+        # Last logs of the clients and the strategies
+        self.logs: typing.Deque[str] = collections.deque(maxlen=MAX_LOGS)
+
+        self._port = port
+        self._server: typing.Optional[ThreadingHTTPServer] = None
+        self._token: typing.Optional[str] = None
+
+        self._running = False
+        self.cpu = CpuMeter()
+
+    # Activate the strategies of the workspace, then run the bookkeeping loop until stop() is called (or Ctrl+C)
+    def run(self, duration: typing.Optional[float] = None):
+        self._running = True
+
+        if self._port is not None:
+            self._start_server()
+
+        self._wait_ready()
+        self.activate_strategies()
+
+        self.cpu.reset()
+        start = time.time()
+
+        try:
+            while self._running and (duration is None or time.time() - start < duration):
+                self.update()
+                time.sleep(UPDATE_INTERVAL)
+        except KeyboardInterrupt:
+            logger.info("Headless runner interrupted")
+
+        self._shutdown()
+
+    def _wait_ready(self):
+        start = time.time()
+
+        while not all(client.ready for client in self._exchanges.values()):
+            if time.time() - start > READY_TIMEOUT:
+                logger.warning("Clients not ready after %s s: %s", READY_TIMEOUT,
+                               ", ".join(e for e, client in self._exchanges.items() if not client.ready))
+                break
+            time.sleep(0.1)
+
+    # Create and start the strategies, returns the number of strategies started
+    def activate_strategies(self) -> int:
+        started = 0
+
+        rows = self._rows if self._rows is not None else workspace_strategies(self._db)
+
+        for b_index, row in rows:
+            if row['contract'] is None or "_" not in row['contract']:
+                logger.warning("Strategy %s: missing contract", b_index)
+                continue
+
+            symbol, exchange = row['contract'].split("_")
+
+            if exchange not in self._exchanges:
+                continue
+
+            client = self._exchanges[exchange]
+
+            if symbol not in client.contracts:
+                logger.warning("Strategy %s: %s is not available on %s", b_index, symbol, exchange)
+                continue
+
+            if any(row[param] in (None, "") for param in ["balance_pct", "take_profit", "stop_loss"]):
+                logger.warning("Strategy %s: missing balance %%, take profit or stop loss", b_index)
+                continue
+
+            strategy = create_strategy(client, row['strategy_type'], client.contracts[symbol], exchange,
+                                       row['timeframe'], float(row['balance_pct']), float(row['take_profit']),
+                                       float(row['stop_loss']), json.loads(row['extra_params']),
+                                       (row['exit_mode'] or "Local").lower(), (row['candle_source'] or "Trades").lower())
+
+            if strategy is None:
+                logger.warning("Strategy %s: unknown strategy type or missing parameter", b_index)
+                continue
+
+            if not client.market_data.subscribe(strategy):
+                logger.warning("Strategy %s: no historical data retrieved for %s", b_index, symbol)
+                continue
+
+            client.strategies[b_index] = strategy
+            started += 1
+
+            self._add_log(f"{row['strategy_type']} strategy on {symbol} / {row['timeframe']} started")
+
+        logger.info("Headless runner: %s strategies started", started)
+
+        return started
+
+    def _add_log(self, msg: str):
+        logger.info("%s", msg)
+        self.logs.append(msg)
+
+    # Collect the new logs and save the trades, same as Root._update_ui() without the widgets
+    def update(self):
+        for client in self._exchanges.values():
+            for log in client.logs:
+                if not log['displayed']:
+                    self.logs.append(log['log'])
+                    log['displayed'] = True
+
+        trades_to_save = []
+
+        for client in self._exchanges.values():
+            for b_index, strat in client.strategies.items():
+                for log in strat.logs:
+                    if not log['displayed']:
+                        self.logs.append(log['log'])
+                        log['displayed'] = True
+
+                trades_to_save.extend(trade_row(trade) for trade in strat.changed_trades())
+
+        if len(trades_to_save) > 0:
+            self._db.upsert("trades", trades_to_save)
+
+    # Ends run() (from another thread or the local API)
+    def stop(self):
+        self._running = False
+
+    def _shutdown(self):
+        self._running = False
+
+        strategies = sum(len(client.strategies) for client in self._exchanges.values())
+        logger.info("Headless runner stopped: %s strategies, %.1f%% CPU on average", strategies, self.cpu.percent())
+
+        for client in self._exchanges.values():
+            client.reconnect = False
+
+        self.update()
+        self._db.flush(timeout=5)
+
+        for client in self._exchanges.values():
+            if client.ws is not None:
+                client.ws.close()
+
+        if self._server is not None:
+            # shutdown() waits for serve_forever() to return, it must not be called from a request thread
+            threading.Thread(target=self._server.shutdown, daemon=True).start()
+
+            if os.path.exists(token_file(self._port)):
+                os.remove(token_file(self._port))
+
+    # Status of the clients and the strategies (JSON serializable)
+    def status(self) -> typing.Dict[str, typing.Any]:
+        exchanges = dict()
+
+        for exchange, client in self._exchanges.items():
+            exchanges[exchange] = {
+                "ready": client.ready,
+                "connected": client.connected,
+                "clock": client.clock.metrics(),
+                "balances": {asset: balance.wallet_balance for asset, balance in list(client.balances.items())
+                             if balance.wallet_balance != 0},
+            }
+
+        strategies = []
+        trades = []
+
+        for exchange, client in self._exchanges.items():
+            for b_index, strat in client.strategies.items():
+                strat_trades = list(strat.trades)
+
+                strategies.append({"index": b_index, "strategy": strat.stat_name, "exchange": exchange,
+                                   "symbol": strat.contract.symbol, "timeframe": strat.tf,
+                                   "ongoing_position": strat.ongoing_position, "trades": len(strat_trades),
+                                   "pnl": sum(t.pnl for t in strat_trades)})
+
+                for trade in strat_trades:
+                    trades.append(dict(zip(["time", "exchange", "symbol", "strategy", "side", "entry_price", "status",
+                                            "pnl", "quantity", "entry_id"], trade_row(trade))))
+
+        return {"running": self._running, "cpu_percent": round(self.cpu.percent(), 1), "exchanges": exchanges,
+                "strategies": strategies, "trades": trades, "logs": list(self.logs)}
+
+    # Local API
+
+    def _start_server(self):
+        runner = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Returns False (and answers 403) if the request doesn't come from the command line or a local script. The
+            # headers are decoded as latin-1, compared as bytes (compare_digest() rejects non-ASCII strings)
+            def _authorized(self) -> bool:
+                token = self.headers.get(TOKEN_HEADER, "").encode("latin-1")
+
+                if self.headers.get("Origin") is not None or not hmac.compare_digest(token, runner._token.encode()):
+                    self._send({"error": "forbidden"}, 403)
+                    return False
+
+                return True
+
+            def do_GET(self):
+                if not self._authorized():
+                    return
+
+                status = runner.status()
+
+                if self.path in ["/", "/status"]:
+                    self._send(status)
+                elif self.path.strip("/") in ["strategies", "trades", "logs", "exchanges"]:
+                    self._send(status[self.path.strip("/")])
+                else:
+                    self._send({"error": "not found"}, 404)
+
+            def do_POST(self):
+                if not self._authorized():
+                    return
+
+                if self.path == "/flatten":
+                    failed, elapsed = flatten_all(list(runner._exchanges.values()))
+                    self._send({"failed": failed, "elapsed_ms": round(elapsed * 1000)})
+                elif self.path == "/stop":
+                    self._send({"stopping": True})
+                    runner.stop()
+                else:
+                    self._send({"error": "not found"}, 404)
+
+            def _send(self, data: typing.Any, code: int = 200):
+                body = json.dumps(data).encode()
+
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            # The requests are not written to the logs
+            def log_message(self, *args):
+                pass
+
+        # Only reachable from the machine itself, and with the token: the API can close the positions
+        self._token = _write_token(self._port)
+        self._server = ThreadingHTTPServer(("127.0.0.1", self._port), Handler)
+        self._server.daemon_threads = True
+
+        t = threading.Thread(target=self._server.serve_forever, daemon=True)
+        t.start()
+
+        logger.info("Headless runner status on http://127.0.0.1:%s/status", self._port)
+
+
+# Command line client of the local API of a running headless runner
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Status and commands of the headless runner")
+    parser.add_argument("command", choices=["status", "strategies", "trades", "logs", "flatten", "stop"])
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    url = f"http://127.0.0.1:{args.port}/{args.command}"
+    method = "POST" if args.command in ["flatten", "stop"] else "GET"
+
+    with open(token_file(args.port)) as f:
+        headers = {TOKEN_HEADER: f.read().strip()}
+
+    with urllib.request.urlopen(urllib.request.Request(url, headers=headers, method=method), timeout=30) as response:
+        print(json.dumps(json.loads(response.read()), indent=2))
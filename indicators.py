@@ -0,0 +1,612 @@
+# Technical indicators shared by the strategies and the scanner
+# Batch functions compute an indicator over a NumPy array of candles values (1-D, or 2-D with one row per symbol, along
+# the last axis) and return arrays of the same shape, NaN where the indicator is not defined yet. The loops (moving
+# averages, rolling windows) run in Numba-compiled kernels when Numba is installed, in pandas otherwise
+# The classes compute the same values incrementally, one candle at a time (update() with the candle that just closed)
+
+import collections
+import math
+import typing
+
+import numpy as np
+import pandas as pd
+
+# Numba is optional (pip install numba)
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+# Kernels: 2-D float arrays, computed along the rows. NaN values are handled as pandas does: the exponential averages
+# skip them (the weights of the previous values still decay), a rolling window containing one is NaN
+
+def _ewm_kernel(values, alpha, adjust, min_periods):
+    rows, n = values.shape
+    result = np.empty((rows, n))
+
+    new_weight = 1.0 if adjust else alpha
+
+    for r in range(rows):
+        weighted = np.nan
+        old_weight = 1.0
+        count = 0
+
+        for i in range(n):
+            x = values[r, i]
+            observed = x == x
+
+            if observed:
+                count += 1
+
+            if weighted == weighted:
+                old_weight *= 1 - alpha
+
+                if observed:
+                    if weighted != x:
+                        weighted = (old_weight * weighted + new_weight * x) / (old_weight + new_weight)
+
+                    if adjust:
+                        old_weight += new_weight
+                    else:
+                        old_weight = 1.0
+            elif observed:
+                weighted = x
+
+            if count >= min_periods and count > 0:
+                result[r, i] = weighted
+            else:
+                result[r, i] = np.nan
+
+    return result
+
+
+# Rolling mean and standard deviation (ddof 0), the sums are shifted by the first value of the row (not NaN) to limit
+# the rounding errors on large prices. The NaN values in the window are counted instead of summed
+def _rolling_mean_std_kernel(values, length):
+    rows, n = values.shape
+    means = np.full((rows, n), np.nan)
+    stds = np.full((rows, n), np.nan)
+
+    for r in range(rows):
+        shift = 0.0
+        for i in range(n):
+            if values[r, i] == values[r, i]:
+                shift = values[r, i]
+                break
+
+        total = 0.0
+        total_squares = 0.0
+        missing = 0
+
+        for i in range(n):
+            x = values[r, i] - shift
+
+            if x == x:
+                total += x
+                total_squares += x * x
+            else:
+                missing += 1
+
+            if i >= length:
+                old = values[r, i - length] - shift
+
+                if old == old:
+                    total -= old
+                    total_squares -= old * old
+                else:
+                    missing -= 1
+
+            if i >= length - 1 and missing == 0:
+                mean = total / length
+                means[r, i] = mean + shift
+                stds[r, i] = math.sqrt(max(total_squares / length - mean * mean, 0.0))
+
+    return means, stds
+
+
+# A NaN value in the window makes the result NaN (NaN is never replaced: the comparisons with it are false)
+def _rolling_max_kernel(values, length):
+    rows, n = values.shape
+    result = np.full((rows, n), np.nan)
+
+    for r in range(rows):
+        for i in range(length - 1, n):
+            highest = values[r, i - length + 1]
+            for j in range(i - length + 2, i + 1):
+                if values[r, j] > highest or values[r, j] != values[r, j]:
+                    highest = values[r, j]
+            result[r, i] = highest
+
+    return result
+
+
+def _rolling_min_kernel(values, length):
+    rows, n = values.shape
+    result = np.full((rows, n), np.nan)
+
+    for r in range(rows):
+        for i in range(length - 1, n):
+            lowest = values[r, i - length + 1]
+            for j in range(i - length + 2, i + 1):
+                if values[r, j] < lowest or values[r, j] != values[r, j]:
+                    lowest = values[r, j]
+            result[r, i] = lowest
+
+    return result
+
+
+if numba is not None:
+    _ewm_kernel = numba.njit(cache=True)(_ewm_kernel)
+    _rolling_mean_std_kernel = numba.njit(cache=True)(_rolling_mean_std_kernel)
+    _rolling_max_kernel = numba.njit(cache=True)(_rolling_max_kernel)
+    _rolling_min_kernel = numba.njit(cache=True)(_rolling_min_kernel)
+
+
+# Applies fn to the 2-D float version of values and gives the results the shape of values
+def _rows(fn: typing.Callable, values: np.ndarray, *args) -> typing.Any:
+    values = np.asarray(values, dtype=np.float64)
+    one_row = values.ndim == 1
+
+    result = fn(np.ascontiguousarray(values.reshape(1, -1) if one_row else values), *args)
+
+    if isinstance(result, tuple):
+        return tuple(r[0] if one_row else r for r in result)
+    return result[0] if one_row else result
+
+
+def _ewm(values: np.ndarray, alpha: float, adjust: bool, min_periods: int) -> np.ndarray:
+    if numba is not None:
+        return _ewm_kernel(values, alpha, adjust, min_periods)
+
+    return pd.DataFrame(values.T).ewm(alpha=alpha, adjust=adjust, min_periods=min_periods).mean().values.T
+
+
+def _rolling_mean_std(values: np.ndarray, length: int) -> typing.Tuple[np.ndarray, np.ndarray]:
+    if numba is not None:
+        return _rolling_mean_std_kernel(values, length)
+
+    rolling = pd.DataFrame(values.T).rolling(length)
+    return rolling.mean().values.T, rolling.std(ddof=0).values.T
+
+
+def _rolling_max(values: np.ndarray, length: int) -> np.ndarray:
+    if numba is not None:
+        return _rolling_max_kernel(values, length)
+
+    return pd.DataFrame(values.T).rolling(length).max().values.T
+
+
+def _rolling_min(values: np.ndarray, length: int) -> np.ndarray:
+    if numba is not None:
+        return _rolling_min_kernel(values, length)
+
+    return pd.DataFrame(values.T).rolling(length).min().values.T
+
+
+# Batch indicators
+
+def sma(values: np.ndarray, length: int) -> np.ndarray:
+    return _rows(lambda v: _rolling_mean_std(v, length)[0], values)
+
+
+# Same values as pandas ewm(span=span).mean()
+def ema(values: np.ndarray, span: int) -> np.ndarray:
+    return _rows(_ewm, values, 2 / (span + 1), True, 0)
+
+
+# Relative strength index: averages of the gains and the losses with a 1 / length smoothing, from the second candle
+def rsi(closes: np.ndarray, length: int = 14) -> np.ndarray:
+    def compute(values: np.ndarray) -> np.ndarray:
+        delta = np.diff(values, axis=1)
+
+        avg_gains = _ewm(np.clip(delta, 0, None), 1 / length, True, length)
+        avg_losses = _ewm(-np.clip(delta, None, 0), 1 / length, True, length)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            result = 100 - 100 / (1 + avg_gains / avg_losses)
+
+        return np.concatenate([np.full((values.shape[0], 1), np.nan), result], axis=1)
+
+    return _rows(compute, closes)
+
+
+# MACD line (fast EMA - slow EMA) and signal line (EMA of the MACD line)
+def macd(closes: np.ndarray, fast: int = 12, slow: int = 26,
+         signal: int = 9) -> typing.Tuple[np.ndarray, np.ndarray]:
+    def compute(values: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
+        macd_line = _ewm(values, 2 / (fast + 1), True, 0) - _ewm(values, 2 / (slow + 1), True, 0)
+        return macd_line, _ewm(macd_line, 2 / (signal + 1), True, 0)
+
+    return _rows(compute, closes)
+
+
+def true_range(highs: np.ndarray, lows: np.ndarray, closes: np.ndarray) -> np.ndarray:
+    highs, lows, closes = np.asarray(highs, dtype=np.float64), np.asarray(lows, dtype=np.float64), \
+        np.asarray(closes, dtype=np.float64)
+
+    previous_closes = np.concatenate([closes[..., :1], closes[..., :-1]], axis=-1)
+
+    return np.maximum(highs, previous_closes) - np.minimum(lows, previous_closes)
+
+
+# Average true range, Wilder smoothing (1 / length, not adjusted)
+def atr(highs: np.ndarray, lows: np.ndarray, closes: np.ndarray, length: int = 14) -> np.ndarray:
+    return _rows(_ewm, true_range(highs, lows, closes), 1 / length, False, length)
+
+
+# Bollinger bands: middle (SMA), upper and lower bands at width standard deviations (population) of the middle
+def bollinger(closes: np.ndarray, length: int = 20,
+              width: float = 2) -> typing.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    middle, std = _rows(_rolling_mean_std, closes, length)
+    return middle, middle + width * std, middle - width * std
+
+
+# Volume weighted average price of the typical price (high + low + close) / 3, from the start of the arrays or, with the
+# timestamps (milliseconds, one per column), from the start of each UTC day
+def vwap(highs: np.ndarray, lows: np.ndarray, closes: np.ndarray, volumes: np.ndarray,
+         timestamps: typing.Optional[np.ndarray] = None) -> np.ndarray:
+    volumes = np.asarray(volumes, dtype=np.float64)
+    typical = (np.asarray(highs, dtype=np.float64) + np.asarray(lows, dtype=np.float64) +
+               np.asarray(closes, dtype=np.float64)) / 3
+
+    cumulative_pv = np.cumsum(typical * volumes, axis=-1)
+    cumulative_volume = np.cumsum(volumes, axis=-1)
+
+    if timestamps is not None:
+        days = np.asarray(timestamps) // 86400000
+        n = days.shape[0]
+
+        # Index of the first candle of the day of each candle, the sums are restarted from it
+        session_start = np.maximum.accumulate(np.where(np.concatenate([[True], days[1:] != days[:-1]]),
+                                                       np.arange(n), 0))
+        before = session_start - 1
+        has_before = before >= 0
+
+        cumulative_pv = cumulative_pv - np.where(has_before, cumulative_pv[..., np.maximum(before, 0)], 0)
+        cumulative_volume = cumulative_volume - np.where(has_before, cumulative_volume[..., np.maximum(before, 0)], 0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return cumulative_pv / cumulative_volume
+
+
+# Donchian channel: highest high, lowest low of the last length candles (current one included) and their middle
+def donchian(highs: np.ndarray, lows: np.ndarray,
+             length: int = 20) -> typing.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    upper = _rows(_rolling_max, highs, length)
+    lower = _rows(_rolling_min, lows, length)
+    return upper, lower, (upper + lower) / 2
+
+
+# Incremental indicators: update() returns the value after the new candle (None while it is not defined), the same
+# value as the last element of the batch function
+
+class EMA:
+    def __init__(self, span: typing.Optional[int] = None, alpha: typing.Optional[float] = None, adjust: bool = True,
+                 min_periods: int = 0):
+        self._alpha = alpha if alpha is not None else 2 / (span + 1)
+        self._adjust = adjust
+        self._min_periods = min_periods
+
+        self._numerator = 0.0
+        self._denominator = 0.0
+        self._count = 0
+
+        self.value: typing.Optional[float] = None
+
+    def update(self, x: float) -> typing.Optional[float]:
+        self._count += 1
+
+        if self._adjust:
+            self._numerator = self._numerator * (1 - self._alpha) + x
+            self._denominator = self._denominator * (1 - self._alpha) + 1
+        elif self._count == 1:
+            self._numerator = x
+            self._denominator = 1.0
+        else:
+            self._numerator = self._numerator * (1 - self._alpha) + self._alpha * x
+
+        if self._count >= self._min_periods:
+            self.value = self._numerator / self._denominator
+
+        return self.value
+
+
+class SMA:
+    def __init__(self, length: int):
+        self._values: typing.Deque[float] = collections.deque(maxlen=length)
+        self.value: typing.Optional[float] = None
+
+    def update(self, x: float) -> typing.Optional[float]:
+        self._values.append(x)
+
+        # The sum of the window is recomputed (not updated) so that the rounding errors don't add up
+        if len(self._values) == self._values.maxlen:
+            self.value = math.fsum(self._values) / len(self._values)
+
+        return self.value
+
+
+class RSI:
+    def __init__(self, length: int = 14):
+        self._gains = EMA(alpha=1 / length, min_periods=length)
+        self._losses = EMA(alpha=1 / length, min_periods=length)
+        self._previous_close: typing.Optional[float] = None
+
+        self.value: typing.Optional[float] = None
+
+    def update(self, close: float) -> typing.Optional[float]:
+        if self._previous_close is not None:
+            delta = close - self._previous_close
+
+            gains = self._gains.update(max(delta, 0))
+            losses = self._losses.update(max(-delta, 0))
+
+            if gains is not None:
+                if losses > 0:
+                    self.value = 100 - 100 / (1 + gains / losses)
+                else:
+                    self.value = 100 if gains > 0 else None
+
+        self._previous_close = close
+
+        return self.value
+
+
+class MACD:
+    def __init__(self, fast: int = 12, slow: int = 26, signal: int = 9):
+        self._fast = EMA(fast)
+        self._slow = EMA(slow)
+        self._signal = EMA(signal)
+
+        self.line: typing.Optional[float] = None
+        self.signal: typing.Optional[float] = None
+
+    # Returns the MACD line and the signal line
+    def update(self, close: float) -> typing.Tuple[float, float]:
+        self.line = self._fast.update(close) - self._slow.update(close)
+        self.signal = self._signal.update(self.line)
+
+        return self.line, self.signal
+
+
+class ATR:
+    def __init__(self, length: int = 14):
+        self._average = EMA(alpha=1 / length, adjust=False, min_periods=length)
+        self._previous_close: typing.Optional[float] = None
+
+        self.value: typing.Optional[float] = None
+
+    def update(self, high: float, low: float, close: float) -> typing.Optional[float]:
+        previous_close = self._previous_close if self._previous_close is not None else close
+        self._previous_close = close
+
+        self.value = self._average.update(max(high, previous_close) - min(low, previous_close))
+
+        return self.value
+
+
+class Bollinger:
+    def __init__(self, length: int = 20, width: float = 2):
+        self._values: typing.Deque[float] = collections.deque(maxlen=length)
+        self._width = width
+
+        self.middle: typing.Optional[float] = None
+        self.upper: typing.Optional[float] = None
+        self.lower: typing.Optional[float] = None
+
+    # Returns the middle, upper and lower bands
+    def update(self, close: float) -> typing.Tuple[typing.Optional[float], ...]:
+        self._values.append(close)
+
+        if len(self._values) == self._values.maxlen:
+            self.middle = math.fsum(self._values) / len(self._values)
+            std = math.sqrt(math.fsum((x - self.middle) ** 2 for x in self._values) / len(self._values))
+
+            self.upper = self.middle + self._width * std
+            self.lower = self.middle - self._width * std
+
+        return self.middle, self.upper, self.lower
+
+
+class VWAP:
+    # daily: the average restarts at the first candle of each UTC day (timestamps needed)
+    def __init__(self, daily: bool = False):
+        self._daily = daily
+        self._day: typing.Optional[int] = None
+
+        self._pv = 0.0
+        self._volume = 0.0
+
+        self.value: typing.Optional[float] = None
+
+    def update(self, high: float, low: float, close: float, volume: float,
+               timestamp: typing.Optional[int] = None) -> typing.Optional[float]:
+        if self._daily and timestamp // 86400000 != self._day:
+            self._day = timestamp // 86400000
+            self._pv = 0.0
+            self._volume = 0.0
+
+        self._pv += (high + low + close) / 3 * volume
+        self._volume += volume
+
+        if self._volume > 0:
+            self.value = self._pv / self._volume
+
+        return self.value
+
+
+class Donchian:
+    def __init__(self, length: int = 20):
+        self._highs: typing.Deque[float] = collections.deque(maxlen=length)
+        self._lows: typing.Deque[float] = collections.deque(maxlen=length)
+
+        self.upper: typing.Optional[float] = None
+        self.lower: typing.Optional[float] = None
+
+    # Returns the upper and lower bands
+    def update(self, high: float, low: float) -> typing.Tuple[typing.Optional[float], typing.Optional[float]]:
+        self._highs.append(high)
+        self._lows.append(low)
+
+        if len(self._highs) == self._highs.maxlen:
+            self.upper = max(self._highs)
+            self.lower = min(self._lows)
+
+        return self.upper, self.lower
+
+
+if __name__ == '__main__':
+    # Parity with pandas (reference implementations written with pandas, as in the strategies) of the batch functions,
+    # of the kernels (the Numba code run by the Python interpreter when Numba is missing) and of the incremental
+    # classes, then the batch functions on 10M candles
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+
+    def random_candles(n: int) -> typing.Tuple[np.ndarray, ...]:
+        closes = 30000 + np.cumsum(rng.normal(0, 20, n))
+        highs = closes + rng.uniform(0, 15, n)
+        lows = closes - rng.uniform(0, 15, n)
+        volumes = rng.exponential(5, n)
+        timestamps = 1600000000000 + np.arange(n) * 60000
+        return highs, lows, closes, volumes, timestamps
+
+    highs, lows, closes, volumes, timestamps = random_candles(5000)
+    c = pd.Series(closes)
+
+    delta = c.diff().dropna()
+    gains = delta.clip(lower=0).ewm(com=13, min_periods=14).mean()
+    losses = (-delta.clip(upper=0)).ewm(com=13, min_periods=14).mean()
+    macd_reference = c.ewm(span=12).mean() - c.ewm(span=26).mean()
+    previous = c.shift(1).fillna(c.iloc[0])
+    tr = pd.concat([pd.Series(highs), previous], axis=1).max(axis=1) - \
+        pd.concat([pd.Series(lows), previous], axis=1).min(axis=1)
+    typical = pd.Series((highs + lows + closes) / 3)
+    days = pd.Series(timestamps // 86400000)
+
+    # Closes with NaN values at the start and in the middle
+    gap_closes = closes.copy()
+    gap_closes[:7] = np.nan
+    gap_closes[[100, 2000, 2001]] = np.nan
+    g = pd.Series(gap_closes)
+
+    references = {
+        "sma": (sma(closes, 20), c.rolling(20).mean()),
+        "sma (NaN)": (sma(gap_closes, 20), g.rolling(20).mean()),
+        "ema (NaN)": (ema(gap_closes, 20), g.ewm(span=20).mean()),
+        "bollinger (NaN)": (bollinger(gap_closes)[1], g.rolling(20).mean() + 2 * g.rolling(20).std(ddof=0)),
+        "donchian (NaN)": (donchian(gap_closes, gap_closes)[0], g.rolling(20).max()),
+        "ema": (ema(closes, 20), c.ewm(span=20).mean()),
+        "rsi": (rsi(closes, 14)[1:], 100 - 100 / (1 + gains / losses)),
+        "macd": (macd(closes)[0], macd_reference),
+        "macd signal": (macd(closes)[1], macd_reference.ewm(span=9).mean()),
+        "atr": (atr(highs, lows, closes, 14), tr.ewm(alpha=1 / 14, adjust=False, min_periods=14).mean()),
+        "bollinger upper": (bollinger(closes)[1], c.rolling(20).mean() + 2 * c.rolling(20).std(ddof=0)),
+        "vwap": (vwap(highs, lows, closes, volumes, timestamps),
+                 (typical * volumes).groupby(days).cumsum() / pd.Series(volumes).groupby(days).cumsum()),
+        "donchian upper": (donchian(highs, lows)[0], pd.Series(highs).rolling(20).max()),
+        "donchian lower": (donchian(highs, lows)[1], pd.Series(lows).rolling(20).min()),
+    }
+
+    # Relative errors, absolute below 1 (the MACD crosses 0)
+    for name, (values, reference) in references.items():
+        reference = reference.values
+        assert np.array_equal(np.isnan(values), np.isnan(reference)), name
+        error = np.nanmax(np.abs(values - reference) / np.maximum(np.abs(reference), 1))
+        assert error < 1e-9, (name, error)
+        print(f"{name:16} parity with pandas, max relative error {error:.1e}")
+
+    # Kernels, on 2-D arrays
+    closes_2d = np.stack([closes, closes[::-1]])
+    checks = {
+        "ewm kernel": (_ewm_kernel(closes_2d, 0.1, True, 0),
+                       pd.DataFrame(closes_2d.T).ewm(alpha=0.1).mean().values.T),
+        "ewm kernel (not adjusted)": (_ewm_kernel(closes_2d, 0.1, False, 5),
+                                      pd.DataFrame(closes_2d.T).ewm(alpha=0.1, adjust=False,
+                                                                    min_periods=5).mean().values.T),
+        "rolling std kernel": (_rolling_mean_std_kernel(closes_2d, 20)[1],
+                               pd.DataFrame(closes_2d.T).rolling(20).std(ddof=0).values.T),
+        "rolling max kernel": (_rolling_max_kernel(closes_2d, 20), pd.DataFrame(closes_2d.T).rolling(20).max().values.T),
+        "rolling min kernel": (_rolling_min_kernel(closes_2d, 20), pd.DataFrame(closes_2d.T).rolling(20).min().values.T),
+    }
+
+    # Same kernels with NaN values at the start and in the middle of the rows
+    gaps_2d = closes_2d.copy()
+    gaps_2d[0, :7] = np.nan
+    gaps_2d[0, [100, 2000, 2001, 2002]] = np.nan
+    gaps_2d[1, 3000:3050] = np.nan
+    gaps = pd.DataFrame(gaps_2d.T)
+
+    checks.update({
+        "ewm kernel (NaN)": (_ewm_kernel(gaps_2d, 0.1, True, 0), gaps.ewm(alpha=0.1).mean().values.T),
+        "ewm kernel (NaN, not adj.)": (_ewm_kernel(gaps_2d, 0.1, False, 5),
+                                       gaps.ewm(alpha=0.1, adjust=False, min_periods=5).mean().values.T),
+        "rolling mean kernel (NaN)": (_rolling_mean_std_kernel(gaps_2d, 20)[0], gaps.rolling(20).mean().values.T),
+        "rolling std kernel (NaN)": (_rolling_mean_std_kernel(gaps_2d, 20)[1],
+                                     gaps.rolling(20).std(ddof=0).values.T),
+        "rolling max kernel (NaN)": (_rolling_max_kernel(gaps_2d, 20), gaps.rolling(20).max().values.T),
+        "rolling min kernel (NaN)": (_rolling_min_kernel(gaps_2d, 20), gaps.rolling(20).min().values.T),
+    })
+
+    for name, (values, reference) in checks.items():
+        assert np.array_equal(np.isnan(values), np.isnan(reference)), name
+        error = np.nanmax(np.abs(values - reference) / np.maximum(np.abs(reference), 1))
+        assert error < 1e-8, (name, error)
+        print(f"{name:26} parity with pandas, max relative error {error:.1e}")
+
+    short = np.array([np.nan, np.nan, 1, 2, 3, 4, 5, 6, 7, 8])
+    assert np.array_equal(_rolling_mean_std_kernel(short.reshape(1, -1), 3)[0][0],
+                          pd.Series(short).rolling(3).mean().values, equal_nan=True)
+
+    # Incremental classes, every value compared to the batch functions
+    incremental = {"ema": EMA(20), "sma": SMA(20), "rsi": RSI(14), "macd": MACD(), "atr": ATR(14),
+                   "bollinger": Bollinger(20), "vwap": VWAP(daily=True), "donchian": Donchian(20)}
+    batch = {"ema": ema(closes, 20), "sma": sma(closes, 20), "rsi": rsi(closes, 14), "macd": macd(closes)[1],
+             "atr": atr(highs, lows, closes, 14), "bollinger": bollinger(closes)[2],
+             "vwap": vwap(highs, lows, closes, volumes, timestamps), "donchian": donchian(highs, lows)[0]}
+
+    for i in range(len(closes)):
+        values = {"ema": incremental["ema"].update(closes[i]), "sma": incremental["sma"].update(closes[i]),
+                  "rsi": incremental["rsi"].update(closes[i]), "macd": incremental["macd"].update(closes[i])[1],
+                  "atr": incremental["atr"].update(highs[i], lows[i], closes[i]),
+                  "bollinger": incremental["bollinger"].update(closes[i])[2],
+                  "vwap": incremental["vwap"].update(highs[i], lows[i], closes[i], volumes[i], timestamps[i]),
+                  "donchian": incremental["donchian"].update(highs[i], lows[i])[0]}
+
+        for name, value in values.items():
+            if np.isnan(batch[name][i]):
+                assert value is None, (name, i)
+            else:
+                assert abs(value - batch[name][i]) <= 1e-8 * abs(batch[name][i]), (name, i, value, batch[name][i])
+
+    print("Incremental indicators: same values as the batch functions")
+
+    # Benchmark
+    highs, lows, closes, volumes, timestamps = random_candles(args.rows)
+
+    print(f"{args.rows:,} candles, {'Numba kernels' if numba is not None else 'pandas (Numba not installed)'}")
+
+    benchmarks = {
+        "sma(20)": lambda: sma(closes, 20),
+        "ema(20)": lambda: ema(closes, 20),
+        "rsi(14)": lambda: rsi(closes, 14),
+        "macd(12, 26, 9)": lambda: macd(closes),
+        "atr(14)": lambda: atr(highs, lows, closes, 14),
+        "bollinger(20, 2)": lambda: bollinger(closes),
+        "vwap (daily)": lambda: vwap(highs, lows, closes, volumes, timestamps),
+        "donchian(20)": lambda: donchian(highs, lows),
+    }
+
+    for name, fn in benchmarks.items():
+        # The first call compiles the Numba kernels (cached on disk afterwards)
+        fn()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        print(f"{name:18} {elapsed * 1000:8.0f} ms, {args.rows / elapsed / 1e6:6.1f}M candles/s")
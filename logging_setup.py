@@ -0,0 +1,250 @@
+# Handlers of the root logger, configured by main.py
+# The websocket threads log on every new candle, missing candle or clock drift: with the handlers called directly, a
+# slow console or disk stalls the market data. By default the records are put in a queue by the logging thread
+# (QueueHandler) and written by a background thread (QueueListener)
+# - info.log is rotated by size (or at a time interval), the previous files are kept as info.log.1, info.log.2...
+# - The records logged with extra={"rate_limit": True} (e.g. the trade time drift warning, sent for every trade) are
+#   written at most once per RATE_LIMIT_INTERVAL for each message template. The number of records suppressed is logged
+#   every RATE_LIMIT_INTERVAL and at exit
+# - The file can be written as JSON lines, one object per record, for later analysis
+
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+import typing
+
+LOG_FILE = "info.log"
+LOG_FORMAT = '%(asctime)s %(levelname)s :: %(message)s'
+
+# Size rotation of the log file, used when no time interval is given
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+# Seconds between two records with the same message template, for the records rate limited
+RATE_LIMIT_INTERVAL = 60
+
+
+# Drop the records repeating a message template within RATE_LIMIT_INTERVAL, for the records logged with
+# extra={"rate_limit": True} only
+class RateLimitFilter(logging.Filter):
+    def __init__(self, interval: float = RATE_LIMIT_INTERVAL):
+        super().__init__()
+
+        self._interval = interval
+
+        # Time of the last record written, number of records suppressed since and the last one suppressed (message
+        # template and arguments), by (level, message template)
+        self._last_times: typing.Dict[typing.Tuple[int, str], float] = dict()
+        self._suppressed: typing.Dict[typing.Tuple[int, str], int] = dict()
+        self._last_suppressed: typing.Dict[typing.Tuple[int, str], typing.Tuple[typing.Any, typing.Any]] = dict()
+
+        # Records are filtered by every logging thread
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "rate_limit", False):
+            return True
+
+        # Without the queue the filter is called by each handler, the record is only counted once
+        if hasattr(record, "rate_limited"):
+            return not record.rate_limited
+
+        key = (record.levelno, str(record.msg))
+        now = time.monotonic()
+
+        with self._lock:
+            last_time = self._last_times.get(key)
+
+            if last_time is not None and now - last_time < self._interval:
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                self._last_suppressed[key] = (record.msg, record.args)
+                record.rate_limited = True
+                return False
+
+            self._last_times[key] = now
+            suppressed = self._suppressed.pop(key, 0)
+            self._last_suppressed.pop(key, None)
+
+        record.rate_limited = False
+
+        if suppressed > 0:
+            record.suppressed = suppressed
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+
+        return True
+
+    # Log the number of records suppressed since the last report (or the last record written) of each template, with
+    # the last record suppressed. Called every RATE_LIMIT_INTERVAL and at exit
+    def report(self):
+        with self._lock:
+            pending = [(key, count, self._last_suppressed.pop(key)) for key, count in self._suppressed.items()]
+            self._suppressed = dict()
+
+        for (levelno, _), count, (msg, args) in pending:
+            try:
+                message = str(msg) % args if args else str(msg)
+            except (TypeError, ValueError):
+                message = str(msg)
+
+            logging.getLogger().log(levelno, "%s similar messages suppressed, the last one: %s", count, message)
+
+    def _run(self):
+        while True:
+            time.sleep(self._interval)
+            self.report()
+
+    def start(self):
+        t = threading.Thread(target=self._run, daemon=True)
+        t.start()
+
+
+# One JSON object per line
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {"time": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+                "level": record.levelname, "thread": record.threadName, "module": record.module,
+                "message": record.getMessage()}
+
+        if hasattr(record, "suppressed"):
+            data["suppressed"] = record.suppressed
+
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(data)
+
+
+# Configure the root logger, returns the listener writing the records in the background (None if synchronous). The
+# listener is stopped at exit, after the records queued are written
+# rotate_when: time interval of the rotation of the log file ("midnight", "H"... see TimedRotatingFileHandler), size
+# rotation if None
+def configure_logging(asynchronous: bool = True, json_output: bool = False, rotate_when: typing.Optional[str] = None,
+                      log_file: str = LOG_FILE) -> typing.Optional[logging.handlers.QueueListener]:
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+
+    formatter = logging.Formatter(LOG_FORMAT)
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+    stream_handler.setLevel(logging.INFO)
+
+    if rotate_when is None:
+        file_handler = logging.handlers.RotatingFileHandler(log_file, maxBytes=LOG_MAX_BYTES,
+                                                            backupCount=LOG_BACKUP_COUNT)
+    else:
+        file_handler = logging.handlers.TimedRotatingFileHandler(log_file, when=rotate_when,
+                                                                 backupCount=LOG_BACKUP_COUNT)
+    file_handler.setFormatter(JsonFormatter() if json_output else formatter)
+    file_handler.setLevel(logging.DEBUG)
+
+    rate_limit = RateLimitFilter()
+    rate_limit.start()
+
+    if not asynchronous:
+        for handler in [stream_handler, file_handler]:
+            handler.addFilter(rate_limit)
+            logger.addHandler(handler)
+
+        atexit.register(rate_limit.report)
+
+        return None
+
+    # The records are filtered before being queued, the message is formatted by the logging thread (the arguments
+    # may change afterwards)
+    log_queue = queue.SimpleQueue()
+
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(rate_limit)
+    logger.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, file_handler, respect_handler_level=True)
+    listener.start()
+
+    # The exit functions are called in reverse order: the last counts are reported before the listener stops
+    atexit.register(_stop_listener, listener)
+    atexit.register(rate_limit.report)
+
+    return listener
+
+
+# QueueListener.stop() can't be called twice before Python 3.12
+def _stop_listener(listener: logging.handlers.QueueListener):
+    if listener._thread is not None:
+        listener.stop()
+
+
+if __name__ == '__main__':
+    # Time spent by the logging thread per record, with the handlers called directly and with the queue (the console
+    # output is discarded), then the rate limit of a repeated warning and the JSON output
+    import os
+    import shutil
+    import sys
+    import tempfile
+
+    directory = tempfile.mkdtemp()
+    stderr = sys.stderr
+    n = 20000
+
+    try:
+        sys.stderr = open(os.devnull, "w")
+
+        for asynchronous in [False, True]:
+            path = os.path.join(directory, f"info_{asynchronous}.log")
+            listener = configure_logging(asynchronous, log_file=path)
+            root = logging.getLogger()
+
+            start = time.perf_counter()
+            for i in range(n):
+                root.info("Binance New candle for %s %s", "BTCUSDT", i)
+            elapsed = time.perf_counter() - start
+
+            if listener is not None:
+                listener.stop()
+
+            for handler in list(root.handlers):
+                root.removeHandler(handler)
+                handler.close()
+
+            print(f"{'Queue' if asynchronous else 'Direct'}: {elapsed / n * 1e6:.1f} us per record in the logging "
+                  f"thread", file=stderr)
+
+        for asynchronous in [False, True]:
+            path = os.path.join(directory, f"info_{asynchronous}.jsonl")
+            listener = configure_logging(asynchronous, json_output=True, log_file=path)
+            root = logging.getLogger()
+
+            for i in range(1000):
+                root.warning("%s %s: %s milliseconds of difference between the current time and the trade time",
+                             "Binance", "BTCUSDT", 2000 + i, extra={"rate_limit": True})
+
+            # Not rate limited: same template, different events
+            for symbol in ["BTCUSDT", "ETHUSDT"]:
+                root.warning("%s order book out of sync", symbol)
+
+            # Count of the suppressed records, as logged by the timer or at exit
+            root.handlers[0].filters[0].report()
+
+            if listener is not None:
+                listener.stop()
+
+            for handler in list(root.handlers):
+                root.removeHandler(handler)
+                handler.close()
+
+            with open(path) as f:
+                lines = [json.loads(line) for line in f]
+
+            assert len(lines) == 4 and lines[-1]["message"].startswith("999 similar messages suppressed"), lines
+
+            print(f"1000 drift warnings and 2 other warnings, {len(lines)} records written: "
+                  f"{[line['message'] for line in lines]}", file=stderr)
+    finally:
+        sys.stderr.close()
+        sys.stderr = stderr
+        shutil.rmtree(directory)
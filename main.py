@@ -1,36 +1,126 @@
+import argparse
 import logging
 import os
+import threading
+import time
 
 from binance_futures import BinanceFuturesClient
 from bitmex import BitmexClient
-from root_component import Root
+from logging_setup import configure_logging
 
 
 logger = logging.getLogger()
 
-logger.setLevel(logging.INFO)
 
-stream_handler = logging.StreamHandler()
-formatter = logging.Formatter('%(asctime)s %(levelname)s :: %(message)s')
-stream_handler.setFormatter(formatter)
-stream_handler.setLevel(logging.INFO)
-
-file_handler = logging.FileHandler('info.log')
-file_handler.setFormatter(formatter)
-file_handler.setLevel(logging.DEBUG)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Crypto Trading Bot")
+    # Without the interface: the strategies saved in the workspace are started, see headless.py
+    parser.add_argument("--headless", action="store_true", help="run the saved strategies without the interface")
+    parser.add_argument("--port", type=int, default=None, help="port of the local status API (headless mode)")
+    # Activate the saved strategies, log the average CPU use after the number of seconds and exit (both modes)
+    parser.add_argument("--benchmark", type=float, default=None, metavar="SECONDS")
+    # Additional accounts (e.g. sub-accounts) sharing the market data connections of the main clients, headless mode.
+    # The keys of an account NAME are read from public_key_binance_NAME, private_key_binance_NAME... and its strategies
+    # from the workspace database_NAME.db
+    parser.add_argument("--accounts", default="", help="comma separated names of the additional accounts")
+    # Without the interface, the saved strategies are spread over worker processes by symbol, see supervisor.py
+    parser.add_argument("--workers", type=int, default=None, help="number of strategy worker processes")
+    # Closed candles and historical downloads written to an on-disk columnar store, see candle_store.py
+    parser.add_argument("--candle-store", nargs="?", const="candles", default=None, metavar="DIRECTORY",
+                        help="store the candles (default directory: candles)")
+    # Trades and bid/ask updates archived for tick-accurate backtests, see tick_recorder.py
+    parser.add_argument("--record-ticks", nargs="?", const="ticks", default=None, metavar="DIRECTORY",
+                        help="record the ticks (default directory: ticks)")
+    # Signals of every contract in the watchlist, see scanner.py
+    parser.add_argument("--scanner", action="store_true", help="scan every contract for signals (interface)")
+    # Logging, see logging_setup.py. The handlers are configured here rather than when the module is imported, the
+    # worker processes of the supervisor import it again
+    parser.add_argument("--log-json", action="store_true", help="write info.log as JSON lines")
+    parser.add_argument("--log-rotate", default=None, metavar="WHEN",
+                        help="rotate info.log at a time interval (e.g. midnight, H) instead of by size")
+    parser.add_argument("--log-sync", action="store_true", help="write the logs from the logging threads (no queue)")
+    args = parser.parse_args()
 
-logger.addHandler(stream_handler)
-logger.addHandler(file_handler)
+    configure_logging(not args.log_sync, args.log_json, args.log_rotate)
 
+    startup_start = time.perf_counter()
 
-if __name__ == '__main__':
     # Enter public and private keys
+    # Both clients fetch their contracts and balances in the background, concurrently, and start with the contracts
+    # saved during the previous session
     binance = BinanceFuturesClient(os.environ.get('public_key_binance'),
-                                   os.environ.get('private_key_binance', True))
-    bitmex = BitmexClient(os.environ.get('public_key_bitmex'), os.environ.get('private_key_bitmex', True))
+                                   os.environ.get('private_key_binance'), True)
+    bitmex = BitmexClient(os.environ.get('public_key_bitmex'), os.environ.get('private_key_bitmex'), True)
+
+    logger.info("Clients created in %.0f ms", (time.perf_counter() - startup_start) * 1000)
+
+    store = None
+
+    if args.candle_store is not None:
+        from candle_store import CandleStore
+
+        store = CandleStore(args.candle_store)
+        binance.market_data.store = store
+        bitmex.market_data.store = store
+
+    recorders = []
+
+    if args.record_ticks is not None:
+        from tick_recorder import TickRecorder
+
+        binance.tick_recorder = TickRecorder("Binance", args.record_ticks)
+        bitmex.tick_recorder = TickRecorder("Bitmex", args.record_ticks)
+        recorders = [binance.tick_recorder, bitmex.tick_recorder]
+
+    if args.workers is not None:
+        from supervisor import Supervisor
+
+        Supervisor({"Binance": binance, "Bitmex": bitmex}, args.workers,
+                   candle_store=args.candle_store).run(args.benchmark)
+
+    elif args.headless:
+        from headless import HeadlessRunner
+
+        accounts = [name for name in args.accounts.split(",") if name != ""]
+        runners = []
+
+        for number, name in enumerate(accounts, start=1):
+            account_binance = BinanceFuturesClient(os.environ.get('public_key_binance_' + name),
+                                                   os.environ.get('private_key_binance_' + name), True, feed=binance)
+            account_bitmex = BitmexClient(os.environ.get('public_key_bitmex_' + name),
+                                          os.environ.get('private_key_bitmex_' + name), True, feed=bitmex)
+
+            # Status API of each account on the next ports
+            port = args.port + number if args.port is not None else None
+            runners.append(HeadlessRunner(account_binance, account_bitmex, port, database=f"database_{name}.db"))
+
+        threads = [threading.Thread(target=runner.run, args=(args.benchmark,)) for runner in runners]
+        for t in threads:
+            t.start()
+
+        HeadlessRunner(binance, bitmex, args.port).run(args.benchmark)
+
+        for runner, t in zip(runners, threads):
+            runner.stop()
+            t.join()
+
+    else:
+        # Tkinter is only imported with the interface
+        from root_component import Root
+
+        root = Root(binance, bitmex, args.scanner)
+
+        # Called once the window is drawn and the event loop is running
+        root.after_idle(lambda: logger.info("Window displayed in %.0f ms", (time.perf_counter() - startup_start) * 1000))
 
-    root = Root(binance, bitmex)
-    root.mainloop()
+        if args.benchmark is not None:
+            root.benchmark(args.benchmark)
 
+        root.mainloop()
 
+    # The last candles and ticks queued
+    if store is not None:
+        store.flush(timeout=5)
 
+    for recorder in recorders:
+        recorder.flush(timeout=5)
@@ -0,0 +1,771 @@
+# Market data shared by the strategies of a client
+# One candle series is kept per (symbol, timeframe) and updated once per trade, whatever the number of strategies using
+# it. The strategies subscribe to the series and receive its "same_candle" / "new_candle" events
+# Only the 1m series of a symbol is built from the trades, the higher timeframes are rolled up from it
+
+import logging
+import threading
+import time
+import typing
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from models import *
+from candle_scheduler import get_scheduler
+
+if typing.TYPE_CHECKING:
+    from candle_store import CandleStore
+    from strategies import Strategy
+    from bitmex import BitmexClient
+    from binance_futures import BinanceFuturesClient
+
+logger = logging.getLogger()
+
+# Timeframe equivalent
+TF_EQUIV = {"1m": 60, "5m": 300, "15m": 900, "30m": 1800, "1h": 3600, "4h": 14400}
+
+# Timeframe of the series built from the trades, every other timeframe is derived from it
+BASE_TF = "1m"
+
+# Minimum number of candles of a derived timeframe. When the base series history is shorter, the history of the
+# derived series is downloaded with a native timeframe of the exchange and resampled
+MIN_HISTORY = 200
+
+# Milliseconds after a timeframe boundary before the candle scheduler closes the candle, to let the trades of the
+# last milliseconds of the period arrive
+CLOSE_DELAY_MS = 250
+
+
+# Aggregate candles into candles of a higher timeframe (vectorized, used for the historical candles)
+def resample_candles(candles: typing.List[Candle], timeframe: str) -> typing.List[Candle]:
+    if len(candles) == 0:
+        return []
+
+    tf_equiv = TF_EQUIV[timeframe] * 1000
+
+    df = pd.DataFrame({'ts': [c.timestamp for c in candles], 'open': [c.open for c in candles],
+                       'high': [c.high for c in candles], 'low': [c.low for c in candles],
+                       'close': [c.close for c in candles], 'volume': [c.volume for c in candles]})
+
+    df['ts'] = df['ts'] - df['ts'] % tf_equiv
+
+    resampled = df.groupby('ts', sort=True).agg({'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last',
+                                                 'volume': 'sum'})
+
+    return [Candle({'ts': int(ts), 'open': row[0], 'high': row[1], 'low': row[2], 'close': row[3], 'volume': row[4]},
+                   timeframe, "parse_trade")
+            for ts, row in zip(resampled.index, resampled[['open', 'high', 'low', 'close', 'volume']].values)]
+
+
+class CandleSeries:
+    # Number of last candles that can still change: the current one, and the previous one while the trades of its period
+    # received late are folded in it (see update())
+    open_candles = 2
+
+    def __init__(self, exchange: str, contract: Contract, timeframe: str, candles: typing.List[Candle]):
+        self.exchange = exchange
+        self.contract = contract
+        self.tf = timeframe
+        self.tf_equiv = TF_EQUIV[timeframe] * 1000
+
+        # The strategies using the series all reference this list
+        self.candles = candles
+
+        # Timestamp of the last candle sent to the candle store, the closed candles of the history are stored when
+        # downloaded
+        self.stored_until = candles[-2].timestamp if len(candles) > 1 else 0
+
+        self.subscribers: typing.List["Strategy"] = []
+
+    # Update the current candle with a trade coming from the websocket, based on its timestamp. Returns the tick type,
+    # None if the trade is older than the previous period (dropped)
+    def update(self, price: float, size: float, timestamp: int) -> typing.Optional[str]:
+
+        # 3 cases: 1. Update the same current candle, 2. new candle, 3. new candle + missing candle
+
+        last_candle = self.candles[-1]
+
+        if timestamp < last_candle.timestamp:
+            # Trade of the previous period received after the candle scheduler started the current candle
+            if len(self.candles) > 1 and timestamp >= last_candle.timestamp - self.tf_equiv:
+                previous_candle = self.candles[-2]
+                previous_candle.close = price
+                previous_candle.volume += size
+                previous_candle.high = max(previous_candle.high, price)
+                previous_candle.low = min(previous_candle.low, price)
+
+                return "same_candle"
+
+            # Older trade (e.g. replayed after a reconnection, or after the scheduler closed several empty candles): its
+            # candle is closed and may be stored already
+            logger.warning("%s %s: trade of %s dropped, older than the previous %s candle", self.exchange,
+                           self.contract.symbol, timestamp, self.tf, extra={"rate_limit": True})
+            return None
+
+        # Same candle (if timestamp of the trade is less than last candle plus the timeframe equivalent -
+        # means it is on the same candle)
+        if timestamp < last_candle.timestamp + self.tf_equiv:
+            # If on the same candle, a consequence of a new trade is that the trade price will now be the last price of
+            # the candle until a new one comes or until the end of the candle.
+            last_candle.close = price
+            last_candle.volume += size
+
+            # Trade price can be the new high or new low so...
+            if price > last_candle.high:
+                last_candle.high = price
+            elif price < last_candle.low:
+                last_candle.low = price
+
+            return "same_candle"
+
+        # Missing candle(s)
+        elif timestamp >= last_candle.timestamp + 2 * self.tf_equiv:
+
+            missing_candles = int((timestamp - last_candle.timestamp) / self.tf_equiv) - 1
+
+            logger.info("%s missing %s candles for %s %s (%s %s)", self.exchange, missing_candles, self.contract.symbol,
+                        self.tf, timestamp, last_candle.timestamp)
+
+            # Add the number of missing candles to the candles list
+            for missing in range(missing_candles):
+                new_ts = last_candle.timestamp + self.tf_equiv
+                candle_info = {'ts': new_ts, 'open': last_candle.close, 'high': last_candle.close,
+                               'low': last_candle.close, 'close': last_candle.close, 'volume': 0}
+                new_candle = Candle(candle_info, self.tf, "parse_trade")
+
+                self.candles.append(new_candle)
+
+                last_candle = new_candle
+
+            new_ts = last_candle.timestamp + self.tf_equiv
+            candle_info = {'ts': new_ts, 'open': price, 'high': price, 'low': price, 'close': price, 'volume': size}
+            new_candle = Candle(candle_info, self.tf, "parse_trade")
+
+            self.candles.append(new_candle)
+
+            return "new_candle"
+
+        # New Candle
+        elif timestamp >= last_candle.timestamp + self.tf_equiv:
+            new_ts = last_candle.timestamp + self.tf_equiv
+            candle_info = {'ts': new_ts, 'open': price, 'high': price, 'low': price, 'close': price, 'volume': size}
+            new_candle = Candle(candle_info, self.tf, "parse_trade")
+
+            self.candles.append(new_candle)
+
+            logger.info("%s New candle for %s %s", self.exchange, self.contract.symbol, self.tf)
+
+            return "new_candle"
+
+    # Called by the candle scheduler once the current period is over: the candles of the periods that started without
+    # any trade yet are added (flat, at the last close price). Returns True if a candle was added
+    def close_candles(self, now: int) -> bool:
+        added = False
+
+        while now >= self.candles[-1].timestamp + self.tf_equiv + CLOSE_DELAY_MS:
+            last_close = self.candles[-1].close
+            candle_info = {'ts': self.candles[-1].timestamp + self.tf_equiv, 'open': last_close, 'high': last_close,
+                           'low': last_close, 'close': last_close, 'volume': 0}
+            self.candles.append(Candle(candle_info, self.tf, "parse_trade"))
+            added = True
+
+        return added
+
+
+# Series updated by the candles streamed by the exchange (Binance klines, Bitmex tradeBin) instead of the trades
+class KlineSeries(CandleSeries):
+    # The closed candles of the stream are final
+    open_candles = 1
+
+    # The candle is the current state of a candle of the stream, closed is True when its period is over (the Bitmex
+    # tradeBin candles are only sent once closed). Returns the tick type, None if the candle is older than the series
+    def update_kline(self, candle: Candle, closed: bool) -> typing.Optional[str]:
+        last_candle = self.candles[-1]
+
+        if candle.timestamp < last_candle.timestamp:
+            return None
+
+        if candle.timestamp == last_candle.timestamp:
+            last_candle.open = candle.open
+            last_candle.high = candle.high
+            last_candle.low = candle.low
+            last_candle.close = candle.close
+            last_candle.volume = candle.volume
+            tick_type = "same_candle"
+        else:
+            # Periods missed (e.g. while disconnected) are filled with flat candles
+            while candle.timestamp >= self.candles[-1].timestamp + 2 * self.tf_equiv:
+                last_close = self.candles[-1].close
+                candle_info = {'ts': self.candles[-1].timestamp + self.tf_equiv, 'open': last_close,
+                               'high': last_close, 'low': last_close, 'close': last_close, 'volume': 0}
+                self.candles.append(Candle(candle_info, self.tf, "parse_trade"))
+
+            self.candles.append(candle)
+            tick_type = "new_candle"
+
+        # The candle of the next period starts at the close price, the strategies check their signals on the candle
+        # that just closed
+        if closed:
+            candle_info = {'ts': candle.timestamp + self.tf_equiv, 'open': candle.close, 'high': candle.close,
+                           'low': candle.close, 'close': candle.close, 'volume': 0}
+            self.candles.append(Candle(candle_info, self.tf, "parse_trade"))
+            tick_type = "new_candle"
+
+            logger.info("%s New candle for %s %s (kline stream)", self.exchange, self.contract.symbol, self.tf)
+
+        return tick_type
+
+
+# Series of a higher timeframe, rolled up from the base (1m) series of the same symbol
+class ResampledSeries(CandleSeries):
+    # Only the current candle is rebuilt from the base series
+    open_candles = 1
+
+    def __init__(self, base: CandleSeries, timeframe: str, history: typing.List[Candle]):
+        self._base = base
+
+        # The candle of the current period is rebuilt from the base series, only the closed candles are kept
+        current_bucket = base.candles[-1].timestamp - base.candles[-1].timestamp % (TF_EQUIV[timeframe] * 1000)
+
+        super().__init__(base.exchange, base.contract, timeframe, [c for c in history if c.timestamp < current_bucket])
+
+        self._start_current_period()
+        self.stored_until = self.candles[-2].timestamp if len(self.candles) > 1 else 0
+
+    # Roll up the current period again from the base series
+    def _start_current_period(self):
+        current_bucket = self._base.candles[-1].timestamp - self._base.candles[-1].timestamp % self.tf_equiv
+
+        # Aggregate of the closed base candles of the current period
+        self._closed_high = None
+        self._closed_low = None
+        self._closed_volume = 0
+
+        # Index (in the base series) of the first base candle that is not closed and folded yet
+        self._next = len(self._base.candles) - 1
+
+        while self._next > 0 and self._base.candles[self._next - 1].timestamp >= current_bucket:
+            self._next -= 1
+
+        self.roll_up()
+
+    # Called after base candles from start (in milliseconds) were replaced: the candles of the periods from start are
+    # resampled again from the base series
+    def resync(self, start: int):
+        bucket = start - start % self.tf_equiv
+        current_bucket = self._base.candles[-1].timestamp - self._base.candles[-1].timestamp % self.tf_equiv
+
+        resampled = resample_candles([c for c in self._base.candles if c.timestamp >= bucket], self.tf)
+
+        index = len(self.candles)
+        while index > 0 and self.candles[index - 1].timestamp >= bucket:
+            index -= 1
+
+        # The list is modified in place, the strategies reference it
+        self.candles[index:] = [c for c in resampled if c.timestamp < current_bucket]
+
+        self._start_current_period()
+
+    # Called after every update of the base series: the base candles that closed are folded in the current candle
+    # (O(1) per closed base candle) and the current base candle is added to it
+    def roll_up(self) -> str:
+        base_candles = self._base.candles
+        tick_type = "same_candle"
+
+        while self._next < len(base_candles) - 1:
+            if self._add(base_candles[self._next], True):
+                tick_type = "new_candle"
+            self._next += 1
+
+        if self._add(base_candles[-1], False):
+            tick_type = "new_candle"
+
+        return tick_type
+
+    # Returns True if the base candle started a new candle
+    def _add(self, base_candle: Candle, closed: bool) -> bool:
+        bucket = base_candle.timestamp - base_candle.timestamp % self.tf_equiv
+        new_candle = False
+
+        if len(self.candles) == 0 or bucket >= self.candles[-1].timestamp + self.tf_equiv:
+            # Periods without any base candle are filled with flat candles, as for the missing base candles
+            while len(self.candles) > 0 and bucket >= self.candles[-1].timestamp + 2 * self.tf_equiv:
+                last_close = self.candles[-1].close
+                candle_info = {'ts': self.candles[-1].timestamp + self.tf_equiv, 'open': last_close,
+                               'high': last_close, 'low': last_close, 'close': last_close, 'volume': 0}
+                self.candles.append(Candle(candle_info, self.tf, "parse_trade"))
+
+            candle_info = {'ts': bucket, 'open': base_candle.open, 'high': base_candle.high, 'low': base_candle.low,
+                           'close': base_candle.close, 'volume': 0}
+            self.candles.append(Candle(candle_info, self.tf, "parse_trade"))
+
+            self._closed_high = None
+            self._closed_low = None
+            self._closed_volume = 0
+
+            new_candle = True
+
+            logger.info("%s New candle for %s %s", self.exchange, self.contract.symbol, self.tf)
+
+        last_candle = self.candles[-1]
+
+        high = base_candle.high if self._closed_high is None else max(self._closed_high, base_candle.high)
+        low = base_candle.low if self._closed_low is None else min(self._closed_low, base_candle.low)
+
+        last_candle.high = high
+        last_candle.low = low
+        last_candle.close = base_candle.close
+        last_candle.volume = self._closed_volume + base_candle.volume
+
+        if closed:
+            self._closed_high = high
+            self._closed_low = low
+            self._closed_volume += base_candle.volume
+
+        return new_candle
+
+
+class MarketDataHub:
+    def __init__(self, client: typing.Union["BitmexClient", "BinanceFuturesClient"], exchange: str):
+        self._client = client
+        self._exchange = exchange
+
+        self._series: typing.Dict[typing.Tuple[str, str], CandleSeries] = dict()
+
+        # Series of each symbol (the base series first), read by the websocket thread. The lists are replaced (never
+        # modified) when a series is added or removed, so the websocket thread can loop through them while the UI
+        # thread subscribes
+        self._series_by_symbol: typing.Dict[str, typing.List[CandleSeries]] = dict()
+
+        # Series fed by the kline streams of the exchange, for the strategies in "klines" mode
+        self._kline_series: typing.Dict[typing.Tuple[str, str], KlineSeries] = dict()
+
+        # Functions receiving every candle of the kline streams, e.g. the scanner (replaced, never modified)
+        self._kline_listeners: typing.List[typing.Callable[[str, str, Candle, bool], None]] = []
+
+        # Strategies of each symbol, read by the websocket thread for every bid/ask update (replaced, never modified)
+        self._strategies_by_symbol: typing.Dict[str, typing.List["Strategy"]] = dict()
+
+        # Number of series (base and kline series) of each symbol, the prices and the order book of the symbol are
+        # subscribed while it is not 0
+        self._symbol_users: typing.Dict[str, int] = dict()
+
+        # Optional on-disk store receiving the closed candles of the series and the historical candles downloaded
+        self.store: typing.Optional["CandleStore"] = None
+
+        # Protects the series dictionaries and the candles, which are updated by the websocket thread and the candle
+        # scheduler thread
+        self._lock = threading.RLock()
+
+        # Held while the series of a symbol are created (download included): the runners of several accounts sharing
+        # the hub subscribe at the same time, a series must only be created (and its streams subscribed) once
+        self._creation_locks: typing.Dict[str, threading.Lock] = dict()
+
+    # Attach the strategy to the series of its symbol and timeframe. The series (and the base series of the symbol)
+    # are created, with their historical candles, when they don't exist yet
+    # Returns False if no historical data could be retrieved
+    def subscribe(self, strategy: "Strategy") -> bool:
+        if strategy.candle_source == "klines":
+            series = self._get_kline_series(strategy.contract, strategy.tf)
+        else:
+            series = self._get_series(strategy.contract, strategy.tf)
+
+        if series is None:
+            return False
+
+        with self._lock:
+            series.subscribers = series.subscribers + [strategy]
+
+            symbol = strategy.contract.symbol
+            self._strategies_by_symbol[symbol] = self._strategies_by_symbol.get(symbol, []) + [strategy]
+
+        strategy.candles = series.candles
+
+        return True
+
+    def _creation_lock(self, symbol: str) -> threading.Lock:
+        with self._lock:
+            if symbol not in self._creation_locks:
+                self._creation_locks[symbol] = threading.Lock()
+
+            return self._creation_locks[symbol]
+
+    def _get_series(self, contract: Contract, timeframe: str) -> typing.Optional[CandleSeries]:
+        with self._creation_lock(contract.symbol):
+            return self._create_series(contract, timeframe)
+
+    def _create_series(self, contract: Contract, timeframe: str) -> typing.Optional[CandleSeries]:
+        with self._lock:
+            series = self._series.get((contract.symbol, timeframe))
+            base = self._series.get((contract.symbol, BASE_TF))
+
+        if series is not None:
+            return series
+
+        if base is None:
+            candles = self._download(contract, BASE_TF)
+
+            if len(candles) == 0:
+                return None
+
+            base = CandleSeries(self._exchange, contract, BASE_TF, candles)
+            self._add_series(base)
+
+            self._client.subscribe_trades(contract)
+            self._acquire_symbol(contract)
+            self._schedule_close(base)
+
+        if timeframe == BASE_TF:
+            return base
+
+        history = self._derived_history(contract, timeframe, base)
+
+        with self._lock:
+            series = ResampledSeries(base, timeframe, history)
+            self._add_series(series)
+
+        return series
+
+    def _get_kline_series(self, contract: Contract, timeframe: str) -> typing.Optional[KlineSeries]:
+        with self._creation_lock(contract.symbol):
+            return self._create_kline_series(contract, timeframe)
+
+    def _create_kline_series(self, contract: Contract, timeframe: str) -> typing.Optional[KlineSeries]:
+        with self._lock:
+            series = self._kline_series.get((contract.symbol, timeframe))
+
+        if series is not None:
+            return series
+
+        if timeframe not in self._client.kline_timeframes:
+            logger.warning("%s has no kline stream for the %s timeframe", self._exchange, timeframe)
+            return None
+
+        candles = self._download(contract, timeframe)
+
+        if len(candles) == 0:
+            return None
+
+        series = KlineSeries(self._exchange, contract, timeframe, candles)
+
+        with self._lock:
+            self._kline_series[(contract.symbol, timeframe)] = series
+
+        self._client.subscribe_klines(contract, timeframe)
+        self._acquire_symbol(contract)
+
+        return series
+
+    # The bid/ask (take profit and stop loss of the kline strategies, PNL) and the order book (trade size) are received
+    # as long as a series of the symbol exists
+    def _acquire_symbol(self, contract: Contract):
+        with self._lock:
+            self._symbol_users[contract.symbol] = self._symbol_users.get(contract.symbol, 0) + 1
+            first = self._symbol_users[contract.symbol] == 1
+
+        if first:
+            self._client.subscribe_prices(contract.symbol)
+            self._client.subscribe_order_book(contract)
+
+    def _release_symbol(self, contract: Contract):
+        with self._lock:
+            self._symbol_users[contract.symbol] -= 1
+            last = self._symbol_users[contract.symbol] == 0
+
+            if last:
+                del self._symbol_users[contract.symbol]
+
+        if last:
+            self._client.unsubscribe_prices(contract.symbol)
+            self._client.unsubscribe_order_book(contract)
+
+    # Historical candles of a derived timeframe: the base history resampled when it is long enough, otherwise the
+    # history of the closest native timeframe of the exchange, resampled
+    def _derived_history(self, contract: Contract, timeframe: str, base: CandleSeries) -> typing.List[Candle]:
+        history = resample_candles(base.candles, timeframe)
+
+        if len(history) >= MIN_HISTORY:
+            return history
+
+        # Another derived series of the symbol may already cover a longer period (e.g. 1h for 4h)
+        with self._lock:
+            sources = [s for s in self._series_by_symbol.get(contract.symbol, [])
+                       if s.tf != BASE_TF and TF_EQUIV[timeframe] % TF_EQUIV[s.tf] == 0]
+
+        for source in sources:
+            source_history = resample_candles(source.candles, timeframe)
+            if len(source_history) >= MIN_HISTORY:
+                return source_history
+
+        native = [tf for tf in self._client.history_timeframes
+                  if tf in TF_EQUIV and TF_EQUIV[tf] <= TF_EQUIV[timeframe] and TF_EQUIV[timeframe] % TF_EQUIV[tf] == 0]
+        native_tf = max(native, key=lambda tf: TF_EQUIV[tf])
+
+        if native_tf == BASE_TF:
+            return history
+
+        native_history = self._download(contract, native_tf)
+
+        if native_tf != timeframe:
+            native_history = resample_candles(native_history, timeframe)
+
+        # The base history is used for the last periods, except its first period which may be incomplete
+        if len(history) > 1:
+            native_history = [c for c in native_history if c.timestamp < history[1].timestamp]
+            return native_history + history[1:]
+
+        return native_history
+
+    def _add_series(self, series: CandleSeries):
+        with self._lock:
+            self._series[(series.contract.symbol, series.tf)] = series
+
+            symbol_series = self._series_by_symbol.get(series.contract.symbol, [])
+
+            if series.tf == BASE_TF:
+                self._series_by_symbol[series.contract.symbol] = [series] + symbol_series
+            else:
+                self._series_by_symbol[series.contract.symbol] = symbol_series + [series]
+
+    # Detach the strategy, the series is dropped when no strategy uses it anymore (the base series is kept as long as
+    # a series of the symbol exists)
+    def unsubscribe(self, strategy: "Strategy"):
+        symbol = strategy.contract.symbol
+
+        with self._lock:
+            strategies = [s for s in self._strategies_by_symbol.get(symbol, []) if s is not strategy]
+
+            if len(strategies) > 0:
+                self._strategies_by_symbol[symbol] = strategies
+            else:
+                self._strategies_by_symbol.pop(symbol, None)
+
+        if strategy.candle_source == "klines":
+            self._unsubscribe_klines(strategy)
+            return
+
+        with self._lock:
+            series = self._series.get((symbol, strategy.tf))
+
+            if series is None:
+                return
+
+            series.subscribers = [s for s in series.subscribers if s is not strategy]
+
+            symbol_series = self._series_by_symbol[symbol]
+
+            if len(series.subscribers) == 0 and series.tf != BASE_TF:
+                del self._series[(symbol, series.tf)]
+                symbol_series = [s for s in symbol_series if s is not series]
+
+            # Only the base series remains and nobody uses it
+            dropped = len(symbol_series) == 1 and len(symbol_series[0].subscribers) == 0
+
+            if dropped:
+                del self._series[(symbol, BASE_TF)]
+                symbol_series = []
+
+            self._series_by_symbol[symbol] = symbol_series
+
+        # The market data of the symbol is not received anymore
+        if dropped:
+            self._client.unsubscribe_trades(strategy.contract)
+            self._release_symbol(strategy.contract)
+
+    def _unsubscribe_klines(self, strategy: "Strategy"):
+        with self._lock:
+            series = self._kline_series.get((strategy.contract.symbol, strategy.tf))
+
+            if series is None:
+                return
+
+            series.subscribers = [s for s in series.subscribers if s is not strategy]
+
+            dropped = len(series.subscribers) == 0
+
+            if dropped:
+                del self._kline_series[(strategy.contract.symbol, strategy.tf)]
+
+        if dropped:
+            self._client.unsubscribe_klines(strategy.contract, strategy.tf)
+            self._release_symbol(strategy.contract)
+
+    # Called by the websocket thread for every trade: the base series of the symbol is updated once, the other
+    # timeframes are rolled up from it, then the events are sent to the strategies subscribed to each series
+    def on_trade(self, symbol: str, price: float, size: float, timestamp: int):
+        symbol_series = self._series_by_symbol.get(symbol)
+
+        if not symbol_series:
+            return
+
+        # Calculate difference of current unix timestamp and timestamp of trade
+        timestamp_diff = self._client.now_ms() - timestamp
+        if timestamp_diff >= 2000:
+            logger.warning("%s %s: %s milliseconds of difference between the current time and the trade time",
+                           self._exchange, symbol, timestamp_diff, extra={"rate_limit": True})
+
+        with self._lock:
+            tick_type = symbol_series[0].update(price, size, timestamp)
+
+            if tick_type is None:
+                return
+
+            events = [(symbol_series[0], tick_type)]
+
+            for series in symbol_series[1:]:
+                events.append((series, series.roll_up()))
+
+        self._send_events(events)
+
+    # Called by the websocket thread for every bid/ask update
+    def on_price(self, symbol: str, bid: typing.Optional[float], ask: typing.Optional[float]):
+        for strategy in self._strategies_by_symbol.get(symbol, []):
+            strategy.on_price(bid, ask)
+
+    # Called by the client (in a thread) after the websocket connection was reopened: the base candles from the
+    # disconnection are downloaded concurrently for every symbol and replace the candles built during the gap (flat
+    # candles of the candle scheduler, candles missing trades), then the higher timeframes are rolled up again
+    def resync(self, disconnected_at: int):
+        with self._lock:
+            symbol_series = [s for s in self._series_by_symbol.values() if len(s) > 0]
+            kline_series = list(self._kline_series.values())
+
+        if len(symbol_series) + len(kline_series) == 0:
+            return
+
+        # The base series of each symbol and every kline series are downloaded from the period of the disconnection
+        to_download = [series[0] for series in symbol_series] + kline_series
+
+        def download(series: CandleSeries) -> typing.List[Candle]:
+            start = disconnected_at - disconnected_at % series.tf_equiv
+            return self._download(series.contract, series.tf, start)
+
+        resync_start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=min(len(to_download), 10)) as executor:
+            downloads = dict(zip([id(series) for series in to_download], executor.map(download, to_download)))
+
+        with self._lock:
+            for series in symbol_series:
+                base = series[0]
+                candles = downloads[id(base)]
+
+                # The series was dropped during the download
+                if len(candles) == 0 or self._series.get((base.contract.symbol, BASE_TF)) is not base:
+                    continue
+
+                self._splice(base, candles)
+
+                for derived in series[1:]:
+                    derived.resync(candles[0].timestamp)
+
+            for series in kline_series:
+                candles = downloads[id(series)]
+
+                if len(candles) > 0 and self._kline_series.get((series.contract.symbol, series.tf)) is series:
+                    self._splice(series, candles)
+
+        logger.info("%s %s candle series resynchronized in %.0f ms", self._exchange, len(to_download),
+                    (time.perf_counter() - resync_start) * 1000)
+
+    # Replace the candles of the series from the first candle downloaded (the list is modified in place, the
+    # strategies reference it)
+    @staticmethod
+    def _splice(series: CandleSeries, candles: typing.List[Candle]):
+        index = len(series.candles)
+        while index > 0 and series.candles[index - 1].timestamp >= candles[0].timestamp:
+            index -= 1
+
+        # The updates received since the download are kept in the current candle
+        if candles[-1].timestamp < series.candles[-1].timestamp:
+            candles = candles + [c for c in series.candles[index:] if c.timestamp > candles[-1].timestamp]
+
+        series.candles[index:] = candles
+
+    def add_kline_listener(self, listener: typing.Callable[[str, str, Candle, bool], None]):
+        with self._lock:
+            self._kline_listeners = self._kline_listeners + [listener]
+
+    # Called by the websocket thread for every candle of the kline streams
+    def on_kline(self, symbol: str, timeframe: str, candle: Candle, closed: bool):
+        for listener in self._kline_listeners:
+            listener(symbol, timeframe, candle, closed)
+
+        series = self._kline_series.get((symbol, timeframe))
+
+        if series is None:
+            return
+
+        with self._lock:
+            tick_type = series.update_kline(candle, closed)
+
+        if tick_type is not None:
+            self._send_events([(series, tick_type)])
+
+    # Historical candles of the exchange, the closed ones are also written to the store
+    def _download(self, contract: Contract, timeframe: str, start: typing.Optional[int] = None) -> typing.List[Candle]:
+        candles = self._client.get_historical_candles(contract, timeframe, start)
+
+        if self.store is not None and len(candles) > 0:
+            now = self._client.now_ms()
+            self.store.append(self._exchange, contract.symbol, timeframe,
+                              [c for c in candles if c.timestamp + TF_EQUIV[timeframe] * 1000 <= now])
+
+        return candles
+
+    # The strategies receive the events outside of the lock, their orders are sent from here
+    def _send_events(self, events: typing.List[typing.Tuple[CandleSeries, str]]):
+        for series, tick_type in events:
+            if tick_type == "new_candle" and self.store is not None:
+                self._store_closed(series)
+
+            for strategy in series.subscribers:
+                strategy.on_candle_event(tick_type)
+
+    # Send the candles of the series that can't change anymore to the store: the candles before the open ones
+    # (CandleSeries.open_candles), several when the scheduler added flat candles at once
+    def _store_closed(self, series: CandleSeries):
+        candles = series.candles
+        end = len(candles) - series.open_candles
+        start = end
+
+        while start > 0 and candles[start - 1].timestamp > series.stored_until:
+            start -= 1
+
+        if start < end:
+            self.store.append(self._exchange, series.contract.symbol, series.tf, candles[start:end])
+            series.stored_until = candles[end - 1].timestamp
+
+    # Ask the candle scheduler to close the current candle of a base series at the end of its period (exchange time
+    # converted to local time)
+    def _schedule_close(self, base: CandleSeries):
+        deadline = base.candles[-1].timestamp + base.tf_equiv + CLOSE_DELAY_MS - self._client.clock_offset
+        get_scheduler().schedule(deadline, self._close_candles, base)
+
+    # Called by the candle scheduler thread with every base series whose period ended at the same time: the new
+    # candles are added and all the events are sent in one batch
+    def _close_candles(self, bases: typing.List[CandleSeries]):
+        now = self._client.now_ms()
+        events = []
+
+        with self._lock:
+            for base in bases:
+                # The series was dropped since it was scheduled
+                if self._series.get((base.contract.symbol, BASE_TF)) is not base:
+                    continue
+
+                if base.close_candles(now):
+                    logger.info("%s New candle for %s %s (closed on time)", self._exchange, base.contract.symbol,
+                                base.tf)
+
+                    symbol_series = self._series_by_symbol[base.contract.symbol]
+                    events.append((base, "new_candle"))
+
+                    for series in symbol_series[1:]:
+                        events.append((series, series.roll_up()))
+
+                self._schedule_close(base)
+
+        self._send_events(events)
@@ -3,7 +3,9 @@ import datetime
 
 
 BITMEX_MULTIPLIER = 0.00000001
-BITMEX_TF_MINUTES = {"1m": 1, "5m": 5, "1h": 60, "1d": 1440}
+BITMEX_ORDER_TYPES = {"MARKET": "Market", "LIMIT": "Limit", "STOP": "Stop", "MARKET_IF_TOUCHED": "MarketIfTouched"}
+BITMEX_TRADE_BINS = {"tradeBin1m": "1m", "tradeBin5m": "5m", "tradeBin1h": "1h", "tradeBin1d": "1d"}
+BITMEX_TF_MINUTES = {"1m": 1, "5m": 5, "15m": 15, "30m": 30, "1h": 60, "4h": 240, "1d": 1440}
 
 # Creating balance class with dictionary being the key and the balance object will be the value
 # Will prevent from having to keep looking at documentation. Doing same with other classes
@@ -46,7 +48,7 @@ class Candle:
             self.close = candle_info['close']
             self.volume = candle_info['volume']
 
-        # Need another case for when the candle comes from the parse_trades() method
+        # Need another case for when the candle is built from the trades by the market data hub (CandleSeries.update())
         elif exchange == "parse_trade":
             self.timestamp = candle_info['ts']
             self.open = candle_info['open']
@@ -98,6 +100,23 @@ class Contract:
             if self.inverse:
                 self.multiplier *= -1
 
+        # Contract loaded from the contracts cache, every value is already parsed
+        elif exchange == "cache":
+            self.symbol = contract_info['symbol']
+            self.base_asset = contract_info['base_asset']
+            self.quote_asset = contract_info['quote_asset']
+            self.price_decimals = contract_info['price_decimals']
+            self.quantity_decimals = contract_info['quantity_decimals']
+            self.tick_size = contract_info['tick_size']
+            self.lot_size = contract_info['lot_size']
+
+            exchange = contract_info['exchange']
+
+            if exchange == "bitmex":
+                self.quanto = bool(contract_info['quanto'])
+                self.inverse = bool(contract_info['inverse'])
+                self.multiplier = contract_info['multiplier']
+
         self.exchange = exchange
 
 class OrderStatus:
@@ -107,11 +126,23 @@ class OrderStatus:
             self.status = order_info['status'].lower()
             self.avg_price = float(order_info['avgPrice'])
             self.executed_qty = float(order_info['executedQty'])
+        # Order update of the Binance user data stream (ORDER_TRADE_UPDATE event)
+        elif exchange == "binance_stream":
+            self.order_id = order_info['i']
+            self.status = order_info['X'].lower()
+            self.avg_price = float(order_info['ap'])
+            self.executed_qty = float(order_info['z'])
         elif exchange == "bitmex":
             self.order_id = order_info['orderID']
             self.status = order_info['ordStatus'].lower()
             self.avg_price = order_info['avgPx']
             self.executed_qty = order_info['cumQty']
+        # Order update of the Bitmex order stream, the fields that did not change are missing
+        elif exchange == "bitmex_stream":
+            self.order_id = order_info['orderID']
+            self.status = order_info['ordStatus'].lower()
+            self.avg_price = order_info.get('avgPx')
+            self.executed_qty = order_info.get('cumQty')
 
 # Data model for the trade
 class Trade:
@@ -125,4 +156,7 @@ class Trade:
         self.pnl: float = trade_info['pnl']
         self.quantity = trade_info['quantity']
         self.entry_id = trade_info['entry_id']
+        # Order ids of the exit orders placed on the exchange ("take_profit"/"stop_loss"), empty when the take profit and
+        # stop loss are checked by the strategy
+        self.exit_orders = dict()
 
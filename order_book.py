@@ -0,0 +1,325 @@
+# Local L2 order books, kept up to date from the depth updates of the websocket streams
+# Binance: <symbol>@depth@100ms diffs synchronized with a REST snapshot (the diffs received before the snapshot are
+# buffered, and a gap in the update ids means that a new snapshot is needed)
+# Bitmex: orderBookL2_25 (partial, then insert/update/delete of the levels identified by their id)
+# Each side keeps its prices sorted (bisect), so the best levels and the cumulative depth are read without sorting
+
+import bisect
+import logging
+import threading
+import time
+import typing
+
+logger = logging.getLogger()
+
+# Maximum slippage (fraction of the best price) accepted when the trade size is capped by the order book depth
+MAX_SLIPPAGE = 0.002
+
+# Number of diffs kept while waiting for the Binance snapshot
+MAX_BUFFERED_DIFFS = 1000
+
+
+class BookSide:
+    def __init__(self, is_bid: bool):
+        self.is_bid = is_bid
+
+        # Sort keys of the price levels, ascending: -price for the bids so that the best level is always the first
+        self._keys: typing.List[float] = []
+        self.levels: typing.Dict[float, float] = dict()
+
+    def clear(self):
+        self._keys = []
+        self.levels = dict()
+
+    # Set the quantity of a price level, 0 removes the level. O(log n) search, the list insertion/deletion is a
+    # memmove of the keys after the level
+    def update(self, price: float, quantity: float):
+        key = -price if self.is_bid else price
+
+        if quantity == 0:
+            if price in self.levels:
+                del self.levels[price]
+                del self._keys[bisect.bisect_left(self._keys, key)]
+            return
+
+        if price not in self.levels:
+            bisect.insort(self._keys, key)
+
+        self.levels[price] = quantity
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def best(self) -> typing.Optional[typing.Tuple[float, float]]:
+        if len(self._keys) == 0:
+            return None
+
+        price = -self._keys[0] if self.is_bid else self._keys[0]
+        return price, self.levels[price]
+
+    # The n best levels, best first
+    def top(self, n: int) -> typing.List[typing.Tuple[float, float]]:
+        prices = [-k for k in self._keys[:n]] if self.is_bid else self._keys[:n]
+        return [(price, self.levels[price]) for price in prices]
+
+    # Levels from the best one
+    def __iter__(self) -> typing.Iterator[typing.Tuple[float, float]]:
+        for key in self._keys:
+            price = -key if self.is_bid else key
+            yield price, self.levels[price]
+
+    # Quantity available at prices as good as limit_price or better
+    def cumulative_quantity(self, limit_price: float) -> float:
+        end = bisect.bisect_right(self._keys, -limit_price if self.is_bid else limit_price)
+
+        total = 0
+        for key in self._keys[:end]:
+            total += self.levels[-key if self.is_bid else key]
+        return total
+
+    # Average price of a market order of the quantity taking the liquidity of this side, and the quantity that the
+    # book can fill
+    def fill_price(self, quantity: float) -> typing.Tuple[typing.Optional[float], float]:
+        remaining = quantity
+        cost = 0
+
+        for price, level_quantity in self:
+            taken = min(remaining, level_quantity)
+            cost += taken * price
+            remaining -= taken
+
+            if remaining <= 0:
+                break
+
+        filled = quantity - remaining
+
+        if filled == 0:
+            return None, 0
+
+        return cost / filled, filled
+
+
+class OrderBook:
+    def __init__(self, exchange: str, symbol: str):
+        self.exchange = exchange
+        self.symbol = symbol
+
+        self.bids = BookSide(True)
+        self.asks = BookSide(False)
+
+        # False until the snapshot (Binance) or the partial (Bitmex) was received, and after a gap in the updates
+        self.synced = False
+
+        # Exchange time (milliseconds) of the last update
+        self.timestamp = 0
+
+        # Binance: update id of the last diff applied, diffs received before the snapshot
+        self.last_update_id = 0
+        self._buffer: typing.List[typing.Dict] = []
+
+        # Bitmex: (side, price) of each level id
+        self._ids: typing.Dict[int, typing.Tuple[BookSide, float]] = dict()
+
+        # The book is updated by the websocket thread (and the snapshot thread) and read by the strategies
+        self.lock = threading.RLock()
+
+    def best_bid(self) -> typing.Optional[float]:
+        with self.lock:
+            best = self.bids.best()
+        return best[0] if best is not None else None
+
+    def best_ask(self) -> typing.Optional[float]:
+        with self.lock:
+            best = self.asks.best()
+        return best[0] if best is not None else None
+
+    # Side of the book taken by a market order: the asks for a buy, the bids for a sell
+    def _taker_side(self, side: str) -> BookSide:
+        return self.asks if side.lower() == "buy" else self.bids
+
+    # Average fill price of a market order and its slippage compared to the best price (fraction, e.g. 0.001 = 0.1%)
+    def estimate_slippage(self, side: str, quantity: float) -> typing.Tuple[typing.Optional[float], typing.Optional[float]]:
+        book_side = self._taker_side(side)
+
+        with self.lock:
+            best = book_side.best()
+
+            if best is None:
+                return None, None
+
+            avg_price, filled = book_side.fill_price(quantity)
+
+        if filled < quantity:
+            return avg_price, None
+
+        return avg_price, abs(avg_price - best[0]) / best[0]
+
+    # Largest market order quantity whose average fill price stays within max_slippage of the best price
+    def max_quantity(self, side: str, max_slippage: float = MAX_SLIPPAGE) -> float:
+        with self.lock:
+            return self._max_quantity(self._taker_side(side), max_slippage)
+
+    def _max_quantity(self, book_side: BookSide, max_slippage: float) -> float:
+        best = book_side.best()
+
+        if best is None:
+            return 0
+
+        # The average price of a buy must stay below the limit, the average price of a sell above it
+        sign = 1 if book_side is self.asks else -1
+        limit = best[0] * (1 + sign * max_slippage)
+
+        quantity = 0
+        cost = 0
+
+        for price, level_quantity in book_side:
+            # Whole level taken while the average price stays within the limit
+            if sign * (cost + level_quantity * price) <= sign * limit * (quantity + level_quantity):
+                quantity += level_quantity
+                cost += level_quantity * price
+                continue
+
+            # Part of the level: average price == limit
+            if price != limit:
+                quantity += max((limit * quantity - cost) / (price - limit), 0)
+            break
+
+        return quantity
+
+    # Binance
+
+    # REST snapshot: the buffered diffs that follow it are applied. Returns False if they do not follow the snapshot
+    def apply_snapshot(self, last_update_id: int, bids: typing.List, asks: typing.List) -> bool:
+        with self.lock:
+            return self._apply_snapshot(last_update_id, bids, asks)
+
+    def _apply_snapshot(self, last_update_id: int, bids: typing.List, asks: typing.List) -> bool:
+        self.bids.clear()
+        self.asks.clear()
+
+        for price, quantity in bids:
+            self.bids.update(float(price), float(quantity))
+        for price, quantity in asks:
+            self.asks.update(float(price), float(quantity))
+
+        self.last_update_id = last_update_id
+        self.synced = True
+
+        buffer = self._buffer
+        self._buffer = []
+
+        for diff in buffer:
+            if not self._apply_diff(diff):
+                return False
+
+        return True
+
+    # depthUpdate event of the diff stream. Returns False when an update was missed (a new snapshot is needed)
+    def apply_diff(self, diff: typing.Dict) -> bool:
+        with self.lock:
+            return self._apply_diff(diff)
+
+    def _apply_diff(self, diff: typing.Dict) -> bool:
+        if not self.synced:
+            if len(self._buffer) < MAX_BUFFERED_DIFFS:
+                self._buffer.append(diff)
+            return True
+
+        # Diff older than the snapshot
+        if diff['u'] < self.last_update_id:
+            return True
+
+        # The first diff after the snapshot must contain the snapshot update id, the next ones must follow each other
+        first_after_snapshot = diff['U'] <= self.last_update_id <= diff['u']
+
+        if not first_after_snapshot and diff['pu'] != self.last_update_id:
+            logger.warning("%s %s order book out of sync (update %s expected, %s received)", self.exchange,
+                           self.symbol, self.last_update_id, diff['pu'])
+            self.synced = False
+            self._buffer = [diff]
+            return False
+
+        for price, quantity in diff['b']:
+            self.bids.update(float(price), float(quantity))
+        for price, quantity in diff['a']:
+            self.asks.update(float(price), float(quantity))
+
+        self.last_update_id = diff['u']
+        self.timestamp = diff['E']
+
+        return True
+
+    # Bitmex
+
+    # orderBookL2_25 message (action "partial", "insert", "update" or "delete")
+    def apply_l2(self, action: str, levels: typing.List[typing.Dict]):
+        with self.lock:
+            self._apply_l2(action, levels)
+
+    def _apply_l2(self, action: str, levels: typing.List[typing.Dict]):
+        if action == "partial":
+            self.bids.clear()
+            self.asks.clear()
+            self._ids = dict()
+            self.synced = True
+
+        elif not self.synced:
+            return
+
+        for level in levels:
+            level_id = level['id']
+
+            if action == "delete":
+                if level_id in self._ids:
+                    side, price = self._ids.pop(level_id)
+                    side.update(price, 0)
+                continue
+
+            if level_id in self._ids:
+                side, price = self._ids[level_id]
+            else:
+                side = self.bids if level['side'] == "Buy" else self.asks
+                price = level['price']
+                self._ids[level_id] = (side, price)
+
+            side.update(price, level['size'])
+
+        self.timestamp = int(time.time() * 1000)
+
+
+if __name__ == '__main__':
+    # Update rate benchmark: 20 symbols, each diff changes 20 levels around the best prices of a 1000 levels book
+    import random
+
+    books = [OrderBook("Binance", f"SYM{i}USDT") for i in range(20)]
+
+    for book in books:
+        book.apply_snapshot(1, [[str(10000 - i * 0.1), "1.0"] for i in range(1000)],
+                            [[str(10000.1 + i * 0.1), "1.0"] for i in range(1000)])
+
+    diffs = []
+    for i in range(20000):
+        diffs.append({'U': i + 2, 'u': i + 2, 'pu': i + 1, 'E': i,
+                      'b': [[str(round(10000 - random.randint(0, 50) * 0.1, 1)), str(random.choice([0, 0.5, 2]))]
+                            for _ in range(10)],
+                      'a': [[str(round(10000.1 + random.randint(0, 50) * 0.1, 1)), str(random.choice([0, 0.5, 2]))]
+                            for _ in range(10)]})
+
+    start = time.perf_counter()
+    for i, diff in enumerate(diffs):
+        books[0].apply_diff(diff)
+    elapsed = time.perf_counter() - start
+
+    # Binance sends at most 10 diffs per second per symbol on the @100ms stream
+    print(f"{len(diffs) / elapsed:,.0f} diffs/s on one book ({elapsed / len(diffs) * 1e6:.1f} us per diff of 20 levels),"
+          f" needed for 20 symbols: 200 diffs/s")
+
+    start = time.perf_counter()
+    for _ in range(10000):
+        books[0].estimate_slippage("buy", 25)
+        books[0].max_quantity("sell", 0.002)
+    elapsed = time.perf_counter() - start
+    print(f"Slippage estimate + size cap: {elapsed / 10000 * 1e6:.1f} us")
+
+    print("Best bid/ask:", books[0].best_bid(), books[0].best_ask(), "slippage for 25:",
+          books[0].estimate_slippage("buy", 25), "max sell quantity within 0.2%:", books[0].max_quantity("sell"))
@@ -0,0 +1,203 @@
+# Best bid/ask of every symbol of a client, written by the websocket thread and read by the interface, the strategies
+# and the headless runner
+# Each symbol gets a slot (an index) in preallocated lists of bids, asks and timestamps: an update only replaces three
+# references to the numbers parsed from the message, no dictionary is created or resized. Unknown prices are NaN (read
+# as None). Lists are used rather than arrays, reading a float from an array allocates a new object every time
+# A sequence counter per slot makes the reads consistent without a lock (seqlock): the writer increments it before and
+# after writing the slot (odd while the slot is being written), a reader retries when the counter was odd or changed
+# during its read. There must be a single writer per cache, the websocket thread of the feed client
+
+import math
+import threading
+import typing
+
+# Slots allocated at first, the lists are grown (copied) when more symbols are received
+INITIAL_CAPACITY = 1024
+
+# Reads retried before giving up on a consistent read, the writer only holds a slot for a few bytecodes
+MAX_READ_RETRIES = 100
+
+
+class PriceCache:
+    def __init__(self, capacity: int = INITIAL_CAPACITY):
+        self._slots: typing.Dict[str, int] = dict()
+        self._symbols: typing.List[str] = []
+
+        self._allocate(capacity)
+
+        # Only slot creations are locked (the writer and the threads calling slot())
+        self._slots_lock = threading.Lock()
+
+    def _allocate(self, capacity: int):
+        old_size = len(self._symbols)
+
+        bids: typing.List[float] = [math.nan] * capacity
+        asks: typing.List[float] = [math.nan] * capacity
+        timestamps: typing.List[int] = [0] * capacity
+        sequences: typing.List[int] = [0] * capacity
+
+        if old_size > 0:
+            bids[:old_size] = self._bids[:old_size]
+            asks[:old_size] = self._asks[:old_size]
+            timestamps[:old_size] = self._timestamps[:old_size]
+            sequences[:old_size] = self._sequences[:old_size]
+
+        # The readers using the previous lists read prices that are at most one update old
+        self._bids, self._asks, self._timestamps, self._sequences = bids, asks, timestamps, sequences
+
+    # O(1) slot of the symbol, created on first use
+    def slot(self, symbol: str) -> int:
+        slot = self._slots.get(symbol)
+
+        if slot is not None:
+            return slot
+
+        with self._slots_lock:
+            if symbol not in self._slots:
+                if len(self._symbols) == len(self._bids):
+                    self._allocate(2 * len(self._bids))
+
+                self._symbols.append(symbol)
+                self._slots[symbol] = len(self._symbols) - 1
+
+            return self._slots[symbol]
+
+    # Called by the websocket thread. A None price keeps the previous one (Bitmex updates only contain the fields that
+    # changed)
+    def update(self, symbol: str, bid: typing.Optional[float], ask: typing.Optional[float], timestamp: int):
+        slot = self._slots.get(symbol)
+        if slot is None:
+            slot = self.slot(symbol)
+
+        sequences = self._sequences
+        sequences[slot] += 1
+
+        if bid is not None:
+            self._bids[slot] = bid
+        if ask is not None:
+            self._asks[slot] = ask
+        self._timestamps[slot] = timestamp
+
+        sequences[slot] += 1
+
+    def __contains__(self, symbol: str) -> bool:
+        slot = self._slots.get(symbol)
+        return slot is not None and self._sequences[slot] > 0
+
+    def symbols(self) -> typing.List[str]:
+        return list(self._symbols)
+
+    # Consistent bid, ask and timestamp of the symbol, (None, None, 0) if no price was received
+    def get(self, symbol: str) -> typing.Tuple[typing.Optional[float], typing.Optional[float], int]:
+        slot = self._slots.get(symbol)
+
+        if slot is None:
+            return None, None, 0
+
+        for _ in range(MAX_READ_RETRIES):
+            bids, asks, timestamps, sequences = self._bids, self._asks, self._timestamps, self._sequences
+
+            sequence = sequences[slot]
+
+            if sequence % 2 == 0:
+                bid, ask, timestamp = bids[slot], asks[slot], timestamps[slot]
+
+                if sequences[slot] == sequence:
+                    return (bid if bid == bid else None), (ask if ask == ask else None), timestamp
+
+        return None, None, 0
+
+    # Bid and ask of several symbols (every symbol by default) at once: the lists are copied in one go, only the
+    # slots written during the copy are read again
+    def snapshot(self, symbols: typing.Optional[typing.Iterable[str]] = None) -> \
+            typing.Dict[str, typing.Tuple[typing.Optional[float], typing.Optional[float]]]:
+        bids, asks, sequences = self._bids, self._asks, self._sequences
+
+        before = sequences[:]
+        bids_copy = bids[:]
+        asks_copy = asks[:]
+        after = sequences[:]
+
+        slots = self._slots
+        symbols = list(slots) if symbols is None else symbols
+
+        result = dict()
+
+        for symbol in symbols:
+            slot = slots.get(symbol)
+
+            if slot is None or slot >= len(before) or after[slot] == 0:
+                continue
+
+            if before[slot] == after[slot] and before[slot] % 2 == 0:
+                bid, ask = bids_copy[slot], asks_copy[slot]
+                result[symbol] = ((bid if bid == bid else None), (ask if ask == ask else None))
+            else:
+                result[symbol] = self.get(symbol)[:2]
+
+        return result
+
+
+if __name__ == '__main__':
+    # Update cost compared to the dictionary of dictionaries, and consistency of the reads while a thread writes
+    import time
+
+    symbols = [f"SYM{i}USDT" for i in range(300)]
+    n = 1_000_000
+
+    # Previous storage of the clients
+    prices: typing.Dict[str, typing.Dict[str, float]] = dict()
+
+    def update_dict(symbol: str, bid: float, ask: float, timestamp: int):
+        if symbol not in prices:
+            prices[symbol] = {'bid': bid, 'ask': ask}
+        else:
+            prices[symbol]['bid'] = bid
+            prices[symbol]['ask'] = ask
+
+    messages = [(symbols[i % 300], float(i), float(i + 1), i) for i in range(n)]
+
+    start = time.perf_counter()
+    for symbol, bid, ask, timestamp in messages:
+        update_dict(symbol, bid, ask, timestamp)
+    dict_elapsed = time.perf_counter() - start
+
+    cache = PriceCache()
+    start = time.perf_counter()
+    for symbol, bid, ask, timestamp in messages:
+        cache.update(symbol, bid, ask, timestamp)
+    cache_elapsed = time.perf_counter() - start
+
+    print(f"Update: {dict_elapsed / n * 1e9:.0f} ns with the dictionaries, {cache_elapsed / n * 1e9:.0f} ns with the "
+          f"price cache")
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        cache.snapshot()
+    print(f"Snapshot of {len(symbols)} symbols: {(time.perf_counter() - start) / 1000 * 1e6:.0f} us")
+
+    # The writer always writes ask = bid + 1, a torn read would break it
+    running = True
+
+    def write():
+        i = 0
+        while running:
+            cache.update(symbols[i % 300], float(i), float(i + 1), i)
+            i += 1
+
+    t = threading.Thread(target=write)
+    t.start()
+
+    reads = 0
+    start = time.time()
+    while time.time() - start < 2:
+        for symbol, (bid, ask) in cache.snapshot().items():
+            assert ask == bid + 1, (symbol, bid, ask)
+        bid, ask, timestamp = cache.get(symbols[reads % 300])
+        assert ask == bid + 1 and timestamp == bid, (bid, ask, timestamp)
+        reads += 1
+
+    running = False
+    t.join()
+
+    print(f"{reads} consistent snapshots and reads while the websocket thread was writing")
@@ -4,6 +4,7 @@ import tkinter as tk
 from tkinter.messagebox import askquestion
 import logging
 import json
+import threading
 
 from bitmex import BitmexClient
 from binance_futures import BinanceFuturesClient
@@ -13,17 +14,27 @@ from logging_component import Logging
 from watchlist_component import Watchlist
 from trades_component import TradesWatch
 from strategy_component import StrategyEditor
+from symbol_index import SymbolIndex
+from scanner import Scanner
+from database import WorkspaceData, trade_row
+from models import Contract, Trade
+from flatten import flatten_all
+from utils import CpuMeter
 
 logger = logging.getLogger()
 
 # Inherits from Tkinter library
 class Root(tk.Tk):
-    def __init__(self, binance: BinanceFuturesClient, bitmex: BitmexClient):
+    # scanner: scan every contract of the exchanges for signals (see scanner.py)
+    def __init__(self, binance: BinanceFuturesClient, bitmex: BitmexClient, scanner: bool = False):
         super().__init__()
 
         self.binance = binance
         self.bitmex = bitmex
 
+        # Trades are saved to the database while the strategies run, the writes happen in the database writer thread
+        self._db = WorkspaceData()
+
         self.title("Crypto Trading Bot")
         self.protocol("WM_DELETE_WINDOW", self._ask_before_close)
 
@@ -43,6 +54,13 @@ class Root(tk.Tk):
         self.main_menu.add_cascade(label="Workspace", menu=self.workspace_menu)
         self.workspace_menu.add_command(label="Save workspace", command=self._save_workspace)
 
+        self.trading_menu = tk.Menu(self.main_menu, tearoff=False)
+        self.main_menu.add_cascade(label="Trading", menu=self.trading_menu)
+        self.trading_menu.add_command(label="Flatten everything", command=self._flatten_everything)
+
+        # Logs added by the threads of the root component, displayed by _update_ui()
+        self._logs = []
+
         # Initializing frames for window
         self._left_frame = tk.Frame(self, bg=BG_COLOR)
         self._left_frame.pack(side=tk.LEFT)
@@ -50,41 +68,165 @@ class Root(tk.Tk):
         self._right_frame = tk.Frame(self, bg=BG_COLOR)
         self._right_frame.pack(side=tk.LEFT)
 
-        self._watchlist_frame = Watchlist(self.binance.contracts, self.bitmex.contracts, self._left_frame, bg=BG_COLOR)
+        # Symbol index built once and shared by the watchlist autocompletes and the strategy editor
+        self.symbol_index = SymbolIndex()
+        self.symbol_index.set_contracts("Binance", self.binance.contracts)
+        self.symbol_index.set_contracts("Bitmex", self.bitmex.contracts)
+
+        # Contracts versions displayed in the UI, the clients replace their cached contracts once the exchanges answer
+        self._contracts_versions = {"Binance": self.binance.contracts_version, "Bitmex": self.bitmex.contracts_version}
+        self._startup_reported = {"Binance": False, "Bitmex": False}
+
+        # Signals of every contract, started once the contracts of the exchange are known. Optional: the history of every
+        # contract is downloaded at startup
+        self._scanners = dict()
+
+        if scanner:
+            self._scanners = {"Binance": Scanner(self.binance, "Binance"), "Bitmex": Scanner(self.bitmex, "Bitmex")}
+        self._displayed_candidates = dict()
+
+        self._watchlist_frame = Watchlist(self.binance, self.bitmex, self.symbol_index, self._left_frame, bg=BG_COLOR)
         self._watchlist_frame.pack(side=tk.TOP)
 
         self.logging_frame = Logging(self._left_frame, bg=BG_COLOR)
         self.logging_frame.pack(side=tk.TOP)
 
-        self._strategy_frame = StrategyEditor(self, self.binance, self.bitmex, self._right_frame, bg=BG_COLOR)
+        self._strategy_frame = StrategyEditor(self, self.binance, self.bitmex, self.symbol_index, self._right_frame, bg=BG_COLOR)
         self._strategy_frame.pack(side=tk.TOP)
 
         # Places new component on root component
         self._trades_frame = TradesWatch(self._right_frame, bg=BG_COLOR)
         self._trades_frame.pack(side=tk.TOP)
 
+        self._load_trades()
+
         # Call update method once after root component is initiated
         self._update_ui()
 
+    # Trades of the previous sessions, saved in the database. The contract of a symbol not listed anymore is rebuilt
+    # from the trade, for display only
+    def _load_trades(self):
+        clients = {"binance": self.binance, "bitmex": self.bitmex}
+
+        for row in self._db.get("trades"):
+            contract = clients[row['exchange']].contracts.get(row['symbol'])
+
+            if contract is None:
+                contract = Contract({"symbol": row['symbol'], "exchange": row['exchange'], "base_asset": None,
+                                     "quote_asset": None, "price_decimals": 8, "quantity_decimals": 8,
+                                     "tick_size": None, "lot_size": None, "quanto": False, "inverse": False,
+                                     "multiplier": 1}, "cache")
+
+            self._trades_frame.add_trade(Trade({"time": row['time'], "contract": contract, "strategy": row['strategy'],
+                                                "side": row['side'], "entry_price": row['entry_price'],
+                                                "status": row['status'], "pnl": row['pnl'],
+                                                "quantity": row['quantity'], "entry_id": row['entry_id']}))
+
     # Called when the user clicks closes/tries to exit the program
     # Gives control of what is to happen before closing the UI
     def _ask_before_close(self):
         result = askquestion("Confirmation", "Do you want to exit the application?")
         if result == "yes":
-            self.binance.reconnect = False
-            self.bitmex.reconnect = False
+            if self._has_open_trades():
+                if askquestion("Open positions", "Close all the open positions before exiting?") == "yes":
+                    failed, elapsed = flatten_all([self.binance, self.bitmex])
+                    logger.info("Positions closed in %.0f ms before exiting (%s symbols failed)", elapsed * 1000, failed)
+
+            self.close()
+
+    # Stop the connections, wait for the database and destroy the window
+    def close(self):
+        self.binance.reconnect = False
+        self.bitmex.reconnect = False
+
+        for scanner in self._scanners.values():
+            scanner.stop()
+
+        # Wait (a little) for the queued database writes
+        self._db.flush(timeout=5)
+
+        # The websocket connections don't exist yet if the clients are still initializing
+        if self.binance.ws is not None:
             self.binance.ws.close()
+        if self.bitmex.ws is not None:
             self.bitmex.ws.close()
 
-            self.destroy()
+        self.destroy()
+
 
+    # CPU benchmark of the interface (main.py --benchmark): once the clients are ready, every strategy of the workspace
+    # is activated and the average CPU use of the process over the duration (seconds) is logged before closing, to
+    # compare with the headless runner running the same strategies
+    def benchmark(self, duration: float):
+        if not (self.binance.ready and self.bitmex.ready):
+            self.after(100, lambda: self.benchmark(duration))
+            return
+
+        self._strategy_frame.activate_all()
+
+        cpu = CpuMeter()
+
+        def report():
+            strategies = len(self.binance.strategies) + len(self.bitmex.strategies)
+            logger.info("Interface benchmark: %s strategies, %.1f%% CPU on average over %.0f s", strategies,
+                        cpu.percent(), duration)
+            self.close()
+
+        self.after(int(duration * 1000), report)
+
+    def _has_open_trades(self) -> bool:
+        for client in [self.binance, self.bitmex]:
+            for b_index, strat in client.strategies.items():
+                if any(trade.status == "open" for trade in strat.trades):
+                    return True
+        return False
+
+    # Close every position of the strategies, in the background so that the UI is not blocked
+    def _flatten_everything(self):
+        def flatten():
+            failed, elapsed = flatten_all([self.binance, self.bitmex])
+
+            if failed > 0:
+                self._logs.append({"log": f"Flatten everything: {failed} symbols could not be closed",
+                                   "displayed": False})
+            self._logs.append({"log": f"Flat in {elapsed * 1000:.0f} ms", "displayed": False})
+
+        self.logging_frame.add_log("Closing all the open positions...")
+
+        t = threading.Thread(target=flatten, daemon=True)
+        t.start()
 
     # Checks periodically for new logs to add and updates elements of the UI
     # Called every 1500 seconds, similar to infinite loop in another class, but it runs in the same thread as .mainloop()
     def _update_ui(self):
 
+        # Contracts and startup timing report, once the clients initialized in the background
+        contracts_changed = False
+
+        for exchange, client in [("Binance", self.binance), ("Bitmex", self.bitmex)]:
+            if client.contracts_version != self._contracts_versions[exchange]:
+                self._contracts_versions[exchange] = client.contracts_version
+                self.symbol_index.set_contracts(exchange, client.contracts)
+                contracts_changed = True
+
+            if client.ready and not self._startup_reported[exchange]:
+                self._startup_reported[exchange] = True
+                logger.info("%s startup timing: %s", exchange,
+                            ", ".join(f"{step} {ms:.0f} ms" for step, ms in client.startup_timings.items()))
+
+                if exchange in self._scanners:
+                    self._scanners[exchange].start()
+
+        if contracts_changed:
+            self._strategy_frame.update_contracts()
+
         # Logs
 
+        for log in self._logs:
+            if not log['displayed']:
+                self.logging_frame.add_log(log['log'])
+                log['displayed'] = True
+
         for log in self.bitmex.logs:
             if not log['displayed']:
                 self.logging_frame.add_log(log['log'])
@@ -96,32 +238,34 @@ class Root(tk.Tk):
                 log['displayed'] = True
 
         # Trades and logs
+        trades_to_save = []
+
+        # The strategy registries are copy-on-write, the strategies started or stopped meanwhile don't interrupt the loop
         for client in [self.binance, self.bitmex]:
-            try:
-                for b_index, strat in client.strategies.items():
-                    for log in strat.logs:
-                        if not log['displayed']:
-                            self.logging_frame.add_log(log['log'])
-                            log['displayed'] = True
+            for b_index, strat in client.strategies.items():
+                for log in strat.logs:
+                    if not log['displayed']:
+                        self.logging_frame.add_log(log['log'])
+                        log['displayed'] = True
+
+                # Only the trades added or modified since the last update are displayed and saved
+                changed_trades = strat.changed_trades()
 
-                    for trade in strat.trades:
-                        if trade.time not in self._trades_frame.body_widgets['symbol']:
-                            self._trades_frame.add_trade(trade)
+                if len(changed_trades) > 0:
+                    self._trades_frame.update_trades(changed_trades)
+                    trades_to_save.extend(trade_row(trade) for trade in changed_trades)
 
-                        if trade.contract.exchange == "binance":
-                            precision = trade.contract.price_decimals
-                        else:
-                            precision = 8 # Always in bitcoin
+        if len(trades_to_save) > 0:
+            self._db.upsert("trades", trades_to_save)
 
-                        pnl_str = "{0:.{prec}f}".format(trade.pnl, prec = precision)
-                        self._trades_frame.body_widgets['pnl_var'][trade.time].set(pnl_str)
-                        self._trades_frame.body_widgets['status_var'][trade.time].set(trade.status.capitalize())
+        # Only the visible rows of the trades table are redrawn, PNL and status are read from the trade objects
+        self._trades_frame.refresh()
 
-            except RuntimeError as e:
-                logger.error("Error while looping through strategies dictionary: %s", e)
 
+        # Watchlist prices, read from a snapshot of the price caches
+        binance_prices = self.binance.prices.snapshot()
+        bitmex_prices = self.bitmex.prices.snapshot()
 
-        # Watchlist prices
         # Try-except statement because if loop through dictionary while a new key is being added
         # or a key is being deleted, there will be an error
         try:
@@ -136,41 +280,54 @@ class Root(tk.Tk):
                     if symbol not in self.binance.contracts:
                         continue
 
-                    # Checks if prices dictionary has a key with a symbol
-                    if symbol not in self.binance.prices:
-                        self.binance.get_bid_ask(self.binance.contracts[symbol])
-                        continue
-
                     precision = self.binance.contracts[symbol].price_decimals
 
-                    prices = self.binance.prices[symbol]
+                    # Requested until the bookTicker stream sends the prices of the symbol
+                    if symbol not in binance_prices:
+                        prices = self.binance.get_bid_ask(self.binance.contracts[symbol])
+
+                        if prices is None:
+                            continue
+
+                        bid, ask = prices['bid'], prices['ask']
+                    else:
+                        bid, ask = binance_prices[symbol]
 
                 elif exchange == "Bitmex":
                     if symbol not in self.bitmex.contracts:
                         continue
 
-                    if symbol not in self.bitmex.prices:
+                    if symbol not in bitmex_prices:
                         continue
 
                     precision = self.bitmex.contracts[symbol].price_decimals
 
-                    prices = self.bitmex.prices[symbol]
+                    bid, ask = bitmex_prices[symbol]
 
                 else:
                     continue
 
-                if prices['bid'] is not None:
-                    price_str = "{0:.{prec}f}".format(prices['bid'], prec=precision)
+                if bid is not None:
+                    price_str = "{0:.{prec}f}".format(bid, prec=precision)
                     self._watchlist_frame.body_widgets['bid_var'][key].set(price_str)
 
-                if prices['ask'] is not None:
-                    price_str = "{0:.{prec}f}".format(prices['ask'], prec=precision)
+                if ask is not None:
+                    price_str = "{0:.{prec}f}".format(ask, prec=precision)
                     self._watchlist_frame.body_widgets['ask_var'][key].set(price_str)
 
         except RuntimeError as e:
             logger.error("Error while looping through watchlist dictionary: %s", e)
 
 
+        # Scanner candidates of both exchanges, redrawn after each scan
+        candidates = {exchange: scanner.candidates for exchange, scanner in self._scanners.items()}
+
+        if any(candidates[exchange] is not self._displayed_candidates.get(exchange) for exchange in candidates):
+            self._displayed_candidates = candidates
+            self._watchlist_frame.update_candidates(sorted([c for exchange_candidates in candidates.values()
+                                                            for c in exchange_candidates],
+                                                           key=lambda c: c.relative_volume, reverse=True))
+
         # Only name the function, don't call it so no need for () in the end
         self.after(1500, self._update_ui)
 
@@ -203,6 +360,8 @@ class Root(tk.Tk):
             balance_pct = strat_widgets['balance_pct'][b_index].get()
             take_profit = strat_widgets['take_profit'][b_index].get()
             stop_loss = strat_widgets['stop_loss'][b_index].get()
+            exit_mode = strat_widgets['exit_mode_var'][b_index].get()
+            candle_source = strat_widgets['candle_source_var'][b_index].get()
 
             # Store all in one column in JSON string
             extra_params = dict()
@@ -214,7 +373,7 @@ class Root(tk.Tk):
                 extra_params[code_name] = self._strategy_frame.additional_parameters[b_index][code_name]
 
             strategies.append((strategy_type, contract, timeframe, balance_pct, take_profit, stop_loss,
-                               json.dumps(extra_params)))
+                               json.dumps(extra_params), exit_mode, candle_source))
 
         self._strategy_frame.db.save("strategies", strategies)
 
@@ -7,11 +7,13 @@ import logging
 import time
 from typing import *
 
-from threading import Timer
+from threading import Timer, Thread, Lock
 
-import pandas as pd
+import numpy as np
 
+import indicators
 from models import *
+from market_data import TF_EQUIV
 
 if TYPE_CHECKING:
     from bitmex import BitmexClient
@@ -19,13 +21,15 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger()
 
-# Timeframe equivalent
-TF_EQUIV = {"1m": 60, "5m": 300, "15m": 900, "30m": 1800, "1h": 3600, "4h": 14400}
+# Seconds an expired exit order is still watched: the Binance STOP_MARKET and TAKE_PROFIT_MARKET orders are sent as
+# EXPIRED by the user data stream when they trigger, then again as a NEW MARKET order with the same id, which is filled
+EXPIRED_EXIT_DELAY = 10
 
 
 class Strategy:
     def __init__(self, client: Union["BitmexClient", "BinanceFuturesClient"], contract: Contract, exchange: str, timeframe: str,
-                 balance_pct: float, take_profit: float, stop_loss: float, strat_name):
+                 balance_pct: float, take_profit: float, stop_loss: float, strat_name, exit_mode: str = "local",
+                 candle_source: str = "trades"):
 
         self.client = client
 
@@ -37,90 +41,97 @@ class Strategy:
         self.take_profit = take_profit
         self.stop_loss = stop_loss
 
+        # "local": the take profit and stop loss are checked at every trade and closed with a market order
+        # "exchange": exit orders are placed on the exchange as soon as the entry is filled
+        self.exit_mode = exit_mode
+
+        # "trades": candles built from every trade of the symbol (the take profit and stop loss are checked at every
+        # trade), "klines": candles streamed by the exchange (the take profit and stop loss are checked at every change
+        # of the bid/ask)
+        self.candle_source = candle_source
+
         self.stat_name = strat_name
 
         self.ongoing_position = False
+        # Candles of the series shared with the other strategies on the same symbol and timeframe (market data hub)
         self.candles: List[Candle] = []
         self.trades: List[Trade] = []
         self.logs = []
 
+        # Trades added or modified (entry price, PNL, status) since the last call of changed_trades(), by entry order id.
+        # Modified by the websocket, timer and flatten threads, collected by the interface
+        self._changed_trades: Dict[Any, Trade] = dict()
+        self._changed_trades_lock = Lock()
+
+        # Last status of the exit orders placed on the exchange, by order id
+        self._exit_statuses: Dict[Any, str] = dict()
+
     def _add_log(self, msg: str):
         logger.info("%s", msg)
         self.logs.append({"log": msg, "displayed": False})
 
-    # Method that parses info of the trade coming from the websocket and update the current candle based on the timestamp
-    def parse_trades(self, price: float, size: float, timestamp: int) -> str:
-
-        # Calculate differecne of current unix timestamp and timestamp of trade
-        timestamp_diff = int(time.time() * 1000) - timestamp
-        if timestamp_diff >= 2000:
-            logger.warning("%s %s: %s milliseconds of difference between the current time and the trade time",
-                           self.exchange, self.contract.symbol, timestamp_diff)
-
-        # 3 cases: 1. Update the same current candle, 2. new candle, 3. new candle + missing candle
-
-        last_candle = self.candles[-1]
-
-        # Same candle (if timestamp of the trade is less than last candle plus the timeframe equivalent -
-        # means it is on the same candle)
-        if timestamp < last_candle.timestamp + self.tf_equiv:
-            # If on the same candle, a consequence of a new trade is that the trade price will now be the last price of
-            # the candle until a new one comes or until the end of the candle.
-            last_candle.close = price
-            last_candle.volume += size
-
-            # Trade price can be the new high or new low so...
-            if price > last_candle.high:
-                last_candle.high = price
-            elif price < last_candle.low:
-                last_candle.low = price
-            
-            #  Check take profit and stop loss
-            for trade in self.trades:
-                if trade.status == "open" and trade.entry_price is not None:
-                    self._check_tp_sl(trade)
+    # Called every time a trade of the strategy is added or modified. The statuses of the exit orders of a closed trade
+    # are not needed anymore
+    def trade_changed(self, trade: Trade):
+        with self._changed_trades_lock:
+            self._changed_trades[trade.entry_id] = trade
 
-            return "same_candle"
+        if trade.status == "closed":
+            for order_id in trade.exit_orders.values():
+                self._exit_statuses.pop(order_id, None)
 
-        # Missing candle(s)
-        elif timestamp >= last_candle.timestamp + 2 * self.tf_equiv:
+    # Trades added or modified since the last call, used by the interface (and the headless runner) to update the trades
+    # table and the database
+    def changed_trades(self) -> List[Trade]:
+        with self._changed_trades_lock:
+            changed, self._changed_trades = self._changed_trades, dict()
 
-            missing_candles = int((timestamp - last_candle.timestamp) / self.tf_equiv) - 1
+        return list(changed.values())
 
-            logger.info("%s missing %s candles for %s %s (%s %s)", self.exchange, missing_candles, self.contract.symbol,
-                        self.tf, timestamp, last_candle.timestamp)
+    # Called by the market data hub every time the candle series of the strategy is updated by a trade
+    def on_candle_event(self, tick_type: str):
+        if tick_type == "same_candle" and self.candle_source == "trades":
+            #  Check take profit and stop loss
+            # Trades protected by exit orders on the exchange are not checked
+            for trade in self.trades:
+                if trade.status == "open" and trade.entry_price is not None and len(trade.exit_orders) == 0:
+                    self._check_tp_sl(trade, self.candles[-1].close)
 
-            # Add the number of missing candles to the candles list
-            for missing in range(missing_candles):
-                new_ts = last_candle.timestamp + self.tf_equiv
-                candle_info = {'ts': new_ts, 'open': last_candle.close, 'high': last_candle.close,
-                               'low': last_candle.close, 'close': last_candle.close, 'volume': 0}
-                new_candle = Candle(candle_info, self.tf, "parse_trade")
+        self.check_trade(tick_type)
 
-                self.candles.append(new_candle)
+    # Called by the market data hub when the bid/ask of the symbol changes: the PNL of the open trades is updated with
+    # the price the position would be closed at, and the take profit and stop loss of the strategies whose candles
+    # come from the kline streams are checked
+    def on_price(self, bid: Optional[float], ask: Optional[float]):
+        for trade in self.trades:
+            if trade.status == "open" and trade.entry_price is not None:
+                price = bid if trade.side == "long" else ask
 
-                last_candle = new_candle
+                if price is None:
+                    continue
 
-            new_ts = last_candle.timestamp + self.tf_equiv
-            candle_info = {'ts': new_ts, 'open': price, 'high': price, 'low': price, 'close': price, 'volume': size}
-            new_candle = Candle(candle_info, self.tf, "parse_trade")
+                pnl = self._trade_pnl(trade, price)
 
-            self.candles.append(new_candle)
+                if pnl != trade.pnl:
+                    trade.pnl = pnl
+                    self.trade_changed(trade)
 
-            return "new_candle"
+                if self.candle_source == "klines" and len(trade.exit_orders) == 0:
+                    self._check_tp_sl(trade, price)
 
+    def _trade_pnl(self, trade: Trade, price: float) -> float:
+        direction = 1 if trade.side == "long" else -1
 
-        # New Candle
-        elif timestamp >= last_candle.timestamp + self.tf_equiv:
-            new_ts = last_candle.timestamp + self.tf_equiv
-            candle_info = {'ts': new_ts, 'open': price, 'high': price, 'low': price, 'close': price, 'volume': size}
-            new_candle = Candle(candle_info, self.tf, "parse_trade")
+        if self.exchange == "Bitmex":
+            multiplier = trade.contract.multiplier
 
-            self.candles.append(new_candle)
+            # From documentation
+            if trade.contract.inverse:
+                return direction * (1 / trade.entry_price - 1 / price) * multiplier * trade.quantity
 
-            logger.info("%s New candle for %s %s", self.exchange, self.contract.symbol, self.tf)
+            return direction * (price - trade.entry_price) * multiplier * trade.quantity
 
-            return "new_candle"
+        return direction * (price - trade.entry_price) * trade.quantity
 
     # Called frequently after an order has been placed until it is filled
     def _check_order_status(self, order_id):
@@ -134,6 +145,10 @@ class Strategy:
                 for trade in self.trades:
                     if trade.entry_id == order_id:
                         trade.entry_price = order_status.avg_price
+                        self.trade_changed(trade)
+
+                        if self.exit_mode == "exchange":
+                            self._place_exit_orders(trade)
                         break
                 return
         t = Timer(2.0, lambda: self._check_order_status(order_id))
@@ -142,16 +157,26 @@ class Strategy:
     # Open a Long or Short position based on the signal's result
     def _open_position(self, signal_result: int):
 
-        trade_size = self.client.get_trade_size(self.contract, self.candles[-1].close, self.balance_pct)
-        if trade_size is None:
-            return
         # Order placement
         order_side = "buy" if signal_result == 1 else "sell"
         positon_side = "long" if signal_result == 1 else "short"
 
+        # The size is capped by the depth of the order book of the contract
+        trade_size = self.client.get_trade_size(self.contract, self.candles[-1].close, self.balance_pct, order_side)
+        if trade_size is None:
+            return
+
 
         self._add_log(f"{positon_side.capitalize()} signal on {self.contract.symbol} {self.tf}")
 
+        book = self.client.order_books.get(self.contract.symbol)
+
+        if book is not None and book.synced:
+            avg_price, slippage = book.estimate_slippage(order_side, trade_size)
+            if slippage is not None:
+                self._add_log(f"Estimated slippage on {self.contract.symbol}: {slippage * 100:.3f}% "
+                              f"(average price {avg_price})")
+
         order_status = self.client.place_order(self.contract, "MARKET", trade_size, order_side)
 
         # The request was successful and the order is placed
@@ -174,14 +199,97 @@ class Strategy:
                                "status": "open", "pnl": 0, "quantity": trade_size, "entry_id": order_status.order_id})
 
             self.trades.append(new_trade)
+            self.trade_changed(new_trade)
+
+            if avg_fill_price is not None and self.exit_mode == "exchange":
+                self._place_exit_orders(new_trade)
+
+    # Place the take profit and stop loss orders on the exchange, once the entry price is known. If one of them is
+    # rejected, the other one is canceled and the take profit and stop loss are checked by the strategy instead
+    def _place_exit_orders(self, trade: Trade):
+        order_side = "sell" if trade.side == "long" else "buy"
+
+        if trade.side == "long":
+            tp_price = trade.entry_price * (1 + self.take_profit / 100) if self.take_profit is not None else None
+            sl_price = trade.entry_price * (1 - self.stop_loss / 100) if self.stop_loss is not None else None
+        else:
+            tp_price = trade.entry_price * (1 - self.take_profit / 100) if self.take_profit is not None else None
+            sl_price = trade.entry_price * (1 + self.stop_loss / 100) if self.stop_loss is not None else None
+
+        orders = self.client.place_exit_orders(self.contract, order_side, trade.quantity, tp_price, sl_price)
+
+        if None in orders.values():
+            self._add_log(f"Exit orders rejected on {self.contract.symbol} {self.tf}, take profit and stop loss "
+                          f"checked by the strategy")
+
+            for order_status in orders.values():
+                if order_status is not None:
+                    self.client.cancel_order(self.contract, order_status.order_id)
+            return
+
+        for exit_type, order_status in orders.items():
+            trade.exit_orders[exit_type] = order_status.order_id
+            self.client.watch_order(order_status.order_id,
+                                    lambda update, t=trade, e=exit_type: self._on_exit_order_update(t, e, update))
+
+        self._add_log(f"Exit orders placed on {self.exchange} for {self.contract.symbol} {self.tf}")
+
+    # Called by the order stream of the client (websocket thread) when an exit order is updated. One exit order filled
+    # closes the trade and cancels the other one (OCO)
+    def _on_exit_order_update(self, trade: Trade, exit_type: str, order_status: OrderStatus):
+        if order_status.status in ["canceled", "rejected"]:
+            self.client.unwatch_order(order_status.order_id)
+            self._exit_statuses.pop(order_status.order_id, None)
+            return
+
+        # Update received after the trade was closed (by the other exit order or flatten)
+        if trade.status != "open":
+            return
+
+        self._exit_statuses[order_status.order_id] = order_status.status
+
+        # Also sent when the order triggers, it is only given up if no other update follows
+        if order_status.status == "expired":
+            t = Timer(EXPIRED_EXIT_DELAY, lambda: self._on_exit_order_expired(trade, exit_type, order_status.order_id))
+            t.daemon = True
+            t.start()
+            return
+
+        if order_status.status != "filled":
+            return
+
+        self._add_log(f"{'Take profit' if exit_type == 'take_profit' else 'Stop loss'} filled on the exchange for "
+                      f"{self.contract.symbol} {self.tf}")
+
+        trade.status = "closed"
+        self.ongoing_position = False
+        self.trade_changed(trade)
+
+        for other_type, order_id in trade.exit_orders.items():
+            self.client.unwatch_order(order_id)
+
+            # The cancel request is not sent from the websocket thread
+            if other_type != exit_type:
+                t = Thread(target=self.client.cancel_order, args=(self.contract, order_id), daemon=True)
+                t.start()
+
+    # The exit order really expired (not triggered): it is not watched anymore, and once no exit order is left on the
+    # exchange the take profit and stop loss are checked by the strategy again
+    def _on_exit_order_expired(self, trade: Trade, exit_type: str, order_id):
+        if self._exit_statuses.get(order_id) != "expired" or trade.status != "open":
+            return
+
+        self.client.unwatch_order(order_id)
+        trade.exit_orders.pop(exit_type, None)
+
+        self._add_log(f"{'Take profit' if exit_type == 'take_profit' else 'Stop loss'} order expired on the exchange for "
+                      f"{self.contract.symbol} {self.tf}")
 
     # Check if take profit or stop loss has been reached based on the average price entry
-    def _check_tp_sl(self, trade: Trade):
+    def _check_tp_sl(self, trade: Trade, price: float):
         tp_triggered = False
         sl_triggered = False
 
-        price = self.candles[-1].close
-
         if trade.side == "long":
             if self.stop_loss is not None:
                 if price <= trade.entry_price * (1 - self.stop_loss / 100):
@@ -208,11 +316,13 @@ class Strategy:
                 self._add_log(f"Exit order on {self.contract.symbol} {self.tf} placed successfully")
                 trade.status = "closed"
                 self.ongoing_position = False
+                self.trade_changed(trade)
 
 class TechnicalStrategy(Strategy):
     def __init__(self, client, contract: Contract, exchange: str, timeframe: str, balance_pct: float, take_profit: float,
-                 stop_loss: float, other_params: Dict):
-        super().__init__(client, contract, exchange, timeframe, balance_pct, take_profit, stop_loss, "Technical")
+                 stop_loss: float, other_params: Dict, exit_mode: str = "local", candle_source: str = "trades"):
+        super().__init__(client, contract, exchange, timeframe, balance_pct, take_profit, stop_loss, "Technical",
+                         exit_mode, candle_source)
 
         self._ema_fast = other_params['ema_fast']
         self._ema_slow = other_params['ema_slow']
@@ -224,62 +334,22 @@ class TechnicalStrategy(Strategy):
         # Get historical data after creating strategy object
 
     # Calculate relative strength index
-    def _rsi(self):
-        close_list = []
-        for candle in self.candles:
-            close_list.append(candle.close)
-            # Candles can be represented as time series (each row is a timestamp, and columns represent open, high,
-            # low and close price--> use Panda library
-
-        closes = pd.Series(close_list)
-        # RSI formula
-        # dropna() to remove the first value of the list after the diff method has been applied because the variations
-        # can be calculated once you have at least two values. First line of the series won't have any value
-        delta = closes.diff().dropna()
-
-        up, down = delta.copy(), delta.copy()
-        # Filter rows under 0 to keep the gains, set losses to 0
-        up[up < 0] = 0
-        down[down > 0] = 0
-        # When average gains of up side is calculated, it will take only close price that have
-        # increased compared to the close price before
-
-        avg_gains = up.ewm(com=(self._rsi_length - 1), min_periods=self._rsi_length).mean()
-        avg_loss = down.abs().ewm(com=(self._rsi_length - 1), min_periods=self._rsi_length).mean()
-
-        rs = avg_gains / avg_loss
-
-        rsi = 100 - 100 / (1 + rs)
-        rsi = rsi.round(2)
+    def _rsi(self) -> float:
+        closes = np.array([candle.close for candle in self.candles])
 
         # Return candle before current one like macd
-        return rsi.iloc[-2]
+        return round(float(indicators.rsi(closes, self._rsi_length)[-2]), 2)
 
     # Calculate the MACD and the corresponding signal line
+    # 4 steps to calculate macd (moving average convergance divergance):
+    # 1. Fast EMA calculation, 2. Slow EMA calculation, 3. Fast EMA - Slow EMA (subtract), 4. EMA on the result of 3.
     def _macd(self) -> Tuple[float, float]:
-        # 4 steps to calculate macd (moving average convergance divergance):
-        # 1. Fast EMA calculation, 2. Slow EMA calculation, 3. Fast EMA - Slow EMA (subtract), 4. EMA on the result of 3.
-        # Slow EMA will use more candles than the fast one -> slow because slope will change more slowly
-        # EMA is exponential moving average
-        # After each step, obtain a list of EMA's, where each EMA corresponds to each candlestick that has been recorded
-
-        close_list = []
-        for candle in self.candles:
-            close_list.append(candle.close)
-            # Candles can be represented as time series (each row is a timestamp, and columns represent open, high,
-            # low and close price--> use Panda library
+        closes = np.array([candle.close for candle in self.candles])
 
-        closes = pd.Series(close_list)
-
-        ema_fast = closes.ewm(span=self._ema_fast).mean()
-        ema_slow = closes.ewm(span=self._ema_slow).mean()
-
-        macd_line = ema_fast - ema_slow
-        macd_signal = macd_line.ewm(span=self._ema_signal).mean()
+        macd_line, macd_signal = indicators.macd(closes, self._ema_fast, self._ema_slow, self._ema_signal)
 
         # -2 and not -1 since -1 represents new candle, not the one that was just finished
-        return macd_line.iloc[-2], macd_signal.iloc[-2]
-
+        return float(macd_line[-2]), float(macd_signal[-2])
 
     # Calculate technical indicators and compare their values to predefined levels and decide whether to go long, short
     # or do nothing
@@ -301,7 +371,7 @@ class TechnicalStrategy(Strategy):
     # Close when a stop loss or take profit has been reached but may take some time to do so
     # Called once per candlestick to avoid always calculating indicators
     def check_trade(self, tick_type: str):
-        if tick_type == "new candle" and not self.ongoing_position:
+        if tick_type == "new_candle" and not self.ongoing_position:
             signal_result = self._check_signal()
 
             if signal_result in [1, -1]:
@@ -311,8 +381,9 @@ class TechnicalStrategy(Strategy):
 
 class BreakoutStrategy(Strategy):
     def __init__(self, client, contract: Contract, exchange: str, timeframe: str, balance_pct: float, take_profit: float,
-                 stop_loss: float, other_params: Dict):
-        super().__init__(client, contract, exchange, timeframe, balance_pct, take_profit, stop_loss, "Breakout")
+                 stop_loss: float, other_params: Dict, exit_mode: str = "local", candle_source: str = "trades"):
+        super().__init__(client, contract, exchange, timeframe, balance_pct, take_profit, stop_loss, "Breakout",
+                         exit_mode, candle_source)
 
         self._min_volume = other_params['min_volume']
 
@@ -347,3 +418,91 @@ class BreakoutStrategy(Strategy):
                 self._open_position(signal_result)
 
 
+
+
+# Strategy classes by strategy type, and the additional parameters each of them needs
+STRATEGY_TYPES: Dict[str, Type[Strategy]] = {"Technical": TechnicalStrategy, "Breakout": BreakoutStrategy}
+
+STRATEGY_PARAMS: Dict[str, List[str]] = {
+    "Technical": ["rsi_length", "ema_fast", "ema_slow", "ema_signal"],
+    "Breakout": ["min_volume"],
+}
+
+
+# Create a strategy from its configuration (a strategy editor row or a row of the workspace database), used by the UI and
+# the headless runner. Returns None if the strategy type is unknown or an additional parameter is missing
+def create_strategy(client: Union["BitmexClient", "BinanceFuturesClient"], strategy_type: str, contract: Contract,
+                    exchange: str, timeframe: str, balance_pct: float, take_profit: float, stop_loss: float,
+                    other_params: Dict, exit_mode: str = "local", candle_source: str = "trades") -> Optional[Strategy]:
+    if strategy_type not in STRATEGY_TYPES:
+        return None
+
+    if any(other_params.get(param) is None for param in STRATEGY_PARAMS[strategy_type]):
+        return None
+
+    return STRATEGY_TYPES[strategy_type](client, contract, exchange, timeframe, balance_pct, take_profit, stop_loss,
+                                         other_params, exit_mode, candle_source)
+
+
+if __name__ == '__main__':
+    # Replay of the Binance user data stream when the stop loss of a long trade triggers: EXPIRED (STOP_MARKET), NEW
+    # (MARKET, same order id) then FILLED. The trade must be closed and the take profit canceled
+    class ReplayClient:
+        def __init__(self):
+            self.callbacks = dict()
+            self.canceled = []
+
+        def place_exit_orders(self, contract, side, quantity, tp_price, sl_price):
+            return {"take_profit": OrderStatus({'i': 1, 'X': "NEW", 'ap': "0", 'z': "0"}, "binance_stream"),
+                    "stop_loss": OrderStatus({'i': 2, 'X': "NEW", 'ap': "0", 'z': "0"}, "binance_stream")}
+
+        def watch_order(self, order_id, callback):
+            self.callbacks[order_id] = callback
+
+        def unwatch_order(self, order_id):
+            self.callbacks.pop(order_id, None)
+
+        def cancel_order(self, contract, order_id):
+            self.canceled.append(order_id)
+
+    class ReplayContract:
+        symbol = "BTCUSDT"
+
+    client = ReplayClient()
+    strategy = Strategy(client, ReplayContract(), "Binance", "1m", 10, 2, 1, "Technical", "exchange")
+    strategy.ongoing_position = True
+
+    trade = Trade({"time": 0, "entry_price": 100.0, "contract": ReplayContract(), "strategy": "Technical",
+                   "side": "long", "status": "open", "pnl": 0, "quantity": 1, "entry_id": 0})
+    strategy.trades.append(trade)
+    strategy._place_exit_orders(trade)
+
+    events = [{'i': 2, 'X': "EXPIRED", 'o': "STOP_MARKET", 'ap': "0", 'z': "0"},
+              {'i': 2, 'X': "NEW", 'o': "MARKET", 'ap': "0", 'z': "0"},
+              {'i': 2, 'X': "FILLED", 'o': "MARKET", 'ap': "99", 'z': "1"}]
+
+    for event in events:
+        order_status = OrderStatus(event, "binance_stream")
+        callback = client.callbacks.get(order_status.order_id)
+
+        assert callback is not None, f"order {order_status.order_id} not watched on {order_status.status}"
+        callback(order_status)
+
+    time.sleep(0.5)
+
+    assert trade.status == "closed" and not strategy.ongoing_position
+    assert client.canceled == [1] and len(client.callbacks) == 0
+    assert strategy.changed_trades() == [trade] and strategy.changed_trades() == []
+    assert len(strategy._exit_statuses) == 0
+
+    # An expired order without trigger is given up after EXPIRED_EXIT_DELAY
+    EXPIRED_EXIT_DELAY = 0.1
+
+    trade.status = "open"
+    strategy._place_exit_orders(trade)
+    client.callbacks[1](OrderStatus({'i': 1, 'X': "EXPIRED", 'ap': "0", 'z': "0"}, "binance_stream"))
+    time.sleep(0.5)
+
+    assert 1 not in client.callbacks and list(trade.exit_orders) == ["stop_loss"]
+
+    print("Triggered stop loss replay: trade closed, take profit canceled")
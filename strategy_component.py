@@ -10,16 +10,18 @@ from scrollable_frame import ScrollableFrame
 from binance_futures import BinanceFuturesClient
 from bitmex import BitmexClient
 
-from strategies import TechnicalStrategy, BreakoutStrategy
+from strategies import create_strategy
 from utils import *
 
 from database import WorkspaceData
+from symbol_index import SymbolIndex
 
 if typing.TYPE_CHECKING:
     from root_component import Root
 
 class StrategyEditor (tk.Frame):
-    def __init__(self, root: "Root", binance: BinanceFuturesClient, bitmex: BitmexClient, *args, **kwargs):
+    def __init__(self, root: "Root", binance: BinanceFuturesClient, bitmex: BitmexClient, symbol_index: SymbolIndex,
+                 *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.root = root
@@ -31,14 +33,11 @@ class StrategyEditor (tk.Frame):
 
         self._exchanges = {"Binance": binance, "Bitmex": bitmex}
 
-        self._all_contracts = []
+        # Labels of the contracts of both exchanges ("BTCUSDT_Binance"), already sorted by the shared index
+        self._symbol_index = symbol_index
+        self._all_contracts = symbol_index.labels()
         self._all_timeframes = ["1m", "5m", "15m", "30m", "1h", "4h"]
 
-        # Populate _all_contracts
-        for exchange, client in self._exchanges.items():
-            for symbol, contract in client.contracts.items():
-                self._all_contracts.append(symbol + "_" + exchange.capitalize())
-
         self._commands_frame = tk.Frame(self, bg=BG_COLOR)
         self._commands_frame.pack(side=tk.TOP)
 
@@ -72,6 +71,12 @@ class StrategyEditor (tk.Frame):
             {"code_name": "balance_pct", "widget": tk.Entry, "data_type": float, "width": 18, "header": "                          Balance %"},
             {"code_name": "take_profit", "widget": tk.Entry, "data_type": float, "width": 14, "header": "                           TP %"},
             {"code_name": "stop_loss", "widget": tk.Entry, "data_type": float, "width": 14, "header": "                          SL %"},
+            # Take profit and stop loss checked by the strategy (Local) or placed as orders on the exchange (Exchange)
+            {"code_name": "exit_mode", "widget": tk.OptionMenu, "data_type": str, "values": ["Local", "Exchange"],
+             "width": 8, "header": "Exits"},
+            # Candles built from the trades (Trades) or streamed by the exchange (Klines)
+            {"code_name": "candle_source", "widget": tk.OptionMenu, "data_type": str, "values": ["Trades", "Klines"],
+             "width": 7, "header": "Candles"},
             # Configure additional parameters
             {"code_name": "parameters", "widget": tk.Button, "data_type": float, "text": "Parameters",
              "bg": BG_COLOR_2, "command": self._show_popup, "header": "", "width": 70},
@@ -116,7 +121,7 @@ class StrategyEditor (tk.Frame):
         # Creates keys of the dictionary in the loop so that self.headers can be reused
         for h in self._base_params:
             self.body_widgets[h['code_name']] = dict()
-            if h['code_name'] in ["strategy_type", "contract", "timeframe"]:
+            if h['code_name'] in ["strategy_type", "contract", "timeframe", "exit_mode", "candle_source"]:
                 self.body_widgets[h['code_name'] + "_var"] = dict()
 
         # Starts at 1 because row is 0 is occupied
@@ -132,11 +137,14 @@ class StrategyEditor (tk.Frame):
         for col, base_param in enumerate(self._base_params):
             code_name = base_param['code_name']
             if base_param['widget'] == tk.OptionMenu:
+                # The contracts list is empty until the exchanges answer when there was no previous session
+                values = base_param['values'] if len(base_param['values']) > 0 else [""]
+
                 self.body_widgets[code_name + "_var"][b_index] = tk.StringVar()
-                self.body_widgets[code_name + "_var"][b_index].set(base_param['values'][0])
+                self.body_widgets[code_name + "_var"][b_index].set(values[0])
                 self.body_widgets[code_name][b_index] = tk.OptionMenu(self._body_frame.sub_frame,
                                                                       self.body_widgets[code_name + "_var"][b_index],
-                                                                      *base_param['values']) # * will unpack the list
+                                                                      *values) # * will unpack the list
                 self.body_widgets[code_name][b_index].config(width=base_param['width'],
                                                              bd=-1, indicatoron=0, highlightthickness=False, font=GLOBAL_FONT)
 
@@ -170,6 +178,21 @@ class StrategyEditor (tk.Frame):
 
         self._body_index += 1
 
+    # Called by the root component when the clients received the contracts from the exchanges, after the UI was built
+    # with the contracts saved during the previous session
+    def update_contracts(self):
+        self._all_contracts[:] = self._symbol_index.labels()
+
+        for b_index, option_menu in self.body_widgets['contract'].items():
+            menu = option_menu["menu"]
+            menu.delete(0, tk.END)
+
+            for label in self._all_contracts:
+                menu.add_command(label=label, command=tk._setit(self.body_widgets['contract_var'][b_index], label))
+
+            if self.body_widgets['contract_var'][b_index].get() == "" and len(self._all_contracts) > 0:
+                self.body_widgets['contract_var'][b_index].set(self._all_contracts[0])
+
     # Delete row of the widgets
     def _delete_row(self, b_index: int):
         for element in self._base_params:
@@ -264,37 +287,40 @@ class StrategyEditor (tk.Frame):
                 self.root.logging_frame.add_log(f"Missing {param['code_name']} parameter")
                 return
 
+        if "_" not in self.body_widgets['contract_var'][b_index].get():
+            self.root.logging_frame.add_log("Missing contract parameter")
+            return
+
         symbol = self.body_widgets['contract_var'][b_index].get().split("_")[0]
         timeframe = self.body_widgets['timeframe_var'][b_index].get()
         exchange = self.body_widgets['contract_var'][b_index].get().split("_")[1]
 
+        if symbol not in self._exchanges[exchange].contracts:
+            self.root.logging_frame.add_log(f"{symbol} is not available on {exchange} (yet)")
+            return
+
         contract = self._exchanges[exchange].contracts[symbol]
 
         balance_pct = float(self.body_widgets['balance_pct'][b_index].get())
         take_profit = float(self.body_widgets['take_profit'][b_index].get())
         stop_loss = float(self.body_widgets['stop_loss'][b_index].get())
+        exit_mode = self.body_widgets['exit_mode_var'][b_index].get().lower()
+        candle_source = self.body_widgets['candle_source_var'][b_index].get().lower()
 
         if self.body_widgets['activation'][b_index].cget("text") == "OFF":
             # Activate strategy
-            if strat_selected == "Technical":
-                new_strategy = TechnicalStrategy(self._exchanges[exchange], contract, exchange, timeframe, balance_pct, take_profit, stop_loss,
-                                                 self.additional_parameters[b_index])
-            elif strat_selected == "Breakout":
-                new_strategy = BreakoutStrategy(self._exchanges[exchange], contract, exchange, timeframe, balance_pct, take_profit, stop_loss,
-                                                 self.additional_parameters[b_index])
-            else:
+            new_strategy = create_strategy(self._exchanges[exchange], strat_selected, contract, exchange, timeframe,
+                                           balance_pct, take_profit, stop_loss, self.additional_parameters[b_index],
+                                           exit_mode, candle_source)
+            if new_strategy is None:
                 return
 
-            # Get historical data when initializing strategy
-            new_strategy.candles = self._exchanges[exchange].get_historical_candles(contract, timeframe)
-
-            if len(new_strategy.candles) == 0:
+            # Attach the strategy to the candle series of its symbol and timeframe. Historical data is only fetched
+            # (and the trades channel subscribed) if no other strategy uses the same series
+            if not self._exchanges[exchange].market_data.subscribe(new_strategy):
                 self.root.logging_frame.add_log(f"No historical data retrieved for {contract.symbol}")
                 return
 
-            if exchange == "Binance":
-                self._exchanges[exchange].subscribe_channel([contract], "aggTrade")
-
             self._exchanges[exchange].strategies[b_index] = new_strategy
 
             # Other buttons will be deactivated to prevent user from changing values while strategy is running
@@ -308,6 +334,7 @@ class StrategyEditor (tk.Frame):
             self.root.logging_frame.add_log(f"{strat_selected} strategy on {symbol} / {timeframe} started")
         else:
             # Deactivate strategy
+            self._exchanges[exchange].market_data.unsubscribe(self._exchanges[exchange].strategies[b_index])
             del self._exchanges[exchange].strategies[b_index]
 
             for param in self._base_params:
@@ -319,6 +346,12 @@ class StrategyEditor (tk.Frame):
             self.body_widgets['activation'][b_index].config(bg="darkred", text="OFF")
             self.root.logging_frame.add_log(f"{strat_selected} strategy on {symbol} / {timeframe} stopped")
 
+    # Activate every strategy row that is not running yet (CPU benchmark of the interface, see main.py)
+    def activate_all(self):
+        for b_index in list(self.body_widgets['activation']):
+            if self.body_widgets['activation'][b_index].cget("text") == "OFF":
+                self._switch_strategy(b_index)
+
     # Load data from the database and add them to the rows
     def _load_workspace(self):
         data = self.db.get("strategies")
@@ -0,0 +1,106 @@
+# Running strategies of a client, by row index of the strategy editor
+# The strategies are started and stopped by the Tkinter thread (or the headless runner) and read by the interface
+# update, the HTTP status server and the flatten thread. The registry is copy-on-write: a change copies the dictionary
+# and replaces it with one assignment, a dictionary is never modified once published. Readers iterate the current
+# dictionary without lock or copy and cannot get "dictionary changed size during iteration"
+
+import threading
+import types
+import typing
+
+if typing.TYPE_CHECKING:
+    from strategies import TechnicalStrategy, BreakoutStrategy
+
+
+class StrategyRegistry:
+    def __init__(self):
+        self._strategies: typing.Dict[int, typing.Union["TechnicalStrategy", "BreakoutStrategy"]] = dict()
+
+        # Only the writers are locked, so that two changes made at the same time are both kept
+        self._lock = threading.Lock()
+
+    # Current strategies, read-only. Stays the same when strategies are added or removed afterwards
+    def snapshot(self) -> typing.Mapping[int, typing.Union["TechnicalStrategy", "BreakoutStrategy"]]:
+        return types.MappingProxyType(self._strategies)
+
+    def __setitem__(self, b_index: int, strategy: typing.Union["TechnicalStrategy", "BreakoutStrategy"]):
+        with self._lock:
+            strategies = dict(self._strategies)
+            strategies[b_index] = strategy
+            self._strategies = strategies
+
+    def __delitem__(self, b_index: int):
+        with self._lock:
+            strategies = dict(self._strategies)
+            del strategies[b_index]
+            self._strategies = strategies
+
+    def pop(self, b_index: int, default=None) -> typing.Optional[typing.Union["TechnicalStrategy", "BreakoutStrategy"]]:
+        with self._lock:
+            if b_index not in self._strategies:
+                return default
+
+            strategies = dict(self._strategies)
+            strategy = strategies.pop(b_index)
+            self._strategies = strategies
+
+            return strategy
+
+    def __getitem__(self, b_index: int) -> typing.Union["TechnicalStrategy", "BreakoutStrategy"]:
+        return self._strategies[b_index]
+
+    def get(self, b_index: int, default=None) -> typing.Optional[typing.Union["TechnicalStrategy", "BreakoutStrategy"]]:
+        return self._strategies.get(b_index, default)
+
+    def __contains__(self, b_index: int) -> bool:
+        return b_index in self._strategies
+
+    def __len__(self) -> int:
+        return len(self._strategies)
+
+    def __iter__(self) -> typing.Iterator[int]:
+        return iter(self._strategies)
+
+    # The views are on the dictionary published when they are created
+    def items(self) -> typing.ItemsView[int, typing.Union["TechnicalStrategy", "BreakoutStrategy"]]:
+        return self._strategies.items()
+
+    def values(self) -> typing.ValuesView[typing.Union["TechnicalStrategy", "BreakoutStrategy"]]:
+        return self._strategies.values()
+
+    def keys(self) -> typing.KeysView[int]:
+        return self._strategies.keys()
+
+
+if __name__ == '__main__':
+    # A reader iterating while another thread starts and stops strategies: no error and every change kept
+    registry = StrategyRegistry()
+
+    def churn(offset: int):
+        for i in range(20000):
+            registry[offset + i % 50] = object()
+            if i % 3 == 0:
+                registry.pop(offset + (i + 25) % 50)
+
+    threads = [threading.Thread(target=churn, args=(offset,)) for offset in [0, 1000]]
+    for t in threads:
+        t.start()
+
+    iterations = 0
+    while any(t.is_alive() for t in threads):
+        for b_index, strategy in registry.items():
+            pass
+        iterations += 1
+
+    for t in threads:
+        t.join()
+
+    expected = set()
+    for offset in [0, 1000]:
+        for i in range(20000):
+            expected.add(offset + i % 50)
+            if i % 3 == 0:
+                expected.discard(offset + (i + 25) % 50)
+
+    assert set(registry) == expected, (sorted(set(registry) ^ expected))
+    print(f"{iterations} iterations during the changes, {len(registry)} strategies registered as expected")
@@ -0,0 +1,667 @@
+# Supervisor mode: the strategies are spread over worker processes, so that their computations (candle series, pandas
+# indicators) run on several CPU cores instead of sharing the GIL of one process with the websocket threads
+# - The supervisor process keeps the exchange clients: their websocket connections are the only market data feed, and
+#   their REST sessions (balances, order books, signed requests) are the order gateway of each exchange
+# - The strategies are partitioned by symbol: every strategy of a symbol runs in the same worker, so each update of the
+#   feed is sent to one process only
+# - The market data hub of each client is replaced by a FeedRouter, which buffers the trades, klines and bid/ask of a
+#   symbol for its worker and puts them in the queue of the worker in batches (one pickled message every few
+#   milliseconds instead of one per update, sent by a thread of the router rather than the websocket thread)
+# - Each worker runs its own market data hubs and strategies (with the bookkeeping of the headless runner) on
+#   WorkerClient proxies: their requests (historical candles, orders, subscriptions) are sent to the gateway of the
+#   supervisor, which answers in the queue of the worker
+# - With a candle store, each worker stores the candles of its own series (the symbols of the workers don't overlap)
+#   python main.py --workers 4
+#   python supervisor.py          (throughput benchmark with synthetic trades)
+
+import itertools
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+import typing
+
+from concurrent.futures import ThreadPoolExecutor
+
+from models import *
+
+if typing.TYPE_CHECKING:
+    from bitmex import BitmexClient
+    from binance_futures import BinanceFuturesClient
+
+logger = logging.getLogger()
+
+# Workers are started with "spawn": a forked copy of the supervisor would inherit its websocket threads and locks
+_mp = multiprocessing.get_context("spawn")
+
+# Client methods the workers can call through the gateway
+GATEWAY_METHODS = ["get_historical_candles", "get_trade_size", "place_order", "place_exit_orders", "cancel_order",
+                   "get_order_status", "subscribe_trades", "unsubscribe_trades", "subscribe_klines",
+                   "unsubscribe_klines", "subscribe_prices", "unsubscribe_prices", "subscribe_order_book",
+                   "unsubscribe_order_book", "watch_order", "unwatch_order"]
+
+# Threads sending the requests of the workers, for each exchange
+GATEWAY_THREADS = 16
+
+# Seconds a worker waits for the answer of the gateway
+REQUEST_TIMEOUT = 30
+
+# Seconds between two batches of updates sent to a worker, and number of updates sending a batch right away
+ROUTER_FLUSH_INTERVAL = 0.005
+ROUTER_BATCH_SIZE = 500
+
+# Seconds between two clock offsets sent to the workers, between two statistics sent by each worker and between two
+# logs of the statistics
+CLOCK_INTERVAL = 5
+WORKER_STATS_INTERVAL = 1
+STATS_INTERVAL = 30
+
+
+# Strategies of each worker: the symbols with the most strategies first, each one to the least loaded worker
+def partition(rows: typing.List[typing.Tuple[int, typing.Dict]], workers: int) -> typing.List[typing.List]:
+    groups: typing.Dict[str, typing.List] = dict()
+
+    for b_index, row in rows:
+        groups.setdefault(row['contract'], []).append((b_index, row))
+
+    shards = [[] for _ in range(workers)]
+    loads = [0] * workers
+
+    for contract, group in sorted(groups.items(), key=lambda g: len(g[1]), reverse=True):
+        worker = loads.index(min(loads))
+        shards[worker].extend(group)
+        loads[worker] += len(group)
+
+    return shards
+
+
+# Supervisor side
+
+# Replaces the market data hub of a client in the supervisor process: the updates of each symbol go to its worker.
+# The updates are appended to the buffer of the worker (in the order received) by the websocket thread, and sent as one
+# ("batch", exchange, updates) message by the flush thread
+class FeedRouter:
+    def __init__(self, exchange: str, routes: typing.Dict[str, typing.Any]):
+        self._exchange = exchange
+        # Queue of the worker of each symbol
+        self._routes = routes
+
+        self._queues = list({id(q): q for q in routes.values()}.values())
+
+        # Updates waiting to be sent to each worker queue, by id of the queue
+        self._buffers: typing.Dict[int, typing.List[tuple]] = {id(q): [] for q in self._queues}
+        self._lock = threading.Lock()
+
+        self._running = True
+
+        t = threading.Thread(target=self._run, daemon=True)
+        t.start()
+
+    def _add(self, symbol: str, update: tuple):
+        worker_queue = self._routes.get(symbol)
+
+        if worker_queue is None:
+            return
+
+        with self._lock:
+            buffer = self._buffers[id(worker_queue)]
+            buffer.append(update)
+
+            if len(buffer) < ROUTER_BATCH_SIZE:
+                return
+
+            self._buffers[id(worker_queue)] = []
+
+        worker_queue.put(("batch", self._exchange, buffer))
+
+    def on_trade(self, symbol: str, price: float, size: float, timestamp: int):
+        self._add(symbol, ("trade", symbol, price, size, timestamp))
+
+    def on_kline(self, symbol: str, timeframe: str, candle: Candle, closed: bool):
+        self._add(symbol, ("kline", symbol, timeframe, candle, closed))
+
+    def on_price(self, symbol: str, bid: typing.Optional[float], ask: typing.Optional[float]):
+        self._add(symbol, ("price", symbol, bid, ask))
+
+    # Each worker downloads the candles missed by its own series
+    def resync(self, disconnected_at: int):
+        with self._lock:
+            for buffer in self._buffers.values():
+                buffer.append(("resync", disconnected_at))
+
+    # Send the updates buffered so far
+    def flush(self):
+        with self._lock:
+            buffers = self._buffers
+            self._buffers = {id(q): [] for q in self._queues}
+
+        for worker_queue in self._queues:
+            if len(buffers[id(worker_queue)]) > 0:
+                worker_queue.put(("batch", self._exchange, buffers[id(worker_queue)]))
+
+    def stop(self):
+        self._running = False
+        self.flush()
+
+    def _run(self):
+        while self._running:
+            time.sleep(ROUTER_FLUSH_INTERVAL)
+            self.flush()
+
+
+class Supervisor:
+    def __init__(self, clients: typing.Dict[str, typing.Union["BitmexClient", "BinanceFuturesClient"]], workers: int,
+                 rows: typing.Optional[typing.List[typing.Tuple[int, typing.Dict]]] = None,
+                 candle_store: typing.Optional[str] = None):
+        self._clients = clients
+        self._workers = workers
+        self._rows = rows
+
+        # Directory of the candle store of the workers (the hubs of the clients are replaced by the routers)
+        self._candle_store = candle_store
+
+        self._processes = []
+        self._queues = []
+        self._routers: typing.List[FeedRouter] = []
+        self._requests = _mp.Queue()
+
+        self._gateways = {exchange: ThreadPoolExecutor(max_workers=GATEWAY_THREADS) for exchange in clients}
+
+        # Last statistics of each worker: events processed and strategies running
+        self.stats: typing.Dict[int, typing.Dict[str, typing.Any]] = dict()
+
+        self._running = False
+
+    # Start the workers with their strategies, the feed is routed to them from now on
+    def start(self):
+        if self._rows is None:
+            from database import WorkspaceData
+            from headless import workspace_strategies
+
+            self._rows = workspace_strategies(WorkspaceData())
+
+        rows = [(b_index, row) for b_index, row in self._rows
+                if row['contract'] is not None and "_" in row['contract']
+                and row['contract'].split("_")[1] in self._clients]
+
+        shards = partition(rows, self._workers)
+        routes = {exchange: dict() for exchange in self._clients}
+
+        self._running = True
+
+        for worker_id, shard in enumerate(shards):
+            worker_queue = _mp.Queue()
+            self._queues.append(worker_queue)
+
+            # Contracts of the symbols of the worker and the attributes of the clients read by the market data hub
+            exchanges = dict()
+
+            for exchange, client in self._clients.items():
+                symbols = {row['contract'].split("_")[0] for b_index, row in shard
+                           if row['contract'].split("_")[1] == exchange}
+
+                exchanges[exchange] = {
+                    "contracts": {s: client.contracts[s] for s in symbols if s in client.contracts},
+                    "history_timeframes": client.history_timeframes,
+                    "kline_timeframes": client.kline_timeframes,
+                    "clock_offset": client.clock_offset,
+                }
+
+                for symbol in symbols:
+                    routes[exchange][symbol] = worker_queue
+
+            process = _mp.Process(target=_worker_main, args=(worker_id, shard, exchanges, worker_queue, self._requests,
+                                                             logger.getEffectiveLevel(), self._candle_store),
+                                  name=f"worker-{worker_id}", daemon=True)
+            process.start()
+
+            self._processes.append(process)
+
+            logger.info("Worker %s started with %s strategies on %s symbols", worker_id, len(shard),
+                        sum(len(e['contracts']) for e in exchanges.values()))
+
+        for exchange, client in self._clients.items():
+            client.market_data = FeedRouter(exchange, routes[exchange])
+            self._routers.append(client.market_data)
+
+        t = threading.Thread(target=self._run_gateway, daemon=True)
+        t.start()
+
+        t = threading.Thread(target=self._send_clock, daemon=True)
+        t.start()
+
+    # Start once the clients received their contracts, then log the statistics of the workers until stop() is called
+    # (or Ctrl+C)
+    def run(self, duration: typing.Optional[float] = None):
+        from headless import READY_TIMEOUT
+
+        ready_start = time.time()
+
+        while not all(client.ready for client in self._clients.values()) and time.time() - ready_start < READY_TIMEOUT:
+            time.sleep(0.1)
+
+        self.start()
+
+        start = time.time()
+        last_stats = time.time()
+
+        try:
+            while self._running and (duration is None or time.time() - start < duration):
+                time.sleep(1)
+
+                if time.time() - last_stats >= STATS_INTERVAL:
+                    last_stats = time.time()
+                    self.log_stats()
+        except KeyboardInterrupt:
+            logger.info("Supervisor interrupted")
+
+        self.stop()
+
+    # The workers save their trades and stop, then the connections are closed
+    def stop(self, timeout: float = 10):
+        self._running = False
+
+        # The updates buffered are processed before the stop message
+        for router in self._routers:
+            router.stop()
+
+        for worker_queue in self._queues:
+            worker_queue.put(("stop",))
+
+        for process in self._processes:
+            process.join(timeout)
+
+            if process.is_alive():
+                logger.warning("%s did not stop, terminated", process.name)
+                process.terminate()
+
+        self.log_stats()
+
+        for exchange, client in self._clients.items():
+            client.reconnect = False
+
+            if getattr(client, "ws", None) is not None:
+                client.ws.close()
+
+        self._requests.put(None)
+
+    def log_stats(self):
+        for worker_id, stats in sorted(self.stats.items()):
+            logger.info("Worker %s: %s strategies, %s events processed, %.1f%% CPU", worker_id, stats['strategies'],
+                        stats['events'], stats['cpu'])
+
+    # Requests of the workers, each one sent by a thread of the gateway of its exchange
+    def _run_gateway(self):
+        while True:
+            message = self._requests.get()
+
+            if message is None:
+                break
+
+            if message[0] == "stats":
+                worker_id, events, strategies, cpu = message[1:]
+                self.stats[worker_id] = {"events": events, "strategies": strategies, "cpu": cpu}
+                continue
+
+            worker_id, request_id, exchange, method, args, kwargs = message[1:]
+            self._gateways[exchange].submit(self._execute, worker_id, request_id, exchange, method, args, kwargs)
+
+    def _execute(self, worker_id: int, request_id: int, exchange: str, method: str, args: typing.Tuple,
+                 kwargs: typing.Dict):
+        client = self._clients[exchange]
+        result = None
+
+        # The contracts received are copies, the client works with its own objects
+        args = [client.contracts.get(a.symbol, a) if isinstance(a, Contract) else a for a in args]
+
+        try:
+            if method not in GATEWAY_METHODS:
+                logger.error("Worker %s: unknown gateway method %s", worker_id, method)
+
+            # The updates of the order stream are sent to the worker of the order
+            elif method == "watch_order":
+                worker_queue = self._queues[worker_id]
+                client.watch_order(args[0], lambda order_status: worker_queue.put(("order_update", exchange,
+                                                                                   order_status.order_id,
+                                                                                   order_status)))
+            else:
+                result = getattr(client, method)(*args, **kwargs)
+
+        except Exception as e:
+            logger.error("Error in the %s gateway while executing %s for worker %s: %s", exchange, method, worker_id, e)
+
+        self._queues[worker_id].put(("response", request_id, result))
+
+    # The workers use the clock offset of the supervisor clients for their candles
+    def _send_clock(self):
+        while self._running:
+            time.sleep(CLOCK_INTERVAL)
+
+            for exchange, client in self._clients.items():
+                for worker_queue in self._queues:
+                    worker_queue.put(("clock", exchange, client.clock_offset))
+
+
+# Worker side
+
+# Requests of a worker to the gateway: the answers are received by the thread reading the queue of the worker
+class _GatewayConnection:
+    def __init__(self, worker_id: int, requests):
+        self._worker_id = worker_id
+        self._requests = requests
+
+        self._ids = itertools.count()
+        self._pending: typing.Dict[int, typing.List] = dict()
+        self._lock = threading.Lock()
+
+    def request(self, exchange: str, method: str, *args, **kwargs) -> typing.Any:
+        event = threading.Event()
+
+        with self._lock:
+            request_id = next(self._ids)
+            self._pending[request_id] = [event, None]
+
+        self._requests.put(("request", self._worker_id, request_id, exchange, method, args, kwargs))
+
+        if not event.wait(REQUEST_TIMEOUT):
+            logger.error("%s %s: no answer from the gateway after %s s", exchange, method, REQUEST_TIMEOUT)
+
+        with self._lock:
+            return self._pending.pop(request_id)[1]
+
+    def resolve(self, request_id: int, result: typing.Any):
+        with self._lock:
+            pending = self._pending.get(request_id)
+
+            # The request timed out
+            if pending is None:
+                return
+
+            pending[1] = result
+
+        pending[0].set()
+
+
+# Client of a worker process: same interface as the exchange clients for the strategies and the market data hub
+class WorkerClient:
+    def __init__(self, exchange: str, gateway: _GatewayConnection, info: typing.Dict[str, typing.Any]):
+        from market_data import MarketDataHub
+        from strategy_registry import StrategyRegistry
+
+        self.exchange = exchange
+        self._gateway = gateway
+
+        self.contracts: typing.Dict[str, Contract] = info['contracts']
+        self.history_timeframes = info['history_timeframes']
+        self.kline_timeframes = info['kline_timeframes']
+        self.clock_offset = info['clock_offset']
+
+        self.strategies = StrategyRegistry()
+        self.logs = []
+
+        # The order books and the balances are kept by the supervisor (the trade size is computed by the gateway)
+        self.order_books = dict()
+        self.balances = dict()
+
+        self.ready = True
+        self.connected = True
+        self.reconnect = True
+        self.ws = None
+
+        self._order_callbacks: typing.Dict[typing.Any, typing.Callable[[OrderStatus], None]] = dict()
+
+        self.market_data = MarketDataHub(self, exchange)
+
+    def now_ms(self) -> int:
+        return int(time.time() * 1000) + self.clock_offset
+
+    def get_historical_candles(self, contract: Contract, timeframe: str,
+                               start_time: typing.Optional[int] = None) -> typing.List[Candle]:
+        candles = self._gateway.request(self.exchange, "get_historical_candles", contract, timeframe, start_time)
+        return candles if candles is not None else []
+
+    def get_trade_size(self, contract: Contract, price: float, balance_pct: float, side: typing.Optional[str] = None):
+        return self._gateway.request(self.exchange, "get_trade_size", contract, price, balance_pct, side)
+
+    def place_order(self, contract: Contract, order_type: str, quantity: float, side: str, *args,
+                    **kwargs) -> typing.Optional[OrderStatus]:
+        return self._gateway.request(self.exchange, "place_order", contract, order_type, quantity, side, *args, **kwargs)
+
+    def place_exit_orders(self, contract: Contract, side: str, quantity: float, take_profit_price: typing.Optional[float],
+                          stop_loss_price: typing.Optional[float]) -> typing.Dict[str, typing.Optional[OrderStatus]]:
+        orders = self._gateway.request(self.exchange, "place_exit_orders", contract, side, quantity, take_profit_price,
+                                       stop_loss_price)
+
+        if orders is None:
+            return {"take_profit": None, "stop_loss": None}
+        return orders
+
+    def cancel_order(self, contract: Contract, order_id) -> typing.Optional[OrderStatus]:
+        return self._gateway.request(self.exchange, "cancel_order", contract, order_id)
+
+    def get_order_status(self, contract: Contract, order_id) -> typing.Optional[OrderStatus]:
+        return self._gateway.request(self.exchange, "get_order_status", contract, order_id)
+
+    def watch_order(self, order_id, callback: typing.Callable[[OrderStatus], None]):
+        self._order_callbacks[order_id] = callback
+        self._gateway.request(self.exchange, "watch_order", order_id)
+
+    def unwatch_order(self, order_id):
+        self._order_callbacks.pop(order_id, None)
+        self._gateway.request(self.exchange, "unwatch_order", order_id)
+
+    def on_order_update(self, order_id, order_status: OrderStatus):
+        callback = self._order_callbacks.get(order_id)
+
+        if callback is not None:
+            callback(order_status)
+
+    def subscribe_trades(self, contract: Contract):
+        self._gateway.request(self.exchange, "subscribe_trades", contract)
+
+    def unsubscribe_trades(self, contract: Contract):
+        self._gateway.request(self.exchange, "unsubscribe_trades", contract)
+
+    def subscribe_klines(self, contract: Contract, timeframe: str):
+        self._gateway.request(self.exchange, "subscribe_klines", contract, timeframe)
+
+    def unsubscribe_klines(self, contract: Contract, timeframe: str):
+        self._gateway.request(self.exchange, "unsubscribe_klines", contract, timeframe)
+
+    def subscribe_prices(self, symbol: str):
+        self._gateway.request(self.exchange, "subscribe_prices", symbol)
+
+    def unsubscribe_prices(self, symbol: str):
+        self._gateway.request(self.exchange, "unsubscribe_prices", symbol)
+
+    def subscribe_order_book(self, contract: Contract):
+        self._gateway.request(self.exchange, "subscribe_order_book", contract)
+
+    def unsubscribe_order_book(self, contract: Contract):
+        self._gateway.request(self.exchange, "unsubscribe_order_book", contract)
+
+
+def _worker_main(worker_id: int, rows: typing.List[typing.Tuple[int, typing.Dict]],
+                 exchanges: typing.Dict[str, typing.Dict[str, typing.Any]], events, requests, log_level: int,
+                 candle_store: typing.Optional[str] = None):
+    from headless import HeadlessRunner
+    from utils import CpuMeter
+
+    # The handlers of main.py are only configured by the main process (a single writer of the rotating info.log)
+    if len(logger.handlers) == 0:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(f'%(asctime)s %(levelname)s :: worker {worker_id} :: %(message)s'))
+        logger.addHandler(handler)
+    logger.setLevel(log_level)
+
+    gateway = _GatewayConnection(worker_id, requests)
+    clients = {exchange: WorkerClient(exchange, gateway, info) for exchange, info in exchanges.items()}
+
+    store = None
+
+    if candle_store is not None:
+        from candle_store import CandleStore
+
+        store = CandleStore(candle_store)
+
+        for client in clients.values():
+            client.market_data.store = store
+
+    # Updates processed by the main thread of the worker. The answers of the gateway are resolved by the receiving
+    # thread, so that a strategy waiting for its order never blocks the answer it waits for (which may arrive after
+    # the stop message, the thread runs until the end of the process)
+    updates = queue.Queue()
+
+    def receive():
+        while True:
+            message = events.get()
+
+            if message[0] == "response":
+                gateway.resolve(message[1], message[2])
+            else:
+                updates.put(message)
+
+    t = threading.Thread(target=receive, daemon=True)
+    t.start()
+
+    runner = HeadlessRunner(clients["Binance"], clients["Bitmex"], rows=rows)
+
+    # Activation (historical candles from the gateway) and bookkeeping
+    runner_thread = threading.Thread(target=runner.run, daemon=True)
+    runner_thread.start()
+
+    cpu = CpuMeter()
+    processed = 0
+    last_stats = time.time()
+
+    def send_stats():
+        requests.put(("stats", worker_id, processed, sum(len(c.strategies) for c in clients.values()), cpu.percent()))
+
+    while True:
+        if time.time() - last_stats >= WORKER_STATS_INTERVAL:
+            last_stats = time.time()
+            send_stats()
+
+        try:
+            message = updates.get(timeout=WORKER_STATS_INTERVAL)
+        except queue.Empty:
+            continue
+
+        kind = message[0]
+
+        if kind == "stop":
+            break
+
+        try:
+            if kind == "batch":
+                client = clients[message[1]]
+                hub = client.market_data
+
+                for update in message[2]:
+                    try:
+                        if update[0] == "trade":
+                            hub.on_trade(*update[1:])
+                        elif update[0] == "price":
+                            hub.on_price(*update[1:])
+                        elif update[0] == "kline":
+                            hub.on_kline(*update[1:])
+                        elif update[0] == "resync":
+                            threading.Thread(target=hub.resync, args=(update[1],), daemon=True).start()
+                    except Exception as e:
+                        logger.error("Error while processing the %s update: %s", update[0], e)
+            elif kind == "order_update":
+                clients[message[1]].on_order_update(message[2], message[3])
+            elif kind == "clock":
+                clients[message[1]].clock_offset = message[2]
+        except Exception as e:
+            logger.error("Error while processing the %s update: %s", kind, e)
+
+        processed += len(message[2]) if kind == "batch" else 1
+
+    runner.stop()
+    runner_thread.join(10)
+
+    if store is not None:
+        store.flush(timeout=5)
+
+    send_stats()
+
+
+if __name__ == '__main__':
+    # Throughput benchmark: synthetic trades on 40 symbols with a Technical and a Breakout strategy each, processed by
+    # 1, 2 and 4 workers. Each trade moves the time by 1 s, so the 1m candles close every 60 trades (indicators
+    # computed by the Technical strategies). No order is sent (the trade size of the synthetic gateway is None)
+    import json
+    import random
+
+    logging.basicConfig(level=logging.ERROR)
+
+    SYMBOLS = [f"SYM{i}USDT" for i in range(40)]
+    TRADES = 200000
+
+    class SyntheticClient:
+        history_timeframes = ["1m", "5m", "15m", "30m", "1h", "4h"]
+        kline_timeframes = []
+        clock_offset = 0
+        ws = None
+
+        def __init__(self):
+            self.contracts = {s: Contract({"symbol": s, "base_asset": s[:-4], "quote_asset": "USDT", "price_decimals": 2,
+                                           "quantity_decimals": 3, "tick_size": 0.01, "lot_size": 0.001,
+                                           "exchange": "binance"}, "cache") for s in SYMBOLS}
+            self.start = int(time.time() / 60) * 60000 - 1000 * 60000
+
+        def get_historical_candles(self, contract, timeframe, start_time=None):
+            price = 100
+            candles = []
+            for i in range(1000):
+                price *= 1 + random.gauss(0, 0.002)
+                candles.append(Candle([self.start + i * 60000, price, price * 1.001, price * 0.999, price, 10],
+                                      timeframe, "binance"))
+            return candles
+
+        def get_trade_size(self, *args):
+            return None
+
+        def __getattr__(self, name):
+            # Subscriptions
+            return lambda *args, **kwargs: None
+
+    extra = {"Technical": {"rsi_length": 14, "ema_fast": 12, "ema_slow": 26, "ema_signal": 9},
+             "Breakout": {"min_volume": 1e9}}
+    rows = []
+    for symbol in SYMBOLS:
+        for strategy_type in ["Technical", "Breakout"]:
+            rows.append((len(rows) + 1, {"strategy_type": strategy_type, "contract": f"{symbol}_Binance",
+                                         "timeframe": "1m", "balance_pct": 1, "take_profit": 1, "stop_loss": 1,
+                                         "extra_params": json.dumps(extra[strategy_type]), "exit_mode": "Local",
+                                         "candle_source": "Trades"}))
+
+    # The timestamps continue the synthetic history
+    start_ts = SyntheticClient().start + 1000 * 60000
+    trades = [(SYMBOLS[n % len(SYMBOLS)], 100 + random.random(), 1.0, start_ts + (n // len(SYMBOLS)) * 1000)
+              for n in range(TRADES)]
+
+    for workers in [w for w in [1, 2, 4] if w <= multiprocessing.cpu_count()]:
+        supervisor = Supervisor({"Binance": SyntheticClient(), "Bitmex": SyntheticClient()}, workers, rows)
+        supervisor.start()
+
+        # Wait for the strategies to start
+        while sum(s['strategies'] for s in supervisor.stats.values()) < len(rows):
+            time.sleep(0.1)
+
+        # The trades go through the router as they would from the websocket thread, one call per trade
+        router = supervisor._clients["Binance"].market_data
+
+        start = time.perf_counter()
+        for trade in trades:
+            router.on_trade(*trade)
+        feed_elapsed = time.perf_counter() - start
+
+        supervisor.stop(timeout=600)
+        elapsed = time.perf_counter() - start
+
+        processed = sum(s['events'] for s in supervisor.stats.values())
+        print(f"{workers} workers: {processed / elapsed:,.0f} trades/s ({processed} trades in {elapsed:.1f} s), "
+              f"{feed_elapsed / TRADES * 1e6:.1f} us per trade in the websocket thread")
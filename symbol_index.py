@@ -0,0 +1,230 @@
+# Prebuilt index of the symbols of every exchange, shared by the watchlist autocomplete and the strategy editor
+# Symbols are kept in a sorted list so that prefix searches are two binary searches instead of a scan of the whole list
+
+import bisect
+import heapq
+import re
+import time
+import typing
+
+from models import *
+
+
+class SymbolIndex:
+    def __init__(self):
+        # Parallel lists sorted by symbol (a symbol listed on two exchanges appears twice)
+        self._symbols: typing.List[str] = []
+        self._exchanges: typing.List[str] = []
+        self._contracts: typing.List[Contract] = []
+
+        # Number of exchanges indexed, a symbol appears at most once per exchange
+        self._exchange_count = 0
+
+        self._by_base: typing.Dict[str, typing.List[typing.Tuple[str, str]]] = dict()
+        self._by_quote: typing.Dict[str, typing.List[typing.Tuple[str, str]]] = dict()
+
+        # All the symbols joined by new lines, substring and fuzzy searches run on it with the C string functions
+        self._text = ""
+        self._line_starts: typing.List[int] = []
+
+        # Increased every time the index is rebuilt, lets the widgets know their cached results are outdated
+        self.version = 0
+
+    # Replace the contracts of an exchange (exchange is the name displayed in the UI, e.g. "Binance")
+    def set_contracts(self, exchange: str, contracts: typing.Dict[str, Contract]):
+        entries = [(s, e, c) for s, e, c in zip(self._symbols, self._exchanges, self._contracts) if e != exchange]
+        entries.extend((symbol, exchange, contract) for symbol, contract in contracts.items())
+        entries.sort(key=lambda entry: (entry[0], entry[1]))
+
+        self._symbols = [entry[0] for entry in entries]
+        self._exchanges = [entry[1] for entry in entries]
+        self._contracts = [entry[2] for entry in entries]
+        self._exchange_count = len(set(self._exchanges))
+
+        self._by_base = dict()
+        self._by_quote = dict()
+
+        for symbol, exch, contract in entries:
+            self._by_base.setdefault(contract.base_asset.upper(), []).append((symbol, exch))
+            self._by_quote.setdefault(contract.quote_asset.upper(), []).append((symbol, exch))
+
+        self._text = "\n".join(self._symbols)
+        self._line_starts = []
+
+        position = 0
+        for symbol in self._symbols:
+            self._line_starts.append(position)
+            position += len(symbol) + 1
+
+        self.version += 1
+
+    def __len__(self) -> int:
+        return len(self._symbols)
+
+    def contains(self, symbol: str, exchange: str) -> bool:
+        lo, hi = self.prefix_range(symbol)
+        return any(self._symbols[i] == symbol and self._exchanges[i] == exchange for i in range(lo, hi))
+
+    # Labels used by the strategy editor OptionMenu, e.g. "BTCUSDT_Binance"
+    def labels(self) -> typing.List[str]:
+        return [symbol + "_" + exchange for symbol, exchange in zip(self._symbols, self._exchanges)]
+
+    # Positions [lo, hi) of the symbols starting with the query. Passing the range of a shorter query narrows the
+    # search when the user keeps typing
+    def prefix_range(self, query: str, lo: int = 0, hi: typing.Optional[int] = None) -> typing.Tuple[int, int]:
+        if hi is None:
+            hi = len(self._symbols)
+
+        start = bisect.bisect_left(self._symbols, query, lo, hi)
+        end = bisect.bisect_left(self._symbols, query + "\uffff", start, hi)
+
+        return start, end
+
+    def prefix(self, query: str, exchange: typing.Optional[str] = None, limit: typing.Optional[int] = None,
+               lo: int = 0, hi: typing.Optional[int] = None) -> typing.List[str]:
+        start, end = self.prefix_range(query, lo, hi)
+        return self._collect(range(start, end), exchange, limit)
+
+    # Symbols containing the query anywhere, in alphabetical order. The scan stops once limit symbols are found
+    def substring(self, query: str, exchange: typing.Optional[str] = None,
+                  limit: typing.Optional[int] = None) -> typing.List[str]:
+        if query == "" or "\n" in query:
+            return []
+
+        results = []
+        last = -1
+        found = self._text.find(query)
+
+        while found != -1 and (limit is None or len(results) < limit):
+            i = bisect.bisect_right(self._line_starts, found) - 1
+            if i != last and (exchange is None or self._exchanges[i] == exchange):
+                results.append(self._symbols[i])
+            last = i
+            found = self._text.find(query, found + 1)
+
+        return results
+
+    # Symbols containing the characters of the query in the same order (e.g. "BTUS" matches "BTCUSDT"),
+    # the tightest matches first. Only the limit tightest matches are kept (heap), the others are not sorted
+    def fuzzy(self, query: str, exchange: typing.Optional[str] = None,
+              limit: typing.Optional[int] = None) -> typing.List[str]:
+        if query == "" or "\n" in query:
+            return []
+
+        pattern = re.compile("[^\n]*?".join(re.escape(char) for char in query))
+
+        matches = []
+        position = 0
+
+        # Matches as tight as possible (the query itself): once limit of them are found, the symbols after them can't
+        # be ranked before them and the scan stops
+        tightest = 0
+
+        while limit is None or tightest < limit:
+            match = pattern.search(self._text, position)
+            if match is None:
+                break
+
+            i = bisect.bisect_right(self._line_starts, match.start()) - 1
+            if exchange is None or self._exchanges[i] == exchange:
+                matches.append((match.end() - match.start(), i))
+
+                if match.end() - match.start() == len(query):
+                    tightest += 1
+
+            # Continue on the next symbol
+            position = self._line_starts[i] + len(self._symbols[i]) + 1
+
+        if limit is None:
+            matches.sort()
+        else:
+            matches = heapq.nsmallest(limit, matches)
+
+        return [self._symbols[i] for span, i in matches]
+
+    # Prefix matches first, then substring matches, then fuzzy matches, without duplicates. The prefix matches can be
+    # given when already known (see Autocomplete._match())
+    def search(self, query: str, exchange: typing.Optional[str] = None, limit: typing.Optional[int] = None,
+               prefix_matches: typing.Optional[typing.List[str]] = None) -> typing.List[str]:
+        results = self.prefix(query, exchange, limit) if prefix_matches is None else list(prefix_matches)
+
+        # The symbols found so far are also substring and fuzzy matches, and a symbol is listed once per exchange: the
+        # number of matches asked for covers the duplicates
+        copies = 1 if exchange is not None else self._exchange_count
+
+        for method in [self.substring, self.fuzzy]:
+            if limit is not None and len(results) >= limit:
+                break
+
+            seen = set(results)
+            for symbol in method(query, exchange, None if limit is None else (limit + len(results)) * copies):
+                if symbol not in seen:
+                    results.append(symbol)
+                    seen.add(symbol)
+                    if limit is not None and len(results) >= limit:
+                        break
+
+        return results
+
+    def by_base_asset(self, asset: str, exchange: typing.Optional[str] = None) -> typing.List[str]:
+        return [s for s, e in self._by_base.get(asset.upper(), []) if exchange is None or e == exchange]
+
+    def by_quote_asset(self, asset: str, exchange: typing.Optional[str] = None) -> typing.List[str]:
+        return [s for s, e in self._by_quote.get(asset.upper(), []) if exchange is None or e == exchange]
+
+    def _collect(self, positions: typing.Iterable[int], exchange: typing.Optional[str],
+                 limit: typing.Optional[int]) -> typing.List[str]:
+        results = []
+
+        for i in positions:
+            if exchange is None or self._exchanges[i] == exchange:
+                results.append(self._symbols[i])
+                if limit is not None and len(results) >= limit:
+                    break
+
+        return results
+
+
+# Keystroke filtering benchmark over a 10k symbols universe: python symbol_index.py
+if __name__ == '__main__':
+    import random
+    import string
+
+    random.seed(1)
+
+    class _BenchContract:
+        def __init__(self, symbol: str, base: str, quote: str):
+            self.symbol = symbol
+            self.base_asset = base
+            self.quote_asset = quote
+
+    universe = dict()
+    while len(universe) < 10000:
+        base = "".join(random.choice(string.ascii_uppercase) for _ in range(random.randint(2, 6)))
+        quote = random.choice(["USDT", "BUSD", "USD", "BTC"])
+        universe[base + quote] = _BenchContract(base + quote, base, quote)
+
+    index = SymbolIndex()
+
+    start = time.perf_counter()
+    index.set_contracts("Binance", universe)
+    print(f"Index built in {(time.perf_counter() - start) * 1000:.2f} ms for {len(index)} symbols")
+
+    queries = random.sample(list(universe.keys()), 200)
+
+    def bench(name: str, func: typing.Callable[[str], typing.List[str]]):
+        latencies = []
+        for symbol in queries:
+            for n in range(1, len(symbol) + 1):
+                t = time.perf_counter()
+                func(symbol[:n])
+                latencies.append(time.perf_counter() - t)
+        latencies.sort()
+        print(f"{name:<28} median {latencies[len(latencies) // 2] * 1e6:8.1f} us   "
+              f"p99 {latencies[int(len(latencies) * 0.99)] * 1e6:8.1f} us   ({len(latencies)} keystrokes)")
+
+    bench("linear startswith scan", lambda q: [s for s in index._symbols if s.startswith(q)])
+    bench("prefix (bisect)", lambda q: index.prefix(q))
+    bench("substring", lambda q: index.substring(q, limit=100))
+    bench("fuzzy", lambda q: index.fuzzy(q, limit=100))
+    bench("search (autocomplete)", lambda q: index.search(q, limit=100))
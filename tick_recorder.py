@@ -0,0 +1,360 @@
+# Archive of the raw ticks (trades and best bid/ask updates) received by the websocket threads, for tick-accurate
+# backtests of the take profit / stop loss checks
+# The websocket threads only append a tuple to a deque, a writer thread packs the ticks every FLUSH_INTERVAL seconds
+# into fixed-width records (32 bytes), compresses them (zlib) and appends the compressed block to the current segment
+# (one file per hour and exchange). Each segment has:
+#   <start>.ticks  the blocks: header (first and last timestamps, number of records, compressed size) + zlib data
+#   <start>.idx    one entry per block (offset, first and last timestamps, records), to read a period without
+#                  decompressing the other blocks
+#   <start>.sym    the symbol of each symbol id of the segment, one "id symbol" line per symbol
+# Every file is only appended to. The index is written after its block, a block missing from the index (program
+# stopped in between) is found again from the block headers
+
+import collections
+import logging
+import math
+import os
+import struct
+import threading
+import time
+import typing
+import zlib
+
+import numpy as np
+
+logger = logging.getLogger()
+
+TICKS_DIR = "ticks"
+
+# Seconds between two writes of the ticks received
+FLUSH_INTERVAL = 1.0
+
+# Duration of a segment, in milliseconds
+SEGMENT_MS = 3600 * 1000
+
+# zlib level: the writer thread must keep up with the websocket threads
+COMPRESSION_LEVEL = 1
+
+TRADE = 0
+BOOK = 1
+
+# Timestamp (exchange time, ms), symbol id, kind, then price and size for a trade, bid and ask (NaN if unknown) for a
+# book update
+RECORD = struct.Struct("<qHB5xdd")
+RECORD_DTYPE = np.dtype([("timestamp", "<i8"), ("symbol", "<u2"), ("kind", "u1"), ("padding", "V5"), ("a", "<f8"),
+                         ("b", "<f8")])
+
+BLOCK = struct.Struct("<4sIIqq")
+BLOCK_MAGIC = b"TICK"
+INDEX = struct.Struct("<qqqI")
+
+
+class TickRecorder:
+    def __init__(self, exchange: str, root: str = TICKS_DIR):
+        self.exchange = exchange
+        self._directory = os.path.join(root, exchange)
+        os.makedirs(self._directory, exist_ok=True)
+
+        # Filled by the websocket threads, emptied by the writer thread (deque appends and pops are thread-safe)
+        self._pending: typing.Deque[tuple] = collections.deque()
+        self._flush_events: typing.Deque[threading.Event] = collections.deque()
+        self._wake = threading.Event()
+
+        self._segment_end = 0
+        self._files: typing.Optional[typing.Tuple[typing.BinaryIO, typing.BinaryIO, typing.TextIO]] = None
+        self._symbol_ids: typing.Dict[str, int] = dict()
+
+        self.recorded = 0
+
+        t = threading.Thread(target=self._run, daemon=True)
+        t.start()
+
+    # Called by the websocket thread
+
+    def record_trade(self, symbol: str, price: float, size: float, timestamp: int):
+        self._pending.append((timestamp, symbol, TRADE, price, size))
+
+    def record_book(self, symbol: str, bid: typing.Optional[float], ask: typing.Optional[float], timestamp: int):
+        self._pending.append((timestamp, symbol, BOOK, math.nan if bid is None else bid,
+                              math.nan if ask is None else ask))
+
+    # Wait until the ticks received so far are written, returns False on timeout
+    def flush(self, timeout: typing.Optional[float] = None) -> bool:
+        event = threading.Event()
+        self._flush_events.append(event)
+        self._wake.set()
+        return event.wait(timeout)
+
+    # Writer thread
+
+    def _run(self):
+        while True:
+            self._wake.wait(FLUSH_INTERVAL)
+            self._wake.clear()
+
+            events = []
+            while len(self._flush_events) > 0:
+                events.append(self._flush_events.popleft())
+
+            try:
+                self._write_pending()
+            except OSError as e:
+                logger.error("%s tick recorder error: %s", self.exchange, e)
+                self._close_segment()
+
+            for event in events:
+                event.set()
+
+    def _write_pending(self):
+        count = len(self._pending)
+
+        if count == 0:
+            return
+
+        ticks = [self._pending.popleft() for _ in range(count)]
+
+        # The ticks of a batch go to the segment of the first one
+        if ticks[0][0] >= self._segment_end or self._files is None:
+            self._open_segment(ticks[0][0])
+
+        ticks_file, index_file, symbols_file = self._files
+
+        buffer = bytearray(RECORD.size * count)
+        first = last = ticks[0][0]
+
+        for i, (timestamp, symbol, kind, a, b) in enumerate(ticks):
+            symbol_id = self._symbol_ids.get(symbol)
+
+            # The symbols are written before the block using them
+            if symbol_id is None:
+                symbol_id = len(self._symbol_ids)
+                self._symbol_ids[symbol] = symbol_id
+                symbols_file.write(f"{symbol_id} {symbol}\n")
+
+            RECORD.pack_into(buffer, i * RECORD.size, timestamp, symbol_id, kind, a, b)
+
+            if timestamp < first:
+                first = timestamp
+            elif timestamp > last:
+                last = timestamp
+
+        symbols_file.flush()
+
+        data = zlib.compress(buffer, COMPRESSION_LEVEL)
+        offset = ticks_file.tell()
+
+        ticks_file.write(BLOCK.pack(BLOCK_MAGIC, len(data), count, first, last) + data)
+        ticks_file.flush()
+
+        index_file.write(INDEX.pack(offset, first, last, count))
+        index_file.flush()
+
+        self.recorded += count
+
+    def _open_segment(self, timestamp: int):
+        self._close_segment()
+
+        start = timestamp - timestamp % SEGMENT_MS
+        self._segment_end = start + SEGMENT_MS
+
+        # Named after the time it was opened, a new segment is started when the program restarts within the hour
+        base = os.path.join(self._directory, time.strftime("%Y%m%d-%H%M%S", time.gmtime(timestamp / 1000)))
+        name = base
+
+        # The symbol ids of an existing segment are not known, it is never appended to
+        number = 1
+        while os.path.exists(name + ".ticks"):
+            name = f"{base}-{number}"
+            number += 1
+
+        self._files = (open(name + ".ticks", "ab"), open(name + ".idx", "ab"), open(name + ".sym", "a"))
+        self._symbol_ids = dict()
+
+    def _close_segment(self):
+        if self._files is not None:
+            for f in self._files:
+                f.close()
+            self._files = None
+
+
+# Ticks of the segments of an exchange, read by blocks
+class TickReader:
+    def __init__(self, exchange: str, root: str = TICKS_DIR):
+        self._directory = os.path.join(root, exchange)
+
+    def segments(self) -> typing.List[str]:
+        if not os.path.isdir(self._directory):
+            return []
+
+        return sorted(os.path.join(self._directory, name[:-len(".ticks")]) for name in os.listdir(self._directory)
+                      if name.endswith(".ticks"))
+
+    # (offset, first timestamp, last timestamp, records) of each block of a segment
+    @staticmethod
+    def _blocks(segment: str) -> typing.List[typing.Tuple[int, int, int, int]]:
+        blocks = []
+
+        if os.path.exists(segment + ".idx"):
+            with open(segment + ".idx", "rb") as f:
+                index = f.read()
+            blocks = list(INDEX.iter_unpack(index[:len(index) - len(index) % INDEX.size]))
+
+        # Blocks written after the last index entry
+        size = os.path.getsize(segment + ".ticks")
+
+        with open(segment + ".ticks", "rb") as f:
+            if len(blocks) > 0:
+                f.seek(blocks[-1][0])
+                f.seek(BLOCK.unpack(f.read(BLOCK.size))[1], os.SEEK_CUR)
+
+            while f.tell() + BLOCK.size <= size:
+                offset = f.tell()
+                magic, length, count, first, last = BLOCK.unpack(f.read(BLOCK.size))
+
+                if magic != BLOCK_MAGIC or offset + BLOCK.size + length > size:
+                    break
+
+                blocks.append((offset, first, last, count))
+                f.seek(length, os.SEEK_CUR)
+
+        return blocks
+
+    @staticmethod
+    def _symbols(segment: str) -> typing.Dict[int, str]:
+        symbols = dict()
+
+        if os.path.exists(segment + ".sym"):
+            with open(segment + ".sym") as f:
+                for line in f:
+                    if line.endswith("\n"):
+                        symbol_id, symbol = line.split()
+                        symbols[int(symbol_id)] = symbol
+
+        return symbols
+
+    # Ticks of each symbol between start and end (exchange timestamps in milliseconds, included), in time order.
+    # Records fields: timestamp, kind (TRADE or BOOK), a (price or bid) and b (size or ask)
+    def read(self, symbols: typing.Optional[typing.List[str]] = None, start: typing.Optional[int] = None,
+             end: typing.Optional[int] = None) -> typing.Dict[str, np.ndarray]:
+        parts: typing.Dict[str, typing.List[np.ndarray]] = dict()
+
+        for segment in self.segments():
+            segment_symbols = self._symbols(segment)
+            wanted = {i: s for i, s in segment_symbols.items() if symbols is None or s in symbols}
+
+            if len(wanted) == 0:
+                continue
+
+            with open(segment + ".ticks", "rb") as f:
+                for offset, first, last, count in self._blocks(segment):
+                    if (start is not None and last < start) or (end is not None and first > end):
+                        continue
+
+                    f.seek(offset)
+                    length = BLOCK.unpack(f.read(BLOCK.size))[1]
+                    records = np.frombuffer(zlib.decompress(f.read(length)), dtype=RECORD_DTYPE)
+
+                    keep = np.isin(records["symbol"], list(wanted))
+                    if start is not None:
+                        keep &= records["timestamp"] >= start
+                    if end is not None:
+                        keep &= records["timestamp"] <= end
+
+                    records = records[keep]
+
+                    for symbol_id in np.unique(records["symbol"]):
+                        parts.setdefault(wanted[int(symbol_id)], []).append(records[records["symbol"] == symbol_id])
+
+        result = dict()
+
+        for symbol, symbol_parts in parts.items():
+            records = np.concatenate(symbol_parts)
+            result[symbol] = records[np.argsort(records["timestamp"], kind="stable")]
+
+        return result
+
+
+# First tick of the records of a symbol (TickReader.read()) that triggers the take profit or the stop loss of a trade
+# opened at entry_time, with the conditions of Strategy._check_tp_sl(): the trade prices for the strategies in "trades"
+# mode, the bid (long) or the ask (short) for the strategies in "klines" mode. take_profit and stop_loss are
+# percentages. Returns (timestamp, price, "take_profit" or "stop_loss"), None if neither is reached
+def tp_sl_exit(records: np.ndarray, entry_time: int, entry_price: float, side: str, take_profit: typing.Optional[float],
+               stop_loss: typing.Optional[float],
+               candle_source: str = "trades") -> typing.Optional[typing.Tuple[int, float, str]]:
+    if candle_source == "trades":
+        ticks = records[(records["kind"] == TRADE) & (records["timestamp"] >= entry_time)]
+        prices = ticks["a"]
+    else:
+        ticks = records[(records["kind"] == BOOK) & (records["timestamp"] >= entry_time)]
+        prices = ticks["a"] if side == "long" else ticks["b"]
+
+    direction = 1 if side == "long" else -1
+
+    with np.errstate(invalid="ignore"):
+        stop = np.zeros(len(ticks), dtype=bool) if stop_loss is None else \
+            direction * prices <= direction * entry_price * (1 - direction * stop_loss / 100)
+        take = np.zeros(len(ticks), dtype=bool) if take_profit is None else \
+            direction * prices >= direction * entry_price * (1 + direction * take_profit / 100)
+
+    triggered = stop | take
+
+    if not triggered.any():
+        return None
+
+    i = int(triggered.argmax())
+
+    return int(ticks["timestamp"][i]), float(prices[i]), "stop_loss" if stop[i] else "take_profit"
+
+
+if __name__ == '__main__':
+    # Throughput of the recorder (the websocket thread side and the writer thread), size of the archive and read speed
+    import shutil
+    import tempfile
+
+    root = tempfile.mkdtemp()
+
+    try:
+        recorder = TickRecorder("Binance", root)
+
+        symbols = [f"SYM{i}USDT" for i in range(50)]
+        n = 500000
+        rng = np.random.default_rng(0)
+        prices = (100 + np.cumsum(rng.normal(0, 0.01, n))).round(2).tolist()
+        sizes = rng.exponential(1, n).round(3).tolist()
+        start_ts = int(time.time() * 1000)
+
+        # Ticks received at 50k per second
+        start = time.perf_counter()
+        for i in range(n):
+            if i % 3 == 0:
+                recorder.record_book(symbols[i % 50], prices[i] - 0.01, prices[i] + 0.01, start_ts + i // 50)
+            else:
+                recorder.record_trade(symbols[i % 50], prices[i], sizes[i], start_ts + i // 50)
+        hot_path = time.perf_counter() - start
+
+        recorder.flush()
+        total = time.perf_counter() - start
+
+        size = sum(os.path.getsize(os.path.join(root, "Binance", f)) for f in os.listdir(os.path.join(root, "Binance")))
+
+        print(f"{n:,} ticks: {hot_path / n * 1e6:.2f} us per tick on the websocket thread, written in {total:.2f} s "
+              f"({n / total:,.0f} ticks/s), {size / n:.1f} bytes per tick on disk (records of {RECORD.size} bytes)")
+
+        reader = TickReader("Binance", root)
+
+        start = time.perf_counter()
+        ticks = reader.read()
+        elapsed = time.perf_counter() - start
+        print(f"Read {sum(len(t) for t in ticks.values()):,} ticks of {len(ticks)} symbols in {elapsed * 1000:.0f} ms")
+
+        start = time.perf_counter()
+        one = reader.read(["SYM7USDT"], start_ts + 2000, start_ts + 4000)
+        elapsed = time.perf_counter() - start
+        print(f"2 seconds of one symbol: {len(one['SYM7USDT'])} ticks in {elapsed * 1000:.1f} ms")
+
+        records = ticks["SYM7USDT"]
+        entry = records[records["kind"] == TRADE][10]
+        print("Long trade, 0.5% take profit / 0.5% stop loss:",
+              tp_sl_exit(records, int(entry["timestamp"]), float(entry["a"]), "long", 0.5, 0.5))
+    finally:
+        shutil.rmtree(root)
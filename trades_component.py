@@ -1,34 +1,84 @@
 import tkinter as tk
 import typing
 import datetime
+import time
 
 from models import *
+from database import trade_key
 
 from styling import *
-from scrollable_frame import ScrollableFrame
+
+# Seconds between two sorts of the table sorted by PNL: the PNL of the open trades changes at every price, the table is
+# not sorted again at every update
+PNL_SORT_INTERVAL = 10
+
 
 class TradesWatch(tk.Frame):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        # Reference the widgets on each row
-        self.body_widgets = dict()
+        # Trade store: every trade ever added, keyed by exchange and entry order id (database.trade_key())
+        self.trades: typing.Dict[typing.Tuple[str, str], Trade] = dict()
+
+        # Status of the trades when they were last sorted and filtered, a status change moves the trade in the view
+        self._statuses: typing.Dict[typing.Tuple[str, str], str] = dict()
+
+        # Trades matching the current filters, in the current sort order. Only a window of this list is displayed
+        self._view: typing.List[Trade] = []
+        self._view_dirty = False
+        self._view_time = 0.0
+        self._pnl_changed = False
 
         self._headers = ["time", "symbol", "exchange", "strategy", "side", "quantity", "status", "pnl"]
 
-        self._table_frame = tk.Frame(self, bg=BG_COLOR)
-        self._table_frame.pack(side=tk.TOP)
+        # Number of rows materialized as widgets, whatever the number of trades
+        self._visible_rows = 12
+        self._offset = 0
+
+        self._sort_key = "time"
+        self._sort_reverse = True
+
+        # Filter values, "All" means the column is not filtered
+        self._filter_columns = ["strategy", "symbol", "status"]
+        self._filter_vars = dict()
+        self._filter_menus = dict()
+        self._filter_values = dict()
 
         self._col_width = 11
 
+        # Create frame for the filters
+        self._filters_frame = tk.Frame(self, bg=BG_COLOR)
+        self._filters_frame.pack(side=tk.TOP, anchor="nw")
+
+        for idx, f in enumerate(self._filter_columns):
+            label = tk.Label(self._filters_frame, text=f.capitalize(), bg=BG_COLOR, fg=FG_COLOR, font=GLOBAL_FONT)
+            label.grid(row=0, column=idx * 2)
+
+            self._filter_values[f] = ["All"]
+            self._filter_vars[f] = tk.StringVar()
+            self._filter_vars[f].set("All")
+            self._filter_vars[f].trace("w", self._filters_changed)
+
+            self._filter_menus[f] = tk.OptionMenu(self._filters_frame, self._filter_vars[f], "All")
+            self._filter_menus[f].config(width=self._col_width, bd=-1, indicatoron=0, highlightthickness=False,
+                                         font=GLOBAL_FONT)
+            self._filter_menus[f].grid(row=0, column=idx * 2 + 1, padx=2)
+
+        self._table_frame = tk.Frame(self, bg=BG_COLOR)
+        self._table_frame.pack(side=tk.TOP)
+
         # Create frame for headers
         self._headers_frame = tk.Frame(self._table_frame, bg=BG_COLOR)
 
-        # Loop through headers to create widgets dynamically
+        # Loop through headers to create widgets dynamically. Clicking on a header sorts the table by that column
+        self._header_labels = dict()
+
         for idx, h in enumerate(self._headers):
             header = tk.Label(self._headers_frame, text=h.capitalize(), bg=BG_COLOR, fg=FG_COLOR,
-                              font=GLOBAL_FONT, width=self._col_width)
+                              font=GLOBAL_FONT, width=self._col_width, cursor="hand2")
+            header.bind("<Button-1>", lambda e, column=h: self._sort_by(column))
             header.grid(row=0, column=idx)
+            self._header_labels[h] = header
 
         header = tk.Label(self._headers_frame, text="", bg=BG_COLOR, fg=FG_COLOR,
                           font=GLOBAL_FONT, width=2)
@@ -36,73 +86,187 @@ class TradesWatch(tk.Frame):
 
         self._headers_frame.pack(side=tk.TOP, anchor="nw")
 
-        self._body_frame = ScrollableFrame(self, bg=BG_COLOR, height=250)
+        self._body_frame = tk.Frame(self._table_frame, bg=BG_COLOR)
         self._body_frame.pack(side=tk.TOP, anchor="nw", fill=tk.X)
 
-        # Creates keys of the dictionary in the loop so that self.headers can be reused
+        # Reference the widgets on each displayed row: body_widgets[column][row] and body_widgets[column + "_var"][row]
+        self.body_widgets = dict()
+
         for h in self._headers:
             self.body_widgets[h] = dict()
-            if h in ["status", "pnl", "quantity"]:
-                self.body_widgets[h + "_var"] = dict()
+            self.body_widgets[h + "_var"] = dict()
+
+        # Text currently displayed in each cell, so that Tk is only called for cells whose content changed
+        self._displayed = dict()
 
-        # Now starts at 0 since there is a dedicated frame for the body and there is no need to reserve the first row
-        # to the headers
-        self._body_index = 0
+        for row in range(self._visible_rows):
+            for col, h in enumerate(self._headers):
+                self.body_widgets[h + "_var"][row] = tk.StringVar()
+                self.body_widgets[h][row] = tk.Label(self._body_frame, textvariable=self.body_widgets[h + "_var"][row],
+                                                     bg=BG_COLOR, fg=FG_COLOR_2, font=GLOBAL_FONT,
+                                                     width=self._col_width)
+                self.body_widgets[h][row].grid(row=row, column=col)
+                self.body_widgets[h][row].bind("<MouseWheel>", self._on_mousewheel)
+                self._displayed[(h, row)] = ""
 
-    # Used by _update_ui method in root_component class, adds a new trade row
+        self._scrollbar = tk.Scrollbar(self._body_frame, orient=tk.VERTICAL, command=self._on_scroll)
+        self._scrollbar.grid(row=0, column=len(self._headers), rowspan=self._visible_rows, sticky="ns")
+
+        self._body_frame.bind("<MouseWheel>", self._on_mousewheel)
+
+    # Adds a new trade to the store (trades of the strategies, or trades of the previous sessions loaded from the
+    # database). Nothing is drawn until refresh()
     def add_trade(self, trade: Trade):
+        key = trade_key(trade)
+
+        self.trades[key] = trade
+        self._statuses[key] = trade.status
+        self._add_filter_values(trade)
+
+        self._view_dirty = True
+
+    # Used by _update_ui method in root_component class with the trades added or modified by the strategies since the
+    # last update. The view is only rebuilt when the rows can move: a new trade, a status change, or a PNL change when
+    # sorted by PNL (at most every PNL_SORT_INTERVAL)
+    def update_trades(self, trades: typing.List[Trade]):
+        for trade in trades:
+            key = trade_key(trade)
+
+            if key not in self.trades:
+                self.add_trade(trade)
+            elif trade.status != self._statuses[key]:
+                self._statuses[key] = trade.status
+                self._add_filter_values(trade)
+                self._view_dirty = True
+            else:
+                self._pnl_changed = True
+
+    def _add_filter_values(self, trade: Trade):
+        for f in self._filter_columns:
+            value = self._column_value(trade, f)
+            if value not in self._filter_values[f]:
+                self._filter_values[f].append(value)
+                self._filter_menus[f]["menu"].add_command(label=value, command=tk._setit(self._filter_vars[f], value))
+
+    # Called periodically by the root component: rebuilds the filtered/sorted view if needed and redraws visible rows
+    def refresh(self):
+        if self._sort_key == "pnl" and self._pnl_changed and time.monotonic() - self._view_time >= PNL_SORT_INTERVAL:
+            self._view_dirty = True
+
+        if self._view_dirty:
+            self._build_view()
+
+        self._draw()
+
+    # Value of a column for a trade, as used for filtering and sorting
+    def _column_value(self, trade: Trade, column: str):
+        if column == "symbol":
+            return trade.contract.symbol
+        elif column == "exchange":
+            return trade.contract.exchange.capitalize()
+        elif column in ["side", "status"]:
+            return getattr(trade, column).capitalize()
+        else:
+            return getattr(trade, column)
+
+    def _build_view(self):
+        filters = dict()
+
+        for f in self._filter_columns:
+            value = self._filter_vars[f].get()
+            if value != "All":
+                filters[f] = value
+
+        if len(filters) > 0:
+            view = [trade for trade in self.trades.values()
+                    if all(self._column_value(trade, f) == value for f, value in filters.items())]
+        else:
+            view = list(self.trades.values())
+
+        # None values (pnl or quantity not known yet) are sorted as the lowest ones
+        view.sort(key=lambda trade: self._sort_value(trade), reverse=self._sort_reverse)
+
+        self._view = view
+        self._view_dirty = False
+        self._view_time = time.monotonic()
+        self._pnl_changed = False
+
+        self._offset = max(0, min(self._offset, len(self._view) - self._visible_rows))
+
+    def _sort_value(self, trade: Trade):
+        value = self._column_value(trade, self._sort_key)
+
+        if value is None:
+            return 0, 0
+
+        return 1, value
 
-        b_index = self._body_index
+    # Update the cells of the materialized rows with the trades at the current scroll position
+    def _draw(self):
+        for row in range(self._visible_rows):
+            index = self._offset + row
 
-        t_index = trade.time
+            if index < len(self._view):
+                trade = self._view[index]
 
-        dt_str = datetime.datetime.fromtimestamp(trade.time / 1000).strftime("%b %d %H:%M")
+                if trade.contract.exchange == "binance":
+                    precision = trade.contract.price_decimals
+                else:
+                    precision = 8  # Always in bitcoin
 
-        # Labels and string variables
-        self.body_widgets['time'][t_index] = tk.Label(self._body_frame.sub_frame, text=dt_str, bg=BG_COLOR,
-                                                      fg=FG_COLOR_2, font =GLOBAL_FONT, width=self._col_width)
-        self.body_widgets['time'][t_index].grid(row=b_index, column=0)
+                values = {
+                    "time": datetime.datetime.fromtimestamp(trade.time / 1000).strftime("%b %d %H:%M"),
+                    "symbol": trade.contract.symbol,
+                    "exchange": trade.contract.exchange.capitalize(),
+                    "strategy": trade.strategy,
+                    "side": trade.side.capitalize(),
+                    "quantity": str(trade.quantity),
+                    "status": trade.status.capitalize(),
+                    "pnl": "{0:.{prec}f}".format(trade.pnl, prec=precision),
+                }
+            else:
+                values = dict.fromkeys(self._headers, "")
 
-        # Symbol
-        self.body_widgets['symbol'][t_index] = tk.Label(self._body_frame.sub_frame, text=trade.contract.symbol,
-                                                        bg=BG_COLOR, fg=FG_COLOR_2, font=GLOBAL_FONT,
-                                                        width=self._col_width)
-        self.body_widgets['symbol'][t_index].grid(row=b_index, column=1)
+            for h in self._headers:
+                if self._displayed[(h, row)] != values[h]:
+                    self.body_widgets[h + "_var"][row].set(values[h])
+                    self._displayed[(h, row)] = values[h]
 
-        # Exchange
-        self.body_widgets['exchange'][t_index] = tk.Label(self._body_frame.sub_frame,
-                                                text=trade.contract.exchange.capitalize(), bg=BG_COLOR,
-                                                fg=FG_COLOR_2, font=GLOBAL_FONT, width=self._col_width)
-        self.body_widgets['exchange'][t_index].grid(row=b_index, column=2)
+        if len(self._view) > 0:
+            first = self._offset / len(self._view)
+            last = min(1.0, (self._offset + self._visible_rows) / len(self._view))
+        else:
+            first, last = 0.0, 1.0
 
-        # Strategy
-        self.body_widgets['strategy'][t_index] = tk.Label(self._body_frame.sub_frame, text=trade.strategy, bg=BG_COLOR,
-                                                          fg=FG_COLOR_2, font=GLOBAL_FONT, width=self._col_width)
-        self.body_widgets['strategy'][t_index].grid(row=b_index, column=3)
+        self._scrollbar.set(first, last)
 
-        # Side
-        self.body_widgets['side'][t_index] = tk.Label(self._body_frame.sub_frame, text=trade.side.capitalize(),
-                                                      bg=BG_COLOR, fg=FG_COLOR_2, font=GLOBAL_FONT, width=self._col_width)
-        self.body_widgets['side'][t_index].grid(row=b_index, column=4)
+    def _scroll_to(self, offset: int):
+        self._offset = max(0, min(offset, len(self._view) - self._visible_rows))
+        self._draw()
 
-        # Quantity
-        self.body_widgets['quantity'][t_index] = tk.Label(self._body_frame.sub_frame, text=trade.quantity, bg=BG_COLOR,
-                                                      fg=FG_COLOR_2, font=GLOBAL_FONT, width=self._col_width)
-        self.body_widgets['quantity'][t_index].grid(row=b_index, column=5)
+    # Called by the scrollbar with ("moveto", fraction) or ("scroll", number, "units"/"pages")
+    def _on_scroll(self, *args):
+        if args[0] == "moveto":
+            self._scroll_to(int(float(args[1]) * len(self._view)))
+        elif args[0] == "scroll":
+            step = self._visible_rows if args[2] == "pages" else 1
+            self._scroll_to(self._offset + int(args[1]) * step)
 
-        # Status
-        self.body_widgets['status_var'][t_index] = tk.StringVar()
-        self.body_widgets['status'][t_index] = tk.Label(self._body_frame.sub_frame,
-                                                    textvariable=self.body_widgets['status_var'][t_index], bg=BG_COLOR,
-                                                    fg=FG_COLOR_2, font=GLOBAL_FONT, width=self._col_width)
-        self.body_widgets['status'][t_index].grid(row=b_index, column=6)
+    def _on_mousewheel(self, event: tk.Event):
+        self._scroll_to(self._offset - int(event.delta))
 
-        # PNL
-        self.body_widgets['pnl_var'][t_index] = tk.StringVar()
-        self.body_widgets['pnl'][t_index] = tk.Label(self._body_frame.sub_frame,
-                                                     textvariable=self.body_widgets['pnl_var'][t_index], bg=BG_COLOR,
-                                                      fg=FG_COLOR_2, font=GLOBAL_FONT, width=self._col_width)
-        self.body_widgets['pnl'][t_index].grid(row=b_index, column=7)
+    # Clicking twice on the same header reverses the order
+    def _sort_by(self, column: str):
+        if column == self._sort_key:
+            self._sort_reverse = not self._sort_reverse
+        else:
+            self._sort_key = column
+            self._sort_reverse = False
 
-        self._body_index += 1
+        self._build_view()
+        self._draw()
 
+    def _filters_changed(self, var_name: str, index: str, mode: str):
+        self._offset = 0
+        self._build_view()
+        self._draw()
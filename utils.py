@@ -1,3 +1,6 @@
+import time
+
+
 # Checks if text is a positive integer
 def check_integer_format(text: str):
     if text == "":
@@ -29,3 +32,20 @@ def check_float_format(text: str):
     else:
         return False
 
+
+# Average CPU use of the process (all threads) since the last reset, in percent of one core
+class CpuMeter:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+    def percent(self) -> float:
+        wall = time.perf_counter() - self._wall_start
+
+        if wall <= 0:
+            return 0
+
+        return (time.process_time() - self._cpu_start) / wall * 100
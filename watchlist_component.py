@@ -9,18 +9,28 @@ from models import *
 from styling import *
 
 from autocomplete_widget import Autocomplete
+from symbol_index import SymbolIndex
 from scrollable_frame import ScrollableFrame
 from database import WorkspaceData
+from scanner import ScanCandidate, MAX_CANDIDATES
+
+if typing.TYPE_CHECKING:
+    from bitmex import BitmexClient
+    from binance_futures import BinanceFuturesClient
 
 
 class Watchlist (tk.Frame):
-    def __init__(self, binance_contracts: typing.Dict[str, Contract], bitmex_contracts: typing.Dict[str, Contract], *args, **kwargs):
+    def __init__(self, binance: "BinanceFuturesClient", bitmex: "BitmexClient", symbol_index: SymbolIndex,
+                 *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.db = WorkspaceData()
 
-        self.binance_symbols = list(binance_contracts.keys())
-        self.bitmex_symbols = list(bitmex_contracts.keys())
+        # The prices of a symbol are only streamed by the exchange while it is in the watchlist (or traded)
+        self._exchanges = {"Binance": binance, "Bitmex": bitmex}
+
+        # Index of the symbols of both exchanges, shared with the strategy editor
+        self._symbol_index = symbol_index
 
         self._commands_frame = tk.Frame(self, bg=BG_COLOR)
         self._commands_frame.pack(side=tk.TOP)
@@ -32,7 +42,7 @@ class Watchlist (tk.Frame):
         self._binance_label.grid(row=0, column=0)
 
         # insertbackground is the colour of the cursor when placed onto the entry widget
-        self._binance_entry = Autocomplete(self.binance_symbols, self._commands_frame, fg=FG_COLOR, justify=tk.CENTER, insertbackground=FG_COLOR,
+        self._binance_entry = Autocomplete(self._symbol_index, "Binance", self._commands_frame, fg=FG_COLOR, justify=tk.CENTER, insertbackground=FG_COLOR,
                                        bg=BG_COLOR_2, highlightthickness=False)
         # Associate keyboard action to a callback function
         self._binance_entry.bind("<Return>", self._add_binance_symbol)
@@ -41,7 +51,7 @@ class Watchlist (tk.Frame):
         self._bitmex_label = tk.Label(self._commands_frame, text="Bitmex", bg=BG_COLOR, fg=FG_COLOR, font=BOLD_FONT)
         self._bitmex_label.grid(row=0, column=1)
 
-        self._bitmex_entry = Autocomplete(self.bitmex_symbols, self._commands_frame, fg=FG_COLOR, justify=tk.CENTER, insertbackground=FG_COLOR,
+        self._bitmex_entry = Autocomplete(self._symbol_index, "Bitmex", self._commands_frame, fg=FG_COLOR, justify=tk.CENTER, insertbackground=FG_COLOR,
                                       bg=BG_COLOR_2, highlightthickness=False)
         self._bitmex_entry.bind("<Return>", self._add_bitmex_symbol)
         self._bitmex_entry.grid(row=1, column=1)
@@ -80,13 +90,63 @@ class Watchlist (tk.Frame):
 
         self._body_index = 0
 
+        # Symbols with a signal at the last candle close, ranked by the scanners. A click adds the symbol to the
+        # watchlist
+        self._candidates_frame = tk.Frame(self, bg=BG_COLOR)
+        self._candidates_frame.pack(side=tk.TOP, anchor="nw")
+
+        self._candidates_label = tk.Label(self._candidates_frame, text="Scanner", bg=BG_COLOR, fg=FG_COLOR,
+                                          font=BOLD_FONT)
+        self._candidates_label.grid(row=0, column=0, sticky="w")
+
+        self._candidates: typing.List[ScanCandidate] = []
+        self._candidate_vars: typing.List[tk.StringVar] = []
+
+        for i in range(MAX_CANDIDATES):
+            var = tk.StringVar()
+            label = tk.Label(self._candidates_frame, textvariable=var, bg=BG_COLOR, fg=FG_COLOR_2, font=GLOBAL_FONT,
+                             anchor="w", width=self._col_width * 4)
+            label.bind("<Button-1>", lambda event, i=i: self._add_candidate(i))
+            label.grid(row=i + 1, column=0, sticky="w")
+            self._candidate_vars.append(var)
+
         # Load data from databa
         saved_symbols = self.db.get("watchlist")
 
         for s in saved_symbols:
             self._add_symbol(s['symbol'], s['exchange'])
 
+    # Display the candidates of the scanners, best first
+    def update_candidates(self, candidates: typing.List[ScanCandidate]):
+        self._candidates = candidates[:MAX_CANDIDATES]
+
+        for i, var in enumerate(self._candidate_vars):
+            if i < len(self._candidates):
+                c = self._candidates[i]
+                var.set(f"{c.symbol} ({c.exchange})  {c.signal} {'long' if c.direction == 1 else 'short'}  "
+                        f"volume x{c.relative_volume:.1f}")
+            else:
+                var.set("")
+
+    def _add_candidate(self, i: int):
+        if i >= len(self._candidates):
+            return
+
+        candidate = self._candidates[i]
+
+        for b_index, label in self.body_widgets['symbol'].items():
+            if label.cget("text") == candidate.symbol and \
+                    self.body_widgets['exchange'][b_index].cget("text") == candidate.exchange:
+                return
+
+        self._add_symbol(candidate.symbol, candidate.exchange)
+
     def _remove_symbol(self, b_index: int):
+        symbol = self.body_widgets['symbol'][b_index].cget("text")
+        exchange = self.body_widgets['exchange'][b_index].cget("text")
+
+        self._exchanges[exchange].unsubscribe_prices(symbol)
+
         # Loops through columns, selects row to delete, and removes the cells
         for h in self._headers:
             self.body_widgets[h][b_index].grid_forget()
@@ -96,20 +156,22 @@ class Watchlist (tk.Frame):
          # Get entry box content
         symbol = event.widget.get()
 
-        if symbol in self.binance_symbols:
+        if self._symbol_index.contains(symbol, "Binance"):
             self._add_symbol(symbol, "Binance")
             event.widget.delete(0, tk.END)
 
     def _add_bitmex_symbol(self, event):
         symbol = event.widget.get()
 
-        if symbol in self.bitmex_symbols:
+        if self._symbol_index.contains(symbol, "Bitmex"):
             self._add_symbol(symbol, "Bitmex")
             event.widget.delete(0, tk.END)
 
     def _add_symbol(self, symbol: str, exchange: str):
         b_index = self._body_index
 
+        self._exchanges[exchange].subscribe_prices(symbol)
+
         # Creates 4 variables
         self.body_widgets['symbol'][b_index] = tk.Label(self._body_frame.sub_frame, text=symbol, bg=BG_COLOR,
                                                         fg=FG_COLOR_2,font=GLOBAL_FONT, width=self._col_width)